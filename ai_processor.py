@@ -7,9 +7,297 @@ AI处理器
 
 import openai
 import os
+import json
 from dotenv import load_dotenv
 import time
 import re
+import math
+import random
+import threading
+import heapq
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from response_cache import ResponseCache
+from endpoint_pool import Endpoint, EndpointPool, load_endpoint_configs
+from prompt_template import compile_template
+from column_dag import get_column_dependencies, get_column_depths, find_cycle, format_cycle, topological_order
+from cell_fingerprint import fingerprint_prompts
+
+# 响应缓存文件名（位于项目目录下）
+CACHE_FILE_NAME = ".aie_cache.sqlite"
+
+# 模型单次回复的输出token上限，未列出的模型按DEFAULT_OUTPUT_LIMIT，可用 AI_MAX_OUTPUT_TOKENS_<模型> 覆盖
+MODEL_OUTPUT_LIMITS = {
+    "gpt-4.1": 32768,
+    "gpt-4.1-mini": 32768,
+    "gpt-4.1-nano": 32768,
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+    "o1": 100000
+}
+DEFAULT_OUTPUT_LIMIT = 16384
+
+# 中日韩字符：大致每个字符对应一个token
+CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """
+    估算文本的token数（无需分词器的近似算法）
+    中日韩字符按1个token/字计，其余字符按4个字符/token计，另加消息格式开销
+    """
+    text = str(text) if text is not None else ""
+    cjk_count = len(CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + math.ceil(other_count / 4) + 4
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充"""
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.tokens = self.capacity
+        self.refill_rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        
+    def refill(self):
+        """按流逝时间补充令牌"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        
+    def wait_time(self, amount):
+        """返回获取amount个令牌需要等待的秒数（超过容量的请求按满桶计）"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_rate
+        
+    def consume(self, amount):
+        """扣除令牌，允许为负以记录超额使用"""
+        self.tokens -= amount
+
+class RateLimiter:
+    """
+    按模型区分的RPM/TPM限速器
+    limits格式: {model: {"rpm": 每分钟请求数, "tpm": 每分钟token数}}，0表示不限制
+    """
+    def __init__(self, limits=None, default_limits=None):
+        self.limits = limits or {}
+        self.default_limits = default_limits or {"rpm": 0, "tpm": 0}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        
+    def get_buckets(self, model):
+        """获取（必要时创建）模型对应的RPM和TPM令牌桶"""
+        if model not in self.buckets:
+            config = self.limits.get(model, self.default_limits)
+            rpm = config.get("rpm", 0)
+            tpm = config.get("tpm", 0)
+            self.buckets[model] = (
+                TokenBucket(rpm) if rpm > 0 else None,
+                TokenBucket(tpm) if tpm > 0 else None
+            )
+        return self.buckets[model]
+        
+    def acquire(self, model, tokens):
+        """阻塞直到该模型同时有1个请求额度和tokens个token额度，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                rpm_bucket, tpm_bucket = self.get_buckets(model)
+                wait = 0.0
+                if rpm_bucket:
+                    wait = max(wait, rpm_bucket.wait_time(1))
+                if tpm_bucket:
+                    wait = max(wait, tpm_bucket.wait_time(tokens))
+                if wait <= 0:
+                    if rpm_bucket:
+                        rpm_bucket.consume(1)
+                    if tpm_bucket:
+                        tpm_bucket.consume(tokens)
+                    return waited
+            time.sleep(wait)
+            waited += wait
+            
+    def settle(self, model, estimated_tokens, actual_tokens):
+        """请求完成后用实际用量修正预扣的token（多退少补）"""
+        with self.lock:
+            _, tpm_bucket = self.get_buckets(model)
+            if tpm_bucket:
+                tpm_bucket.refill()
+                tpm_bucket.consume(actual_tokens - estimated_tokens)
+
+# 可重试的HTTP状态码：请求超时、冲突、限流和服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class AIAPIError(Exception):
+    """AI API调用失败，保留HTTP状态码、服务端要求的重试等待时间和是否可重试"""
+    def __init__(self, message, status_code=None, retry_after=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.retryable = retryable
+        self.attempts = 1
+        
+    @property
+    def is_overload(self):
+        """是否为限流(429)或服务端过载(5xx)错误"""
+        return self.status_code is not None and (self.status_code == 429 or self.status_code >= 500)
+
+def is_overload_error(error):
+    """判断请求失败是否说明端点过载（限流、5xx或超时），需要减小该端点的并发"""
+    if isinstance(error, (openai.APITimeoutError, TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+def is_retryable_error(error):
+    """判断异常是否为瞬时错误（超时、连接中断、限流、5xx），认证/参数/额度耗尽等为永久错误"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        # 429中的额度耗尽不会因等待而恢复
+        if getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+def is_endpoint_failure(error):
+    """判断失败是否说明端点本身不可用（瞬时错误、认证失败、额度耗尽、模型不存在），参数错误等不计入"""
+    if is_retryable_error(error):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (401, 403, 404) or getattr(error, "code", None) == "insufficient_quota"
+    return False
+
+def parse_retry_after(response):
+    """从响应头解析Retry-After（支持retry-after-ms、秒数和HTTP日期），返回秒数或None"""
+    if response is None:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            retry_at = parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+    except Exception:
+        return None
+
+class AdaptiveConcurrency:
+    """
+    AIMD自适应并发控制器（每个端点一个，一个端点限流不影响其他端点）
+    成功时加性增加并发上限（约每轮往返+1），遇到429/5xx/超时或延迟持续明显升高时乘性减小，
+    并在Retry-After指定的时间内暂停发出新请求
+    延迟以短期平均与缓慢跟随的长期基线比较，LLM延迟的正常波动不会被当作拥塞
+    """
+    # 短期平均和长期基线的平滑系数；拥塞期间基线跟随得更慢，延迟持续升高时不会被基线吸收
+    SHORT_ALPHA = 0.2
+    BASELINE_ALPHA = 0.02
+    CONGESTED_BASELINE_ALPHA = 0.002
+    
+    def __init__(self, initial_limit, max_limit, min_limit=1, decrease_factor=0.5, latency_tolerance=2.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(max(self.min_limit, min(initial_limit, self.max_limit)))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.baseline_latency = None
+        self.avg_latency = None
+        self.congested_samples = 0  # 超过基线容忍倍数的成功请求计数（低于阈值时递减）
+        self.condition = threading.Condition()
+        
+    def acquire(self):
+        """阻塞直到在途请求数低于当前上限且不在暂停期内"""
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+                
+    def has_capacity(self, now=None):
+        """是否可以立即发出新请求：不在暂停期且在途请求数低于上限（调用方持有condition）"""
+        return (now or time.monotonic()) >= self.paused_until and self.in_flight < int(self.limit)
+        
+    def release(self):
+        """释放一个在途请求名额"""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+            
+    def on_success(self, latency):
+        """请求成功：记录延迟，延迟正常时加性增加，持续一轮往返明显高于基线时视为拥塞"""
+        with self.condition:
+            if self.avg_latency is None:
+                self.avg_latency = self.baseline_latency = latency
+            else:
+                alpha = self.CONGESTED_BASELINE_ALPHA if self.congested_samples else self.BASELINE_ALPHA
+                self.avg_latency += self.SHORT_ALPHA * (latency - self.avg_latency)
+                self.baseline_latency += alpha * (latency - self.baseline_latency)
+            if self.baseline_latency > 0 and self.avg_latency > self.baseline_latency * self.latency_tolerance:
+                self.congested_samples += 1
+                if self.congested_samples >= max(1, int(self.limit)):
+                    # 排队延迟持续升高，温和回退
+                    self._decrease(0.9)
+                    self.congested_samples = 0
+            else:
+                # 偶尔低于阈值的样本只抵消一次计数，噪声不会打断持续的延迟升高
+                self.congested_samples = max(0, self.congested_samples - 1)
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+            
+    def on_overload(self, retry_after=None):
+        """遇到限流、过载或超时：乘性减小并发上限，按Retry-After暂停新请求"""
+        with self.condition:
+            self._decrease(self.decrease_factor)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.condition.notify_all()
+            
+    def _decrease(self, factor):
+        """乘性减小上限，同一轮往返内的多次信号只生效一次"""
+        now = time.monotonic()
+        cooldown = self.avg_latency or 1.0
+        if now - self.last_decrease < cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        
+    def current_limit(self):
+        """当前允许的在途请求数"""
+        return int(self.limit)
+
+class RetryPolicy:
+    """带上限的指数退避重试策略（全抖动），每个任务最多重试max_retries次"""
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+    def get_delay(self, error, attempt):
+        """返回第attempt次尝试失败后的等待秒数，不应再重试时返回None"""
+        if not getattr(error, "retryable", False) or attempt > self.max_retries:
+            return None
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(0, backoff)
+        # 服务端给出Retry-After时至少等待该时长
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
 
 class AIProcessor:
     def __init__(self):
@@ -27,21 +315,189 @@ class AIProcessor:
         print(f"Model: {model}")
         
         # 配置OpenAI客户端
-        self.client = openai.OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+        # 重试由RetryPolicy统一处理，关闭SDK内置重试避免重复
+        self.client_options = {"max_retries": 0}
+        if os.getenv('AI_TIMEOUT'):
+            self.client_options["timeout"] = float(os.getenv('AI_TIMEOUT'))
+            
+        # 多端点：AI_ENDPOINTS配置多个Key/网关时只使用这些端点，否则使用上面的单个Key
+        self.endpoint_configs = load_endpoint_configs(os.getenv('AI_ENDPOINTS'))
+        self.client = None
+        if not self.endpoint_configs:
+            self.client = openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                **self.client_options
+            )
         
         self.model = model
         
-    def process_single_cell(self, dataframe, row_index, column_name, prompt_template, model=None):
-        """处理单个单元格"""
-        try:
-            # 获取行数据
-            row_data = dataframe.iloc[row_index].to_dict()
+        # 并发配置：每个端点同时在途的最大请求数，总并发上限随端点数增加
+        self.endpoint_concurrency = max(1, int(os.getenv('AI_MAX_CONCURRENCY', '8')))
+        self.initial_concurrency = int(os.getenv('AI_INITIAL_CONCURRENCY', max(1, self.endpoint_concurrency // 2)))
+        self.latency_tolerance = float(os.getenv('AI_LATENCY_TOLERANCE', '2.0'))
+        
+        # 重试策略：MAX_RETRIES为每个任务的重试预算
+        self.retry_policy = RetryPolicy(
+            max_retries=int(os.getenv('MAX_RETRIES', '3')),
+            base_delay=float(os.getenv('AI_RETRY_BASE_DELAY', '1.0')),
+            max_delay=float(os.getenv('AI_RETRY_MAX_DELAY', '30.0'))
+        )
+        
+        # 响应缓存：AI_CACHE=0关闭；AI_CACHE_BYPASS=1时不读缓存但仍写入新结果
+        self.cache = None
+        self.cache_enabled = os.getenv('AI_CACHE', '1') != '0'
+        self.cache_bypass = os.getenv('AI_CACHE_BYPASS', '0') == '1'
+        self.cache_max_bytes = int(float(os.getenv('AI_CACHE_SIZE_MB', '200')) * 1024 * 1024)
+        self.open_cache(os.getenv('AI_CACHE_DIR', os.getcwd()))
+        
+        # 最近一次批量处理的请求统计
+        self.last_batch_stats = {"tasks": 0, "requests": 0, "saved_requests": 0}
+        
+        # 结果日志：由项目管理器设置，每个成功的单元格结果立即追加
+        self.journal = None
+        
+        # 单元格指纹：由表格管理器提供，记录每个结果生成时的 (模型, prompt)
+        self.fingerprints = None
+        
+        # 按模型累计的实际用量和延迟，用于校准费用/耗时预估
+        self.usage_stats = {}
+        self.usage_lock = threading.Lock()
+        
+        # 请求参数（o1模型不支持max_tokens和temperature）
+        self.max_tokens = 1000
+        self.temperature = 0.7
+        # o1不限制输出长度，限速时按该值预估输出token
+        self.o1_output_tokens = int(os.getenv('AI_O1_OUTPUT_TOKENS', '4000'))
+        
+        # 流式输出：AI_STREAM=1时边生成边回调部分结果，界面按刷新间隔（秒）合并更新
+        self.stream_enabled = os.getenv('AI_STREAM', '0') == '1'
+        self.stream_refresh_interval = float(os.getenv('AI_STREAM_REFRESH_INTERVAL', '0.1'))
+        
+        # 限速配置：AI_RPM/AI_TPM为默认值，AI_RPM_<模型>/AI_TPM_<模型>按模型覆盖
+        self.rate_limiter = RateLimiter(
+            limits={m: self.get_rate_limit_config(m) for m in ("gpt-4.1", "o1", model)},
+            default_limits=self.get_rate_limit_config(None)
+        )
+        
+        # 端点池：按在途请求数/权重分配请求，连续失败的端点暂时摘除
+        # 每个端点有独立的自适应并发控制器，从初始值起步，按错误和延迟信号在[1, 最大并发]之间调整
+        self.endpoint_pool = self.build_endpoint_pool()
+        self.client = self.endpoint_pool.endpoints[0].client
+        self.max_concurrency = sum(e.concurrency.max_limit for e in self.endpoint_pool.endpoints)
+        print(f"Max Concurrency: {self.max_concurrency}")
+        
+    def create_concurrency(self, max_limit=None):
+        """创建一个端点的自适应并发控制器"""
+        max_limit = max(1, int(max_limit or self.endpoint_concurrency))
+        return AdaptiveConcurrency(min(self.initial_concurrency, max_limit), max_limit,
+                                   latency_tolerance=self.latency_tolerance)
+        
+    def build_endpoint_pool(self):
+        """根据AI_ENDPOINTS创建端点池；未配置时只有默认客户端一个端点"""
+        pool_options = {
+            "max_failures": int(os.getenv('AI_ENDPOINT_MAX_FAILURES', '3')),
+            "base_ejection": float(os.getenv('AI_ENDPOINT_EJECTION', '30')),
+            "health_interval": float(os.getenv('AI_ENDPOINT_HEALTH_INTERVAL', '30'))
+        }
+        if not self.endpoint_configs:
+            return EndpointPool([Endpoint("default", self.client, self.rate_limiter,
+                                          concurrency=self.create_concurrency())], **pool_options)
             
-            # 替换模板中的变量
-            prompt = self.replace_template_variables(prompt_template, row_data)
+        endpoints = []
+        for config in self.endpoint_configs:
+            client = openai.OpenAI(
+                api_key=config["api_key"],
+                base_url=config.get("base_url"),
+                **self.client_options
+            )
+            # 端点配置了rpm/tpm时按端点限速，否则沿用环境变量中的限速配置
+            if "rpm" in config or "tpm" in config:
+                rate_limiter = RateLimiter(default_limits={
+                    "rpm": int(config.get("rpm", 0)),
+                    "tpm": int(config.get("tpm", 0))
+                })
+            else:
+                rate_limiter = RateLimiter(
+                    limits={m: self.get_rate_limit_config(m) for m in ("gpt-4.1", "o1", self.model)},
+                    default_limits=self.get_rate_limit_config(None)
+                )
+            endpoints.append(Endpoint(config["name"], client, rate_limiter,
+                                      weight=config.get("weight", 1), models=config.get("models"),
+                                      concurrency=self.create_concurrency(config.get("max_concurrency"))))
+            print(f"API端点: {config['name']} (权重 {config.get('weight', 1)})")
+        return EndpointPool(endpoints, **pool_options)
+        
+    def open_cache(self, directory):
+        """在指定目录打开响应缓存（打开或保存项目时切换到项目目录）"""
+        if not self.cache_enabled:
+            return
+        cache_path = os.path.join(directory or os.getcwd(), CACHE_FILE_NAME)
+        if self.cache is not None and self.cache.db_path == cache_path:
+            return
+        try:
+            new_cache = ResponseCache(cache_path, self.cache_max_bytes)
+        except Exception as e:
+            print(f"打开响应缓存失败: {e}")
+            return
+        old_cache = self.cache
+        self.cache = new_cache
+        if old_cache is not None:
+            old_cache.close()
+        print(f"响应缓存: {cache_path}")
+        
+    def current_concurrency_limit(self):
+        """所有端点当前允许的在途请求数之和"""
+        return sum(e.concurrency.current_limit() for e in self.endpoint_pool.endpoints)
+        
+    def shutdown(self):
+        """退出前停止后台线程（端点健康检查）"""
+        self.endpoint_pool.close()
+        
+    def get_cache_stats(self):
+        """获取响应缓存统计（未启用时返回None）"""
+        if self.cache is None:
+            return None
+        return self.cache.get_stats()
+        
+    def record_usage(self, model, prompt, usage, latency):
+        """累计一次成功请求的实际token用量和延迟"""
+        with self.usage_lock:
+            stats = self.usage_stats.setdefault(model, {
+                "requests": 0, "latency": 0.0, "usage_requests": 0,
+                "prompt_tokens": 0, "estimated_prompt_tokens": 0, "completion_tokens": 0
+            })
+            stats["requests"] += 1
+            stats["latency"] += latency
+            prompt_tokens = getattr(usage, "prompt_tokens", None)
+            completion_tokens = getattr(usage, "completion_tokens", None)
+            if prompt_tokens and completion_tokens is not None:
+                stats["usage_requests"] += 1
+                stats["prompt_tokens"] += prompt_tokens
+                stats["estimated_prompt_tokens"] += estimate_tokens(prompt)
+                stats["completion_tokens"] += completion_tokens
+                
+    def get_rate_limit_config(self, model):
+        """从环境变量读取模型的RPM/TPM配置，模型名中的非字母数字字符替换为下划线"""
+        rpm = int(os.getenv('AI_RPM', '0'))
+        tpm = int(os.getenv('AI_TPM', '0'))
+        if model:
+            suffix = re.sub(r'[^0-9A-Za-z]', '_', model).upper()
+            rpm = int(os.getenv(f'AI_RPM_{suffix}', rpm))
+            tpm = int(os.getenv(f'AI_TPM_{suffix}', tpm))
+        return {"rpm": rpm, "tpm": tpm}
+        
+    def estimate_request_tokens(self, prompt, model=None, max_tokens=None):
+        """预估一次请求计入TPM的token数：输入token + 输出上限"""
+        use_model = model if model else self.model
+        output_tokens = self.o1_output_tokens if use_model == "o1" else (max_tokens or self.max_tokens)
+        return estimate_tokens(prompt) + output_tokens
+        
+    def process_single_cell(self, dataframe, row_index, column_name, prompt_template, model=None, stream_callback=None):
+        """处理单个单元格，开启流式输出时stream_callback(部分结果)在调用线程中随生成进度被调用"""
+        try:
+            # 替换模板中的变量（只读取模板引用的列）
+            prompt = compile_template(prompt_template).render_row(dataframe, row_index)
             
             # 使用指定模型或默认模型
             use_model = model if model else self.model
@@ -49,13 +505,17 @@ class AIProcessor:
             print(f"处理第{row_index+1}行，列：{column_name} (模型: {use_model})")
             print(f"Prompt: {prompt}")
             
-            # 调用AI API
-            result = self.call_ai_api(prompt, use_model)
+            # 调用AI API（瞬时错误自动重试）
+            result, attempts = self.call_with_retry(prompt, use_model, stream_callback=stream_callback)
             
             print(f"AI结果: {result}")
             
             # 更新数据框
             dataframe.loc[row_index, column_name] = result
+            self.write_journal(dataframe, row_index, column_name, result, use_model)
+            if self.journal is not None:
+                self.journal.flush()
+            self.record_fingerprints(column_name, [prompt], [use_model])
             
             return True, result
             
@@ -65,74 +525,634 @@ class AIProcessor:
             dataframe.loc[row_index, column_name] = error_msg
             return False, error_msg
         
-    def process_batch(self, dataframe, ai_columns, progress_callback=None):
+    def process_batch(self, dataframe, ai_columns, progress_callback=None, max_concurrency=None):
         """批量处理AI列"""
         try:
-            total_tasks = len(dataframe) * len(ai_columns)
-            current_task = 0
+            tasks = self.build_tasks(dataframe, ai_columns)
+            self.process_tasks(dataframe, tasks, max_concurrency=max_concurrency,
+                               progress_callback=progress_callback)
+            return True
             
-            # 遍历每一行
-            for row_index in range(len(dataframe)):
-                row_data = dataframe.iloc[row_index].to_dict()
+        except Exception as e:
+            print(f"批量处理错误: {e}")
+            return False
+            
+    def get_column_config(self, config):
+        """解析AI列配置，返回 (prompt模板, 模型)"""
+        if isinstance(config, dict):
+            return config.get("prompt", ""), config.get("model", self.model)
+        # 向后兼容：旧格式只有prompt字符串，使用默认模型
+        return config, self.model
+        
+    def get_pack_size(self, config):
+        """AI列的打包行数：大于1时每次请求合并多行prompt，不超过模型输出上限允许的行数，旧格式和未设置时为1"""
+        if isinstance(config, dict):
+            try:
+                pack_size = max(1, int(config.get("pack_size", 1)))
+            except (TypeError, ValueError):
+                return 1
+            return min(pack_size, self.get_max_pack_size(config.get("model", self.model)))
+        return 1
+        
+    def get_model_output_limit(self, model=None):
+        """模型单次回复的输出token上限"""
+        use_model = model if model else self.model
+        suffix = re.sub(r'[^0-9A-Za-z]', '_', use_model).upper()
+        return int(os.getenv(f'AI_MAX_OUTPUT_TOKENS_{suffix}',
+                             MODEL_OUTPUT_LIMITS.get(use_model, DEFAULT_OUTPUT_LIMIT)))
+        
+    def get_max_pack_size(self, model=None):
+        """输出上限允许的最大打包行数：每行预留与单独请求相同的输出token"""
+        use_model = model if model else self.model
+        output_tokens = self.o1_output_tokens if use_model == "o1" else self.max_tokens
+        return max(1, self.get_model_output_limit(use_model) // output_tokens)
+        
+    def get_pending_rows(self, dataframe, column_name):
+        """返回AI列中待处理（空值或错误结果）的行位置列表"""
+        if column_name not in dataframe.columns:
+            return list(range(len(dataframe)))
+        column = dataframe[column_name]
+        text = column.map(str, na_action='ignore').str.strip()
+        pending = column.isna() | (text == "") | text.str.startswith("错误:").fillna(False)
+        return pending.to_numpy().nonzero()[0].tolist()
+        
+    def write_journal(self, dataframe, row_index, column_name, value, model=None):
+        """把成功的结果追加到结果日志，日志写入失败不影响处理"""
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(dataframe, row_index, column_name, value, model or self.model)
+        except Exception as e:
+            print(f"写入结果日志失败: {e}")
+            
+    def record_fingerprints(self, column_name, prompts, models):
+        """记录新生成结果的指纹"""
+        if self.fingerprints is None or not prompts:
+            return
+        self.fingerprints.record(column_name, fingerprint_prompts(prompts, models))
+        
+    def get_stale_rows(self, dataframe, column_name, config):
+        """
+        返回需要重新处理的行位置：待处理（空值或错误结果），
+        或当前 (模型, prompt) 与生成该结果时不同（输入、模板或模型变化）；手动修改过的结果不算过期
+        """
+        pending = np.zeros(len(dataframe), dtype=bool)
+        pending[self.get_pending_rows(dataframe, column_name)] = True
+        if self.fingerprints is None or column_name not in dataframe.columns:
+            return pending.nonzero()[0].tolist()
+        prompt_template, model = self.get_column_config(config)
+        prompts = compile_template(prompt_template).render_rows(dataframe)
+        stale = self.fingerprints.stale_mask(column_name, fingerprint_prompts(prompts, model))
+        return (pending | stale).nonzero()[0].tolist()
+        
+    def add_downstream_rows(self, ai_columns, rows_by_column):
+        """
+        上游单元格需要重新处理时，同一行引用它的下游单元格也要重新处理
+        rows_by_column为 {列名: 行位置列表}，返回补充后的字典；存在循环引用时抛出ValueError
+        """
+        dependencies = get_column_dependencies(ai_columns)
+        expanded = {}
+        for column_name in topological_order(ai_columns):
+            rows = set(rows_by_column.get(column_name, ()))
+            for upstream_column in dependencies[column_name]:
+                rows.update(expanded[upstream_column])
+            expanded[column_name] = sorted(rows)
+        return expanded
+        
+    def build_stale_tasks(self, dataframe, ai_columns):
+        """只为需要重新处理的单元格及其下游单元格生成任务（增量处理）"""
+        rows_by_column = {column_name: self.get_stale_rows(dataframe, column_name, config)
+                          for column_name, config in ai_columns.items()}
+        return self.build_column_tasks(dataframe, ai_columns, self.add_downstream_rows(ai_columns, rows_by_column))
+        
+    def build_pending_tasks(self, dataframe, ai_columns):
+        """只为待处理（空值或错误结果）的单元格及其下游单元格生成任务，用于继续中断的处理"""
+        rows_by_column = {column_name: self.get_pending_rows(dataframe, column_name)
+                          for column_name in ai_columns}
+        return self.build_column_tasks(dataframe, ai_columns, self.add_downstream_rows(ai_columns, rows_by_column))
+        
+    def build_column_tasks(self, dataframe, ai_columns, rows_by_column):
+        """按 {列名: 行位置列表} 生成任务"""
+        tasks = []
+        for column_name, config in ai_columns.items():
+            row_indices = rows_by_column.get(column_name)
+            if row_indices:
+                tasks.extend(self.build_tasks(dataframe, {column_name: config}, row_indices))
+        return tasks
+        
+    def build_tasks(self, dataframe, ai_columns, row_indices=None):
+        """根据AI列配置生成 (行, 列) 任务列表，引用其他AI列的列排在其上游列之后"""
+        rows = range(len(dataframe)) if row_indices is None else list(row_indices)
+        tasks = []
+        order = topological_order(ai_columns)
+        for column_name in order:
+            config = ai_columns[column_name]
+            prompt_template, model = self.get_column_config(config)
+            pack_size = self.get_pack_size(config)
+            for row_index in rows:
+                tasks.append({
+                    "row_index": row_index,
+                    "column_name": column_name,
+                    "prompt_template": prompt_template,
+                    "model": model,
+                    "pack_size": pack_size
+                })
+        return tasks
+        
+    def process_tasks(self, dataframe, tasks, max_concurrency=None, progress_callback=None, result_callback=None,
+                      partial_callback=None, control=None):
+        """
+        并发处理一批 (行, 列) 任务
+        渲染后prompt和模型都相同的任务只发送一次请求，结果分发给所有对应单元格；
+        pack_size大于1的任务每K个prompt合并为一次请求，返回格式不正确的包退回逐个请求；
+        模板引用了本批次中另一AI列的任务按行流水线执行：同一行的上游单元格完成后立即渲染并排到上游积压之前，
+        上游失败时下游单元格直接记为错误，互不依赖的列按行交错同时进行，存在循环引用时抛出ValueError；
+        依赖已满足的请求在调用线程的优先队列中排队，线程池中同时只有当前并发上限个请求，
+        结果在调用线程中写回数据框并触发回调，
+        开启流式输出时partial_callback(行, 列, 部分结果)按刷新间隔在调用线程中被调用（不写入数据框），
+        control（如后台任务）提供wait_while_paused()，工作线程发送每个请求前调用，暂停时阻塞，返回False表示已取消，
+        取消的单元格不发送请求也不修改数据框，结果中cancelled为True；
+        返回与tasks顺序一致的结果列表，每项为:
+        {"row_index", "column_name", "model", "success", "result", "elapsed", "attempts", "shared", "cancelled"}
+        本批次的请求统计保存在 self.last_batch_stats
+        """
+        total = len(tasks)
+        results = [None] * total
+        self.last_batch_stats = {"tasks": total, "requests": 0, "saved_requests": 0}
+        if total == 0:
+            return results
+            
+        # 线程池大小为并发上限，实际在途请求数由自适应控制器决定
+        workers = max(1, int(max_concurrency or self.max_concurrency))
+        
+        # 按模板中的AI列引用建立 上游任务 -> 下游任务 的依赖，下游任务等待同一行的所有上游任务完成
+        batch_templates = {task["column_name"]: task["prompt_template"] for task in tasks}
+        cycle = find_cycle(batch_templates)
+        if cycle:
+            raise ValueError(format_cycle(cycle))
+        column_dependencies = get_column_dependencies(batch_templates)
+        task_positions = {(task["row_index"], task["column_name"]): i for i, task in enumerate(tasks)}
+        dependents = {}
+        waiting = [0] * total
+        for i, task in enumerate(tasks):
+            for upstream_column in column_dependencies[task["column_name"]]:
+                upstream = task_positions.get((task["row_index"], upstream_column))
+                if upstream is not None:
+                    dependents.setdefault(upstream, []).append(i)
+                    waiting[i] += 1
+                    
+        prompts = [None] * total
+        
+        def render_prompts(indices):
+            # 在调用线程中渲染prompt，工作线程不接触数据框
+            # 同一模板的任务一次性向量化渲染，只读取模板引用的列
+            tasks_by_template = {}
+            for i in indices:
+                tasks_by_template.setdefault(tasks[i]["prompt_template"], []).append(i)
+            for prompt_template, template_indices in tasks_by_template.items():
+                row_indices = [tasks[i]["row_index"] for i in template_indices]
+                rendered = compile_template(prompt_template).render_rows(dataframe, row_indices)
+                for i, prompt in zip(template_indices, rendered):
+                    prompts[i] = prompt
+                    
+        # 按 (模型, prompt) 分组去重；已完成的请求结果保留，后续渲染出相同prompt的任务直接复用
+        groups = {}
+        group_outcomes = {}
+        
+        # 流式部分结果由工作线程写入，调用线程定时取出后回调，同一请求只保留最新文本
+        streaming = partial_callback is not None and self.stream_enabled
+        partials = {}
+        partials_lock = threading.Lock()
+        
+        def make_stream_callback(group_key):
+            def on_partial(text):
+                with partials_lock:
+                    partials[group_key] = text
+            return on_partial
+            
+        def flush_partials():
+            with partials_lock:
+                pending_partials = list(partials.items())
+                partials.clear()
+            for group_key, text in pending_partials:
+                for i in groups[group_key]:
+                    if results[i] is None:
+                        partial_callback(tasks[i]["row_index"], tasks[i]["column_name"], text)
+                        
+        completed = 0
+        skipped = 0  # 因上游失败而未发送请求的任务
+        cancelled = 0  # 因取消而未发送请求的任务
+        generated = {}  # {列名: ([prompt], [模型])}，结束后批量记录指纹
+        ready = [i for i in range(total) if waiting[i] == 0]
+        
+        def finish_task(i, success, value, elapsed, attempts, shared, prompt=None):
+            nonlocal completed, skipped
+            task = tasks[i]
+            
+            # 更新数据框
+            dataframe.loc[task["row_index"], task["column_name"]] = value
+            if success:
+                self.write_journal(dataframe, task["row_index"], task["column_name"], value, task.get("model"))
+                column_generated = generated.setdefault(task["column_name"], ([], []))
+                column_generated[0].append(prompt)
+                column_generated[1].append(task.get("model") or self.model)
+                
+            result = {
+                "row_index": task["row_index"],
+                "column_name": task["column_name"],
+                "model": task.get("model") or self.model,
+                "success": success,
+                "result": value,
+                "elapsed": elapsed,
+                "attempts": attempts,
+                "shared": shared,
+                "cancelled": False
+            }
+            results[i] = result
+            completed += 1
+            
+            if result_callback:
+                result_callback(result)
+            if progress_callback:
+                progress_callback(completed, total)
+                
+            # 释放下游任务：上游成功时依赖全部满足的任务进入就绪队列，上游失败时下游直接记为错误
+            for downstream in dependents.get(i, ()):
+                if results[downstream] is not None:
+                    continue
+                if not success:
+                    skipped += 1
+                    finish_task(downstream, False, f"错误: 依赖的列 {task['column_name']} 处理失败", 0.0, 0, False)
+                    continue
+                waiting[downstream] -= 1
+                if waiting[downstream] == 0:
+                    ready.append(downstream)
+                    
+        def finish_group(group_key, success, value, elapsed, attempts):
+            indices = groups[group_key]
+            if not success:
+                print(f"处理第{tasks[indices[0]]['row_index']+1}行，列：{tasks[indices[0]]['column_name']} 失败: {value}")
+                value = f"错误: {value}"
+            group_outcomes[group_key] = (success, value, elapsed, attempts)
+            
+            # 将同一请求的结果分发给所有相同prompt的单元格
+            for i in indices:
+                finish_task(i, success, value, elapsed, attempts, len(indices) > 1, group_key[1])
+                
+        def cancel_task(i):
+            nonlocal completed, cancelled
+            task = tasks[i]
+            result = {
+                "row_index": task["row_index"],
+                "column_name": task["column_name"],
+                "model": task.get("model") or self.model,
+                "success": False,
+                "result": None,
+                "elapsed": 0.0,
+                "attempts": 0,
+                "shared": False,
+                "cancelled": True
+            }
+            results[i] = result
+            completed += 1
+            cancelled += 1
+            
+            if result_callback:
+                result_callback(result)
+            if progress_callback:
+                progress_callback(completed, total)
+                
+            # 取消的单元格没有结果，依赖它的下游单元格也一并取消
+            for downstream in dependents.get(i, ()):
+                if results[downstream] is None:
+                    cancel_task(downstream)
+                    
+        # 请求优先级：依赖链中越靠下游的列越优先（刚就绪的下游请求排在上游积压之前，一行尽快走完整条链），
+        # 同层按行号排序，互不依赖的列按行交错推进
+        depths = get_column_depths(batch_templates)
+        
+        def get_priority(group_key):
+            task = tasks[groups[group_key][0]]
+            return -depths[task["column_name"]], task["row_index"]
+            
+        with ThreadPoolExecutor(max_workers=min(workers, total)) as executor:
+            futures = {}
+            not_done = set()
+            # 待提交的请求 (优先级, 序号, 是否打包, group_key或包)，只按当前并发上限交给线程池
+            queue = []
+            sequence = itertools.count()
+            # 等待打包的prompt {(模型, 打包行数): [group_key]}：流水线中每轮只释放少量下游任务，
+            # 凑满一包或没有在途请求（不会再有新的就绪任务）时才提交，保持打包节省的请求数
+            held_packs = {}
+            
+            def enqueue(is_pack, key):
+                priority = min(get_priority(group_key) for group_key in key) if is_pack else get_priority(key)
+                heapq.heappush(queue, (priority, next(sequence), is_pack, key))
                 
-                # 处理每个AI列
-                for column_name, prompt_template in ai_columns.items():
-                    success, result = self.process_single_cell(dataframe, row_index, column_name, prompt_template)
+            def feed():
+                """按优先级把排队的请求交给线程池，在途请求数不超过当前并发上限"""
+                capacity = max(1, min(workers, self.current_concurrency_limit()))
+                while queue and len(not_done) < capacity:
+                    _, _, is_pack, key = heapq.heappop(queue)
+                    if is_pack:
+                        future = executor.submit(self._run_pack, [prompt for _, prompt in key], key[0][0], control)
+                    else:
+                        stream_callback = make_stream_callback(key) if streaming else None
+                        future = executor.submit(self._run_task, key[1], key[0], stream_callback, control)
+                    futures[future] = (is_pack, key)
+                    not_done.add(future)
+                    self.last_batch_stats["requests"] += 1
                     
-                    # 更新进度
-                    current_task += 1
-                    if progress_callback:
-                        progress_callback(current_task, total_tasks)
+            def dispatch(indices):
+                """渲染依赖已满足的任务，去重、打包后排队"""
+                render_prompts(indices)
+                new_keys = []
+                for i in indices:
+                    group_key = (tasks[i].get("model") or self.model, prompts[i])
+                    if group_key in group_outcomes:
+                        finish_task(i, *group_outcomes[group_key], True, group_key[1])
+                    elif group_key in groups:
+                        groups[group_key].append(i)
+                    else:
+                        groups[group_key] = [i]
+                        new_keys.append(group_key)
                         
-                    # 添加延迟避免API限制
-                    time.sleep(0.1)
+                # 按 (模型, 打包行数) 收集需要打包的prompt，凑满K个排队一包
+                for group_key in new_keys:
+                    pack_size = tasks[groups[group_key][0]].get("pack_size", 1) or 1
+                    if pack_size > 1:
+                        held_packs.setdefault((group_key[0], pack_size), []).append(group_key)
+                    else:
+                        enqueue(False, group_key)
+                enqueue_packs()
+                
+            def enqueue_packs(flush=False):
+                """已凑满的包排队；flush为True时剩余不足一包的prompt也一并排队"""
+                for bucket_key, group_keys in list(held_packs.items()):
+                    pack_size = bucket_key[1]
+                    while len(group_keys) >= pack_size or (flush and group_keys):
+                        pack = group_keys[:pack_size]
+                        del group_keys[:pack_size]
+                        if len(pack) > 1:
+                            enqueue(True, pack)
+                        else:
+                            enqueue(False, pack[0])
+                    if not group_keys:
+                        del held_packs[bucket_key]
                         
-            return True
+            def dispatch_ready():
+                # 复用已完成的结果时可能继续释放下游任务，直到没有新的就绪任务
+                while ready:
+                    indices = ready[:]
+                    ready.clear()
+                    dispatch(indices)
+                feed()
+                if not not_done and held_packs:
+                    enqueue_packs(flush=True)
+                    feed()
+                    
+            dispatch_ready()
+            while not_done:
+                done, _ = wait(not_done, timeout=self.stream_refresh_interval if streaming else None,
+                               return_when=FIRST_COMPLETED)
+                not_done.difference_update(done)
+                if streaming:
+                    flush_partials()
+                    
+                for future in done:
+                    is_pack, key = futures.pop(future)
+                    outcome = future.result()
+                    if outcome is None:
+                        # 已取消，请求没有发出
+                        for group_key in (key if is_pack else [key]):
+                            for i in groups[group_key]:
+                                if results[i] is None:
+                                    cancel_task(i)
+                        continue
+                    if not is_pack:
+                        finish_group(key, *outcome)
+                        continue
+                        
+                    answers, elapsed, attempts = outcome
+                    if answers is None:
+                        # 整包失败或返回格式不正确，退回逐个请求
+                        print(f"多行打包结果无效，{len(key)}个prompt改为逐个请求")
+                        for group_key in key:
+                            enqueue(False, group_key)
+                        continue
+                    for group_key, answer in zip(key, answers):
+                        finish_group(group_key, True, answer, elapsed, attempts)
+                        
+                # 本轮完成的上游单元格释放的下游任务一起渲染排队，便于去重和打包；空出的并发名额按优先级补充
+                dispatch_ready()
+                
+        sent = total - skipped - cancelled
+        if sent > len(groups):
+            print(f"相同prompt合并: {sent}个任务只需{len(groups)}个不同请求，节省{sent - len(groups)}次")
+        if skipped:
+            print(f"{skipped}个单元格因依赖的上游单元格失败而未处理")
+        if cancelled:
+            print(f"已取消，{cancelled}个单元格未处理")
+        self.last_batch_stats["saved_requests"] = sent - self.last_batch_stats["requests"]
+        if self.journal is not None:
+            self.journal.flush()
+        for column_name, (column_prompts, column_models) in generated.items():
+            self.record_fingerprints(column_name, column_prompts, column_models)
+        return results
+        
+    def _run_task(self, prompt, model, stream_callback=None, control=None):
+        """在工作线程中执行单个请求，返回 (是否成功, 结果或错误信息, 耗时, 尝试次数)，已取消时返回None"""
+        if control is not None and not control.wait_while_paused():
+            return None
+        start = time.time()
+        try:
+            result, attempts = self.call_with_retry(prompt, model, limited=True, stream_callback=stream_callback)
+            return True, result, time.time() - start, attempts
+        except Exception as e:
+            return False, str(e), time.time() - start, getattr(e, "attempts", 1)
             
+    def _run_pack(self, prompts, model, control=None):
+        """
+        在工作线程中把多个prompt合并为一次请求，返回 (答案列表, 耗时, 尝试次数)
+        请求失败或返回的答案数量不符时答案列表为None，已取消时返回None
+        """
+        if control is not None and not control.wait_while_paused():
+            return None
+        start = time.time()
+        try:
+            pack_prompt = self.build_pack_prompt(prompts)
+            result, attempts = self.call_with_retry(pack_prompt, model, limited=True,
+                                                    max_tokens=min(self.max_tokens * len(prompts),
+                                                                   self.get_model_output_limit(model)))
+            return self.parse_pack_response(result, len(prompts)), time.time() - start, attempts
         except Exception as e:
-            print(f"批量处理错误: {e}")
-            return False
+            print(f"多行打包请求失败: {e}")
+            return None, time.time() - start, getattr(e, "attempts", 1)
+            
+    def build_pack_prompt(self, prompts):
+        """把多个相互独立的prompt合并为一个要求返回JSON数组的prompt"""
+        lines = [
+            f"下面有{len(prompts)}个相互独立的任务，请逐个完成。",
+            f"只输出一个JSON字符串数组，恰好包含{len(prompts)}个元素，第i个元素是第i个任务的完整回答，"
+            f"不要输出任何其他内容。"
+        ]
+        for i, prompt in enumerate(prompts, 1):
+            lines.append(f"\n### 任务{i}\n{prompt}")
+        return "\n".join(lines)
+        
+    def parse_pack_response(self, text, count):
+        """解析打包请求的回复，返回count个答案的列表，格式或数量不正确时返回None"""
+        if not text:
+            return None
+        start = text.find("[")
+        end = text.rfind("]")
+        if start < 0 or end <= start:
+            return None
+        try:
+            answers = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(answers, list) or len(answers) != count:
+            return None
+        return [answer.strip() if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+                for answer in answers]
+        
+    def call_with_retry(self, prompt, model=None, limited=False, stream_callback=None, max_tokens=None):
+        """
+        调用AI API，可重试错误按退避策略重试，返回 (结果, 尝试次数)
+        limited为True时每次尝试占用所选端点的一个在途名额（受该端点的自适应并发限制），退避等待期间释放
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self.call_ai_api(prompt, model, stream_callback, max_tokens, limited), attempt
+            except AIAPIError as e:
+                e.attempts = attempt
+                delay = self.retry_policy.get_delay(e, attempt)
+                if delay is None:
+                    raise
+            print(f"第{attempt}次请求失败（可重试），{delay:.1f}秒后重试")
+            time.sleep(delay)
             
     def replace_template_variables(self, template, row_data):
         """替换模板中的变量"""
-        # 使用正则表达式找到所有 {变量名} 格式的占位符
-        def replace_var(match):
-            var_name = match.group(1)
-            return str(row_data.get(var_name, f"{{未找到字段: {var_name}}}"))
-            
-        return re.sub(r'\{(\w+)\}', replace_var, template)
+        # 模板按 {变量名} 预先解析并缓存，渲染时直接拼接
+        return compile_template(template).render(row_data)
+        
+    def build_request_params(self, prompt, model=None, max_tokens=None):
+        """构造chat.completions请求参数，max_tokens为空时使用默认输出上限"""
+        use_model = model if model else self.model
+        params = {
+            "model": use_model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }
+        # 根据模型调整参数：o1模型不支持temperature和max_tokens参数
+        if use_model != "o1":
+            params["max_tokens"] = max_tokens or self.max_tokens
+            params["temperature"] = self.temperature
+        return params
+        
+    def get_cache_key(self, prompt, model=None, max_tokens=None):
+        """响应缓存键：模型、prompt及影响输出的请求参数"""
+        params = self.build_request_params(prompt, model, max_tokens)
+        return ResponseCache.make_key(params["model"], prompt,
+                                      params.get("max_tokens"), params.get("temperature"))
         
-    def call_ai_api(self, prompt, model=None):
-        """调用AI API"""
+    def store_cached_result(self, cache_key, model, result):
+        """写入响应缓存，写入失败不影响本次结果"""
+        if cache_key is None or self.cache is None:
+            return
+        try:
+            self.cache.put(cache_key, model, result)
+        except Exception as e:
+            print(f"写入响应缓存失败: {e}")
+            
+    def call_ai_api(self, prompt, model=None, stream_callback=None, max_tokens=None, limited=False):
+        """
+        调用AI API，开启流式输出且提供stream_callback时，每收到新内容即以累计文本回调
+        limited为True时只选择有空闲并发名额且不在Retry-After暂停期的端点，都没有时等待
+        """
         try:
             use_model = model if model else self.model
             
-            # 根据模型调整参数
-            if use_model == "o1":
-                # o1模型的特殊配置
-                response = self.client.chat.completions.create(
-                    model=use_model,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                    # o1模型不支持temperature和max_tokens参数
-                )
-            else:
-                # 其他模型的标准配置
-                response = self.client.chat.completions.create(
-                    model=use_model,
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=1000,
-                    temperature=0.7
-                )
+            # 查询响应缓存，键包含模型、prompt和影响输出的请求参数
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.get_cache_key(prompt, use_model, max_tokens)
+                if not self.cache_bypass:
+                    cached = self.cache.get(cache_key)
+                    if cached is not None:
+                        return cached
             
-            return response.choices[0].message.content.strip()
+            # 选择端点，发送前按该端点的RPM/TPM预扣额度，额度不足时等待
+            endpoint = self.endpoint_pool.acquire(use_model, limited)
+            try:
+                estimated_tokens = self.estimate_request_tokens(prompt, use_model, max_tokens)
+                endpoint.rate_limiter.acquire(use_model, estimated_tokens)
+                
+                request_start = time.monotonic()
+                
+                params = self.build_request_params(prompt, use_model, max_tokens)
+                if stream_callback is not None and self.stream_enabled:
+                    result, usage = self.stream_completion(params, stream_callback, endpoint.client)
+                else:
+                    response = endpoint.client.chat.completions.create(**params)
+                    result = response.choices[0].message.content
+                    usage = getattr(response, "usage", None)
+            except Exception as request_error:
+                # 只减小出错端点的并发并按Retry-After暂停该端点，其他端点照常发送
+                if is_overload_error(request_error):
+                    endpoint.concurrency.on_overload(parse_retry_after(getattr(request_error, "response", None)))
+                self.endpoint_pool.release(endpoint, False, count_failure=is_endpoint_failure(request_error),
+                                           limited=limited)
+                raise
+            self.endpoint_pool.release(endpoint, True, limited=limited)
+            
+            # 延迟信号用于该端点的自适应并发（不含限速等待时间）
+            latency = time.monotonic() - request_start
+            endpoint.concurrency.on_success(latency)
+            
+            # 用实际用量修正预扣的token额度
+            if usage is not None and getattr(usage, "total_tokens", None):
+                endpoint.rate_limiter.settle(use_model, estimated_tokens, usage.total_tokens)
+            self.record_usage(use_model, prompt, usage, latency)
+            
+            result = result.strip()
+            
+            self.store_cached_result(cache_key, use_model, result)
+            
+            return result
             
         except Exception as e:
-            raise Exception(f"AI API调用失败: {str(e)}")
+            status_code = getattr(e, "status_code", None)
+            # 受并发限制的请求由端点暂停执行Retry-After，重试时可立即改用其他端点
+            retry_after = None if limited else parse_retry_after(getattr(e, "response", None))
+            error = AIAPIError(f"AI API调用失败: {str(e)}", status_code=status_code,
+                               retry_after=retry_after, retryable=is_retryable_error(e))
+            raise error from e
             
+    def stream_completion(self, params, stream_callback, client=None):
+        """以流式方式请求，每收到新内容即以累计文本回调，返回 (完整结果, 用量)"""
+        stream = (client or self.client).chat.completions.create(
+            **params, stream=True, stream_options={"include_usage": True}
+        )
+        text = ""
+        usage = None
+        for chunk in stream:
+            # 最后一个分块只携带用量，没有choices
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                text += delta
+                stream_callback(text)
+        return text, usage
+        
     def test_connection(self):
         """测试AI API连接"""
         try:
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI Excel 命令行工具
+无界面运行.aie项目，适合服务器、定时任务和容器（不导入tkinter）
+
+用法:
+    python -m aie run data/bench.aie --columns 摘要,分类 --concurrency 32
+    python -m aie shard data/bench.aie --shards 4
+    python -m aie run data/bench.shard-01-of-04.aie        # 每个分片可在不同机器上处理
+    python -m aie merge data/bench.aie data/bench.shard-*.aie
+"""
+
+import argparse
+import os
+import signal
+import sys
+import time
+
+def parse_columns(value):
+    """解析逗号分隔的列名"""
+    return [column.strip() for column in value.split(",") if column.strip()] if value else None
+
+def print_progress(job, start_time):
+    """输出一行进度"""
+    from cost_estimator import format_duration
+    elapsed = time.time() - start_time
+    rate = job.completed / elapsed if elapsed > 0 else 0.0
+    percent = job.completed / job.total * 100 if job.total else 100.0
+    line = (f"[{elapsed:7.1f}s] {job.completed}/{job.total} {percent:5.1f}%  "
+            f"成功 {job.success_count}  失败 {job.completed - job.success_count}  {rate:.1f}格/秒")
+    if 0 < rate and job.completed < job.total:
+        line += f"  预计剩余 {format_duration((job.total - job.completed) / rate)}"
+    print(line, flush=True)
+
+def run_project(args):
+    """处理项目中的AI列并原子保存"""
+    if args.concurrency:
+        # AIProcessor在初始化时读取并发配置
+        os.environ['AI_MAX_CONCURRENCY'] = str(args.concurrency)
+    
+    from table_manager import TableManager
+    from project_manager import ProjectManager
+    from ai_processor import AIProcessor
+    from job_runner import JobRunner, JOB_CANCELLED, JOB_FAILED
+    from cost_estimator import format_duration
+    
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    result = project_manager.load_project(args.project, table_manager)
+    if not result[0]:
+        print(result[1], file=sys.stderr)
+        return 2
+    print(result[1], flush=True)
+    
+    df = table_manager.get_dataframe()
+    ai_columns = table_manager.get_ai_columns()
+    columns = parse_columns(args.columns)
+    if columns:
+        missing = [column for column in columns if column not in ai_columns]
+        if missing:
+            print(f"不是AI列: {', '.join(missing)}", file=sys.stderr)
+            return 2
+        ai_columns = {column: ai_columns[column] for column in columns}
+    if df is None or len(df) == 0 or not ai_columns:
+        print("没有AI列需要处理")
+        return 0
+    
+    processor = AIProcessor()
+    processor.fingerprints = table_manager.fingerprints
+    output_path = args.output or args.project
+    if os.path.abspath(output_path) != os.path.abspath(args.project):
+        # 结果属于输出项目，不写入原项目的结果日志（否则再次打开原项目时会被重放）
+        project_manager.open_journal(output_path, table_manager)
+    processor.journal = project_manager.journal
+    processor.open_cache(os.path.dirname(os.path.abspath(args.project)))
+    
+    try:
+        if args.mode == "all":
+            tasks = processor.build_tasks(df, ai_columns)
+        elif args.mode == "stale":
+            tasks = processor.build_stale_tasks(df, ai_columns)
+        else:
+            tasks = processor.build_pending_tasks(df, ai_columns)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    if not tasks:
+        print("没有需要处理的单元格")
+        return 0
+    print(f"开始处理: {len(tasks)}个单元格，AI列: {', '.join(ai_columns)}，模式: {args.mode}", flush=True)
+    
+    # 在后台线程中处理，主线程输出进度并响应Ctrl+C（取消未发出的请求后保存已完成的结果）
+    runner = JobRunner(processor)
+    job = runner.submit(os.path.basename(args.project), df, tasks)
+    
+    def on_interrupt(signum, frame):
+        if job.is_cancelled():
+            raise KeyboardInterrupt
+        print("\n正在取消，等待已发出的请求完成后保存（再次按Ctrl+C立即退出）...", flush=True)
+        job.cancel()
+    
+    previous_handler = signal.signal(signal.SIGINT, on_interrupt)
+    start_time = time.time()
+    last_report = 0.0
+    try:
+        while True:
+            _, finished = runner.drain()
+            if finished:
+                break
+            now = time.time()
+            if now - last_report >= args.progress_interval:
+                print_progress(job, start_time)
+                last_report = now
+            time.sleep(0.05)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    print_progress(job, start_time)
+    processor.shutdown()
+    
+    if job.status == JOB_FAILED:
+        print(f"处理失败: {job.error}", file=sys.stderr)
+        return 2
+    
+    success, message = project_manager.save_project(output_path, table_manager, processor)
+    print(message, flush=True)
+    if not success:
+        return 2
+    
+    stats = job.stats or processor.last_batch_stats
+    print(f"完成: 成功 {job.success_count}/{job.total}，实际请求 {stats['requests']} 次，"
+          f"耗时 {format_duration(job.get_elapsed())}"
+          + ("（已取消）" if job.status == JOB_CANCELLED else ""), flush=True)
+    return 0 if job.success_count == job.total else 1
+
+def shard_project(args):
+    """把项目按行拆分为多个分片"""
+    from project_shards import split_project
+    
+    success, message, paths = split_project(args.project, args.shards, args.output_dir)
+    print(message, file=sys.stdout if success else sys.stderr)
+    for path in paths:
+        print(path)
+    return 0 if success else 2
+    
+def merge_project(args):
+    """把处理完成的分片合并回原项目"""
+    from project_shards import merge_shards, format_conflict
+    
+    success, message, conflicts = merge_shards(args.project, args.shards, args.output)
+    print(message, file=sys.stdout if success else sys.stderr)
+    for conflict in conflicts[:args.max_conflicts]:
+        print(f"  冲突 {format_conflict(conflict)}")
+    if len(conflicts) > args.max_conflicts:
+        print(f"  ……另有 {len(conflicts) - args.max_conflicts} 处冲突")
+    if not success:
+        return 2
+    return 1 if conflicts else 0
+    
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(prog="python -m aie", description="AI Excel 命令行工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = subparsers.add_parser("run", help="处理项目中的AI列并保存")
+    run_parser.add_argument("project", help=".aie项目文件")
+    run_parser.add_argument("--columns", help="只处理这些AI列（逗号分隔），默认全部AI列")
+    run_parser.add_argument("--concurrency", type=int, help="每个端点的最大并发请求数（覆盖AI_MAX_CONCURRENCY）")
+    run_parser.add_argument("--mode", choices=["pending", "stale", "all"], default="pending",
+                            help="pending: 空值或错误的单元格（默认）；stale: 另含输入、提示词或模型变化的单元格；all: 全部重新处理")
+    run_parser.add_argument("--output", help="保存到另一个项目文件，默认覆盖原项目")
+    run_parser.add_argument("--progress-interval", type=float, default=1.0, help="进度输出间隔（秒）")
+    run_parser.set_defaults(handler=run_project)
+    
+    shard_parser = subparsers.add_parser("shard", help="把项目按行拆分为多个分片，每个分片可单独用run处理")
+    shard_parser.add_argument("project", help=".aie项目文件")
+    shard_parser.add_argument("--shards", type=int, required=True, help="分片数")
+    shard_parser.add_argument("--output-dir", help="分片保存目录，默认与项目相同")
+    shard_parser.set_defaults(handler=shard_project)
+    
+    merge_parser = subparsers.add_parser("merge", help="把处理完成的分片按行键合并回原项目")
+    merge_parser.add_argument("project", help="原.aie项目文件")
+    merge_parser.add_argument("shards", nargs="+", help="分片文件")
+    merge_parser.add_argument("--output", help="保存到另一个项目文件，默认覆盖原项目")
+    merge_parser.add_argument("--max-conflicts", type=int, default=20, help="最多显示的冲突数")
+    merge_parser.set_defaults(handler=merge_project)
+    
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch API处理器
+将AI列中待处理的单元格渲染为OpenAI Batch API的JSONL请求文件，
+提交后轮询任务状态，完成后把结果写回数据框（适合不需要实时返回的大表夜间任务）；
+请求标识带有行键，任务进行期间插入或删除行后结果仍写回对应的行
+"""
+
+import json
+import os
+import tempfile
+import time
+from prompt_template import compile_template
+from column_dag import get_column_dependencies
+from result_journal import get_key_columns, compute_row_key, compute_row_keys
+
+# 任务的终止状态
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# 有结果文件可写回的终止状态（取消和过期的任务保留已完成部分的结果）
+BATCH_RESULT_STATUSES = {"completed", "expired", "cancelled"}
+# 请求标识中行键的长度（十六进制字符）
+ROW_KEY_LENGTH = 16
+
+class BatchAPIProcessor:
+    def __init__(self, ai_processor):
+        self.ai_processor = ai_processor
+        self.client = ai_processor.client
+        self.poll_interval = float(os.getenv('AI_BATCH_POLL_INTERVAL', '30'))
+        self.completion_window = os.getenv('AI_BATCH_COMPLETION_WINDOW', '24h')
+    
+    @staticmethod
+    def make_custom_id(column_name, row_index, row_key):
+        """请求标识：列名:行号:行键"""
+        return f"{column_name}:{row_index}:{row_key[:ROW_KEY_LENGTH]}"
+    
+    @staticmethod
+    def parse_custom_id(custom_id):
+        """解析请求标识，返回 (列名, 行号, 行键)；列名中可能包含冒号，按最后两个冒号分割"""
+        column_name, row_index, row_key = custom_id.rsplit(":", 2)
+        return column_name, int(row_index), row_key
+    
+    @staticmethod
+    def compute_key(dataframe, row_index, key_columns):
+        """一行的行键（截取为请求标识中的长度）"""
+        values = [dataframe.iat[row_index, dataframe.columns.get_loc(column)] for column in key_columns]
+        return compute_row_key(values)[:ROW_KEY_LENGTH]
+    
+    def build_requests(self, dataframe, ai_columns, columns=None):
+        """
+        为指定AI列中所有待处理的单元格生成Batch API请求
+        Batch任务无法在服务端按行衔接上下游，同一行上游AI列仍待处理的单元格本次跳过，下次提交时处理
+        """
+        requests = []
+        key_columns = get_key_columns(dataframe, ai_columns)
+        dependencies = get_column_dependencies(ai_columns)
+        pending_rows = {column_name: self.ai_processor.get_pending_rows(dataframe, column_name)
+                        for column_name in ai_columns}
+        for column_name, config in ai_columns.items():
+            if columns is not None and column_name not in columns:
+                continue
+            prompt_template, model = self.ai_processor.get_column_config(config)
+            blocked_rows = set()
+            for upstream_column in dependencies[column_name]:
+                blocked_rows.update(pending_rows[upstream_column])
+            row_indices = [row for row in pending_rows[column_name] if row not in blocked_rows]
+            if not row_indices:
+                continue
+            prompts = compile_template(prompt_template).render_rows(dataframe, row_indices)
+            for row_index, prompt in zip(row_indices, prompts):
+                requests.append({
+                    "custom_id": self.make_custom_id(column_name, row_index,
+                                                     self.compute_key(dataframe, row_index, key_columns)),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.ai_processor.build_request_params(prompt, model)
+                })
+        return requests
+    
+    def write_request_file(self, requests, file_path=None):
+        """将请求写入JSONL文件，返回文件路径"""
+        if file_path is None:
+            fd, file_path = tempfile.mkstemp(prefix="aie_batch_", suffix=".jsonl")
+            os.close(fd)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + '\n')
+        return file_path
+    
+    def submit(self, file_path):
+        """上传请求文件并创建批处理任务，返回任务ID"""
+        with open(file_path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window
+        )
+        print(f"已提交批处理任务: {batch.id} (输入文件: {input_file.id})")
+        return batch.id
+    
+    def get_status(self, batch_id):
+        """查询任务状态，返回batch对象"""
+        return self.client.batches.retrieve(batch_id)
+    
+    def wait(self, batch_id, poll_interval=None, progress_callback=None):
+        """轮询直到任务结束，progress_callback(已完成数, 总数, 状态)"""
+        interval = poll_interval if poll_interval is not None else self.poll_interval
+        while True:
+            batch = self.get_status(batch_id)
+            counts = getattr(batch, "request_counts", None)
+            completed = (counts.completed + counts.failed) if counts else 0
+            total = counts.total if counts else 0
+            if progress_callback:
+                progress_callback(completed, total, batch.status)
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            time.sleep(interval)
+    
+    def download_results(self, batch):
+        """下载任务的输出和错误文件，返回 {custom_id: (是否成功, 结果或错误信息)}"""
+        results = {}
+        for file_id in (batch.error_file_id, batch.output_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            for line in content.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                results[record["custom_id"]] = self.parse_result_record(record)
+        return results
+    
+    @staticmethod
+    def parse_result_record(record):
+        """解析输出文件中的一行，返回 (是否成功, 结果或错误信息)"""
+        error = record.get("error")
+        if error:
+            return False, error.get("message", str(error)) if isinstance(error, dict) else str(error)
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code", 200) != 200:
+            message = body.get("error", {}).get("message") if isinstance(body.get("error"), dict) else None
+            return False, message or f"HTTP {response.get('status_code')}"
+        try:
+            return True, body["choices"][0]["message"]["content"].strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return False, "无法解析的批处理结果"
+    
+    def locate_row(self, dataframe, row_index, row_key, key_columns, rows_by_key):
+        """
+        结果对应的当前行：原行号处的行键一致时直接使用，否则按行键查找（插入或删除行后行号会变化）；
+        找不到或匹配到多行时返回None。rows_by_key为按需建立的 {行键: [行号]} 索引
+        """
+        if 0 <= row_index < len(dataframe) and self.compute_key(dataframe, row_index, key_columns) == row_key:
+            return row_index
+        if not rows_by_key:
+            for row, key in enumerate(compute_row_keys(dataframe, key_columns)):
+                rows_by_key.setdefault(key[:ROW_KEY_LENGTH], []).append(row)
+        candidates = rows_by_key.get(row_key, [])
+        return candidates[0] if len(candidates) == 1 else None
+    
+    def apply_results(self, dataframe, results, request_bodies=None, ai_columns=None):
+        """将结果写回数据框，成功结果同时写入响应缓存，返回 (成功数, 失败数, 找不到对应行的结果数)"""
+        success_count = 0
+        error_count = 0
+        unmatched_count = 0
+        key_columns = get_key_columns(dataframe, ai_columns or {})
+        rows_by_key = {}
+        for custom_id, (success, value) in results.items():
+            column_name, row_index, row_key = self.parse_custom_id(custom_id)
+            if column_name not in dataframe.columns:
+                continue
+            row_index = self.locate_row(dataframe, row_index, row_key, key_columns, rows_by_key)
+            if row_index is None:
+                unmatched_count += 1
+                continue
+            if success:
+                dataframe.loc[row_index, column_name] = value
+                success_count += 1
+                body = (request_bodies or {}).get(custom_id)
+                self.ai_processor.write_journal(dataframe, row_index, column_name, value,
+                                                body["model"] if body else None)
+                if body:
+                    prompt = body["messages"][-1]["content"]
+                    cache_key = self.ai_processor.get_cache_key(prompt, body["model"])
+                    self.ai_processor.store_cached_result(cache_key, body["model"], value)
+                    self.ai_processor.record_fingerprints(column_name, [prompt], [body["model"]])
+            else:
+                dataframe.loc[row_index, column_name] = f"错误: {value}"
+                error_count += 1
+        if self.ai_processor.journal is not None:
+            self.ai_processor.journal.flush()
+        return success_count, error_count, unmatched_count
+    
+    def start(self, dataframe, ai_columns, columns=None):
+        """渲染待处理单元格并提交任务，返回 (任务ID, 请求列表)；没有待处理单元格时任务ID为None"""
+        requests = self.build_requests(dataframe, ai_columns, columns)
+        if not requests:
+            return None, requests
+        file_path = self.write_request_file(requests)
+        try:
+            batch_id = self.submit(file_path)
+        finally:
+            os.remove(file_path)
+        return batch_id, requests
+    
+    def finish(self, dataframe, batch, requests, ai_columns):
+        """
+        下载已结束任务的结果并写回数据框，取消或过期的任务写回已完成部分的结果
+        （未返回的单元格保持待处理，下次提交时处理），返回 (是否成功, 消息)
+        """
+        if batch.status not in BATCH_RESULT_STATUSES:
+            return False, f"批处理任务失败: {batch.id} 状态 {batch.status}"
+        results = self.download_results(batch)
+        request_bodies = {request["custom_id"]: request["body"] for request in requests}
+        success_count, error_count, unmatched_count = self.apply_results(dataframe, results, request_bodies, ai_columns)
+        missing_count = len(requests) - len(results)
+        title = "批处理完成" if batch.status == "completed" else f"批处理任务已{'取消' if batch.status == 'cancelled' else '过期'}，已写回部分结果"
+        message = f"{title}: 成功 {success_count}，失败 {error_count}，共 {len(requests)} 个请求"
+        if missing_count > 0:
+            message += f"，{missing_count} 个无返回"
+        if unmatched_count > 0:
+            message += f"，{unmatched_count} 个结果的行已删除或内容已改变，未写回"
+        return True, message
+    
+    def run(self, dataframe, ai_columns, columns=None, poll_interval=None, progress_callback=None):
+        """
+        完整流程（阻塞）：渲染待处理单元格 -> 提交 -> 轮询 -> 写回
+        返回 (是否成功, 消息)
+        """
+        try:
+            batch_id, requests = self.start(dataframe, ai_columns, columns)
+            if batch_id is None:
+                return True, "没有待处理的单元格"
+            batch = self.wait(batch_id, poll_interval, progress_callback)
+            return self.finish(dataframe, batch, requests, ai_columns)
+        except Exception as e:
+            return False, f"批处理失败: {str(e)}"
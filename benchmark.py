@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+以data/bench.aie为样本生成1k/100k/1M行的合成表格，计时文件加载、项目保存/加载、模板渲染、导出，
+以及针对本地模拟服务（mock_server.py）的端到端AI处理，结果写入JSON文件，可与上次结果对比发现性能回退
+
+用法:
+    python benchmark.py                                   # 默认 bench,1k,100k,1M
+    python benchmark.py --sizes 1k,100k --output before.json
+    python benchmark.py --sizes 1k,100k --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from table_manager import TableManager
+from project_manager import ProjectManager
+from prompt_template import compile_template
+
+BENCH_PROJECT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bench.aie")
+ARXIV_IDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "train_id.jsonl")
+
+# 合成表格中的AI列及其模板（引用两个普通列）
+AI_COLUMN = "summary"
+AI_TEMPLATE = "用一句话总结下面的问题：{query}\n类别：{categories}"
+
+ALL_BENCHMARKS = ["render", "export", "load", "project", "e2e"]
+
+def parse_size(value):
+    """解析行数，支持 1k、100k、1M 和 bench（bench.aie原始行数）"""
+    value = value.strip()
+    if value.lower() == "bench":
+        return None
+    multipliers = {"k": 1000, "m": 1000000}
+    if value[-1].lower() in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1].lower()])
+    return int(value)
+
+def format_size(rows):
+    """行数的简短名称"""
+    if rows % 1000000 == 0:
+        return f"{rows // 1000000}M"
+    if rows % 1000 == 0:
+        return f"{rows // 1000}k"
+    return str(rows)
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """屏蔽被测代码的逐行日志输出"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def load_bench_table(work_dir):
+    """读取bench.aie（复制到工作目录，避免在data/下生成结果日志）"""
+    project_path = os.path.join(work_dir, "bench-source.aie")
+    shutil.copyfile(BENCH_PROJECT, project_path)
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    with quiet():
+        success, message = project_manager.load_project(project_path, table_manager)[:2]
+    project_manager.close_journal()
+    if not success:
+        raise RuntimeError(f"无法加载 {BENCH_PROJECT}: {message}")
+    return table_manager.get_dataframe()
+
+def load_arxiv_ids():
+    """train_id.jsonl中的arxiv_id列表"""
+    with open(ARXIV_IDS_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line)["arxiv_id"] for line in f if line.strip()]
+
+def make_table(bench_df, arxiv_ids, rows, text_length):
+    """
+    生成合成表格：循环使用bench.aie中的行（长文本截断到text_length个字符），
+    arxiv_id循环使用train_id.jsonl并加行号保证行键唯一，另加一个空的AI列
+    rows为None时直接使用bench.aie的全部行
+    """
+    if rows is None:
+        df = bench_df.copy()
+    else:
+        positions = np.arange(rows) % len(bench_df)
+        ids = np.array(arxiv_ids, dtype=object)[np.arange(rows) % len(arxiv_ids)]
+        df = pd.DataFrame({
+            "row_id": np.arange(1, rows + 1).astype(str).astype(object),
+            "arxiv_id": ids + "-" + (np.arange(rows) // len(arxiv_ids)).astype(str).astype(object),
+            "categories": bench_df["categories"].astype(str).to_numpy(dtype=object)[positions],
+            "query": bench_df["query"].astype(str).str.slice(0, text_length).to_numpy(dtype=object)[positions],
+            "golden_answer": bench_df["golden_answer"].astype(str).str.slice(0, text_length).to_numpy(dtype=object)[positions]
+        })
+    df[AI_COLUMN] = ""
+    return df
+
+def make_table_manager(df):
+    """包含合成表格和AI列配置的TableManager"""
+    table_manager = TableManager()
+    table_manager.dataframe = df
+    table_manager.ai_columns = {AI_COLUMN: {"prompt": AI_TEMPLATE, "model": "gpt-4.1"}}
+    return table_manager
+
+def time_runs(func, repeat, setup=None, verbose=False):
+    """运行repeat次并返回每次的耗时（秒）；setup在每次计时前执行，不计入耗时"""
+    times = []
+    value = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        with quiet(not verbose):
+            start = time.perf_counter()
+            value = func()
+            times.append(time.perf_counter() - start)
+    return times, value
+
+def make_result(benchmark, variant, dataset, rows, times, **extra):
+    """一条机器可读的结果"""
+    median = statistics.median(times)
+    result = {
+        "benchmark": benchmark,
+        "variant": variant,
+        "dataset": dataset,
+        "rows": rows,
+        "runs": [round(t, 6) for t in times],
+        "median": round(median, 6),
+        "min": round(min(times), 6),
+        "rows_per_sec": round(rows / median, 1) if median > 0 else None
+    }
+    result.update(extra)
+    return result
+
+def make_skipped(benchmark, variant, dataset, rows, reason):
+    """跳过的项目也写入结果，便于对比时区分"""
+    return {"benchmark": benchmark, "variant": variant, "dataset": dataset, "rows": rows, "skipped": reason}
+
+def bench_render(ctx):
+    """模板渲染：整列向量化渲染与逐行渲染"""
+    df = ctx["df"]
+    template = compile_template(AI_TEMPLATE)
+    results = []
+    times, _ = time_runs(lambda: template.render_rows(df), ctx["repeat"], verbose=ctx["verbose"])
+    results.append(make_result("render", "render_rows", ctx["dataset"], len(df), times))
+    
+    rows = min(len(df), ctx["row_loop_max_rows"])
+    times, _ = time_runs(lambda: [template.render_row(df, i) for i in range(rows)], ctx["repeat"],
+                         verbose=ctx["verbose"])
+    results.append(make_result("render", "render_row", ctx["dataset"], rows, times))
+    return results
+
+def bench_export(ctx):
+    """导出CSV、JSONL和Excel（导出的文件同时作为加载测试的输入）"""
+    table_manager = make_table_manager(ctx["df"])
+    results = []
+    for variant, method in (("csv", table_manager.export_csv), ("jsonl", table_manager.export_jsonl),
+                            ("xlsx", table_manager.export_excel)):
+        path = os.path.join(ctx["work_dir"], f"{ctx['dataset']}.{variant}")
+        if variant == "xlsx" and len(ctx["df"]) > ctx["xlsx_max_rows"]:
+            results.append(make_skipped("export", variant, ctx["dataset"], len(ctx["df"]),
+                                        f"超过--xlsx-max-rows ({ctx['xlsx_max_rows']})"))
+            continue
+        times, _ = time_runs(lambda: method(path), ctx["repeat"], verbose=ctx["verbose"])
+        ctx["files"][variant] = path
+        results.append(make_result("export", variant, ctx["dataset"], len(ctx["df"]), times,
+                                   bytes=os.path.getsize(path)))
+    return results
+
+def bench_load(ctx):
+    """TableManager.load_file 加载CSV、JSONL和Excel"""
+    results = []
+    for variant in ("csv", "jsonl", "xlsx"):
+        path = ctx["files"].get(variant)
+        if path is None:
+            path = os.path.join(ctx["work_dir"], f"{ctx['dataset']}.{variant}")
+            if variant == "xlsx" and len(ctx["df"]) > ctx["xlsx_max_rows"]:
+                results.append(make_skipped("load", variant, ctx["dataset"], len(ctx["df"]),
+                                            f"超过--xlsx-max-rows ({ctx['xlsx_max_rows']})"))
+                continue
+            # 未运行导出测试时先准备输入文件
+            with quiet(not ctx["verbose"]):
+                getattr(make_table_manager(ctx["df"]), f"export_{'excel' if variant == 'xlsx' else variant}")(path)
+            ctx["files"][variant] = path
+        
+        def load():
+            table_manager = TableManager()
+            if not table_manager.load_file(path):
+                raise RuntimeError(f"加载失败: {path}")
+            return table_manager
+        
+        times, table_manager = time_runs(load, ctx["repeat"], verbose=ctx["verbose"])
+        results.append(make_result("load", variant, ctx["dataset"], len(table_manager.get_dataframe()), times,
+                                   bytes=os.path.getsize(path)))
+    return results
+
+def bench_project(ctx):
+    """ProjectManager.save_project 和 load_project"""
+    table_manager = make_table_manager(ctx["df"])
+    project_path = os.path.join(ctx["work_dir"], f"{ctx['dataset']}.aie")
+    results = []
+    
+    def save():
+        project_manager = ProjectManager()
+        success, message = project_manager.save_project(project_path, table_manager)
+        project_manager.close_journal()
+        if not success:
+            raise RuntimeError(message)
+    
+    times, _ = time_runs(save, ctx["repeat"], verbose=ctx["verbose"])
+    results.append(make_result("project", "save", ctx["dataset"], len(ctx["df"]), times,
+                               bytes=os.path.getsize(project_path)))
+    
+    def load():
+        project_manager = ProjectManager()
+        success, message = project_manager.load_project(project_path, TableManager())[:2]
+        project_manager.close_journal()
+        if not success:
+            raise RuntimeError(message)
+    
+    times, _ = time_runs(load, ctx["repeat"], verbose=ctx["verbose"])
+    results.append(make_result("project", "load", ctx["dataset"], len(ctx["df"]), times,
+                               bytes=os.path.getsize(project_path)))
+    return results
+
+def bench_e2e(ctx):
+    """端到端AI处理：对模拟服务逐个请求和多行打包各运行一次（行数受--e2e-max-rows限制）"""
+    from ai_processor import AIProcessor
+    
+    rows = min(len(ctx["df"]), ctx["e2e_max_rows"])
+    results = []
+    for variant, pack_size in (("single", 1), (f"pack{ctx['pack_size']}", ctx["pack_size"])):
+        if pack_size < 2 and variant != "single":
+            continue
+        ai_columns = {AI_COLUMN: {"prompt": AI_TEMPLATE, "model": "gpt-4.1", "pack_size": pack_size}}
+        holder = {}
+        
+        def setup():
+            # 每次使用新的处理器和未处理的表格，避免并发控制器和缓存的状态影响下一次
+            holder["df"] = ctx["df"].iloc[:rows].copy()
+            with quiet(not ctx["verbose"]):
+                holder["processor"] = AIProcessor()
+            holder["tasks"] = holder["processor"].build_tasks(holder["df"], ai_columns)
+        
+        def run():
+            processor = holder["processor"]
+            return processor.process_tasks(holder["df"], holder["tasks"], processor.max_concurrency,
+                                           None, None, None)
+        
+        times, task_results = time_runs(run, ctx["repeat"], setup=setup, verbose=ctx["verbose"])
+        stats = holder["processor"].last_batch_stats
+        results.append(make_result("e2e", variant, ctx["dataset"], rows, times,
+                                   success=sum(1 for result in task_results if result["success"]),
+                                   requests=stats.get("requests"),
+                                   attempts=sum(result.get("attempts", 1) for result in task_results)))
+    return results
+
+BENCHMARKS = {
+    "render": bench_render,
+    "export": bench_export,
+    "load": bench_load,
+    "project": bench_project,
+    "e2e": bench_e2e
+}
+
+def get_git_commit():
+    """当前代码版本（非git仓库时为None）"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare_results(current, baseline, threshold):
+    """与基线结果对比，输出每项的耗时比例，返回回退（比基线慢threshold倍以上）的项目列表"""
+    baseline_by_key = {(r["benchmark"], r["variant"], r["dataset"]): r for r in baseline.get("results", [])
+                       if "median" in r}
+    regressions = []
+    print(f"\n{'项目':<32}{'基线':>12}{'当前':>12}{'比例':>9}")
+    for result in current["results"]:
+        key = (result["benchmark"], result["variant"], result["dataset"])
+        old = baseline_by_key.get(key)
+        if "median" not in result or old is None or old["rows"] != result["rows"]:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] > 0 else float("inf")
+        flag = "  回退" if ratio > threshold else ""
+        print(f"{'/'.join(key):<32}{old['median']:>11.4f}s{result['median']:>11.4f}s{ratio:>8.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+def run_benchmarks(args):
+    """运行所选的基准测试，返回结果字典"""
+    sizes = [parse_size(size) for size in args.sizes.split(",") if size.strip()]
+    names = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"未知的基准测试: {', '.join(unknown)}（可选: {', '.join(ALL_BENCHMARKS)}）")
+    
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="aie-bench-", dir=args.work_dir)
+    server = None
+    saved_env = {key: os.environ.get(key) for key in ("OPENAI_BASE_URL", "OPENAI_API_KEY", "AI_CACHE",
+                                                      "AI_MAX_CONCURRENCY", "AI_ENDPOINTS")}
+    if "e2e" in names:
+        from mock_server import MockConfig, start_server
+        server = start_server(MockConfig(latency=args.mock_latency, rate_429=args.mock_rate_429,
+                                         rate_5xx=args.mock_rate_5xx, retry_after=0.1, seed=args.seed))
+        # 处理器在初始化时读取这些配置；关闭响应缓存，否则重复运行会直接命中缓存
+        os.environ.update(OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY="mock", AI_CACHE="0",
+                          AI_MAX_CONCURRENCY=str(args.concurrency))
+        os.environ.pop("AI_ENDPOINTS", None)
+    
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": get_git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args)
+        },
+        "results": []
+    }
+    try:
+        bench_df = load_bench_table(work_dir)
+        arxiv_ids = load_arxiv_ids()
+        for rows in sizes:
+            dataset = "bench" if rows is None else format_size(rows)
+            df = make_table(bench_df, arxiv_ids, rows, args.text_length)
+            ctx = {
+                "dataset": dataset,
+                "df": df,
+                "work_dir": work_dir,
+                "files": {},
+                # 百万行及以上只运行一次
+                "repeat": args.repeat if len(df) < 1000000 else 1,
+                "verbose": args.verbose,
+                "xlsx_max_rows": args.xlsx_max_rows,
+                "e2e_max_rows": args.e2e_max_rows,
+                "row_loop_max_rows": args.row_loop_max_rows,
+                "pack_size": args.pack_size
+            }
+            for name in ALL_BENCHMARKS:
+                if name not in names:
+                    continue
+                print(f"[{dataset}] {name} ...", flush=True)
+                for result in BENCHMARKS[name](ctx):
+                    report["results"].append(result)
+                    if "skipped" in result:
+                        print(f"    {result['variant']:<10} 跳过: {result['skipped']}", flush=True)
+                    else:
+                        print(f"    {result['variant']:<10} {result['rows']:>9}行  中位数 {result['median']:.4f}s  "
+                              f"{result['rows_per_sec'] or 0:,.0f}行/秒", flush=True)
+            del df, ctx
+            gc.collect()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        if args.keep:
+            print(f"测试文件保留在: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+def build_parser():
+    """命令行参数"""
+    parser = argparse.ArgumentParser(description="AI Excel 性能基准测试")
+    parser.add_argument("--sizes", default="bench,1k,100k,1M",
+                        help="数据规模（逗号分隔），bench表示bench.aie原始数据，默认 bench,1k,100k,1M")
+    parser.add_argument("--benchmarks", default=",".join(ALL_BENCHMARKS),
+                        help=f"要运行的测试（逗号分隔），默认全部: {','.join(ALL_BENCHMARKS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取中位数），百万行及以上只运行一次")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    parser.add_argument("--threshold", type=float, default=1.2, help="比基线慢多少倍视为回退，默认1.2")
+    parser.add_argument("--text-length", type=int, default=120, help="合成表格中长文本列截断的字符数")
+    parser.add_argument("--xlsx-max-rows", type=int, default=100000, help="超过该行数时跳过Excel导出和加载")
+    parser.add_argument("--row-loop-max-rows", type=int, default=100000, help="逐行渲染对照测试的最大行数")
+    parser.add_argument("--e2e-max-rows", type=int, default=5000, help="端到端处理的最大行数")
+    parser.add_argument("--pack-size", type=int, default=10, help="端到端测试中多行打包的每包行数")
+    parser.add_argument("--concurrency", type=int, default=32, help="端到端测试的最大并发请求数")
+    parser.add_argument("--mock-latency", default="uniform:0.01,0.05", help="模拟服务的延迟分布（见mock_server.py）")
+    parser.add_argument("--mock-rate-429", type=float, default=0.0, help="模拟服务返回429的比例")
+    parser.add_argument("--mock-rate-5xx", type=float, default=0.0, help="模拟服务返回5xx的比例")
+    parser.add_argument("--seed", type=int, default=42, help="模拟服务的随机种子")
+    parser.add_argument("--work-dir", help="临时文件目录，默认系统临时目录")
+    parser.add_argument("--keep", action="store_true", help="保留生成的测试文件")
+    parser.add_argument("--verbose", action="store_true", help="显示被测代码的日志输出")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        report = run_benchmarks(args)
+    except (ValueError, RuntimeError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {args.output}")
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)}项比基线慢{args.threshold}倍以上", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
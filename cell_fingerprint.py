@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单元格指纹
+记录每个AI结果生成时的 (模型, 渲染后prompt) 指纹，
+重新处理时向量化比对，只发送输入、模板或模型发生变化的单元格；
+单元格的内容本身不参与比对，手动修改过的结果不会被当作过期而覆盖
+"""
+
+import numpy as np
+import pandas as pd
+
+# 模型和prompt之间的分隔符，避免拼接后产生歧义
+SEPARATOR = "\x1f"
+
+def hash_strings(values):
+    """向量化计算字符串数组的64位哈希"""
+    values = np.asarray(values, dtype=object)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    strings = np.fromiter(map(str, values), dtype=object, count=len(values))
+    return pd.util.hash_array(strings, categorize=False)
+
+def fingerprint_prompts(prompts, models):
+    """计算 (模型, prompt) 指纹，models可以是单个模型名或与prompts等长的数组"""
+    prompts = np.asarray(prompts, dtype=object)
+    if isinstance(models, str):
+        keys = (models + SEPARATOR) + prompts
+    else:
+        keys = np.asarray(models, dtype=object) + SEPARATOR + prompts
+    return hash_strings(keys)
+
+class FingerprintStore:
+    """
+    按列保存已生成结果的指纹集合
+    与行位置无关：排序、插入或删除行后，同样输入的单元格仍能判断是否为最新结果
+    """
+    def __init__(self):
+        self.columns = {}  # {列名: 排序去重的指纹数组(uint64)}
+    
+    def clear(self):
+        """清空所有指纹"""
+        self.columns = {}
+    
+    def has_column(self, column_name):
+        """该列是否有指纹记录"""
+        return column_name in self.columns and len(self.columns[column_name]) > 0
+    
+    def record(self, column_name, fingerprints):
+        """记录一批新生成结果的指纹"""
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        if len(fingerprints) == 0:
+            return
+        old_entries = self.columns.get(column_name)
+        if old_entries is not None and len(old_entries) > 0:
+            fingerprints = np.concatenate([old_entries, fingerprints])
+        self.columns[column_name] = np.unique(fingerprints)
+    
+    def stale_mask(self, column_name, fingerprints):
+        """返回布尔数组：当前 (模型, prompt) 没有生成记录（输入、模板或模型已变化）"""
+        fingerprints = np.asarray(fingerprints, dtype=np.uint64)
+        entries = self.columns.get(column_name)
+        if entries is None or len(entries) == 0:
+            return np.ones(len(fingerprints), dtype=bool)
+        return ~np.isin(fingerprints, entries)
+    
+    def prune(self, column_name, fingerprints):
+        """只保留当前表格中仍然存在的指纹（删除行或列后调用，避免指纹库无限增长）"""
+        entries = self.columns.get(column_name)
+        if entries is None:
+            return
+        entries = entries[np.isin(entries, np.asarray(fingerprints, dtype=np.uint64))]
+        if len(entries) > 0:
+            self.columns[column_name] = entries
+        else:
+            del self.columns[column_name]
+    
+    def merge(self, other):
+        """合并另一个指纹库（如分片处理的结果）"""
+        for column_name, entries in other.columns.items():
+            self.record(column_name, entries)
+    
+    def rename_column(self, old_name, new_name):
+        """列重命名时迁移指纹"""
+        if old_name in self.columns:
+            self.columns[new_name] = self.columns.pop(old_name)
+    
+    def delete_column(self, column_name):
+        """删除列的指纹"""
+        self.columns.pop(column_name, None)
+    
+    def to_dict(self):
+        """序列化为可写入项目文件的字典（十六进制字符串）"""
+        return {
+            column_name: {"prompts": [format(int(value), '016x') for value in entries]}
+            for column_name, entries in self.columns.items() if len(entries) > 0
+        }
+    
+    def load_dict(self, data):
+        """从项目文件中的字典恢复（旧项目中的结果哈希不再使用）"""
+        self.columns = {}
+        for column_name, entries in (data or {}).items():
+            prompts = np.array([int(value, 16) for value in entries.get("prompts", [])], dtype=np.uint64)
+            if len(prompts) > 0:
+                self.columns[column_name] = np.unique(prompts)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI列依赖关系
+AI列的模板通过 {列名} 引用另一个AI列时，下游列依赖上游列的结果，
+由字段引用构成有向无环图，用于检测循环引用和确定处理顺序
+"""
+
+from prompt_template import compile_template
+
+def get_template_text(config):
+    """AI列配置中的模板文本（兼容旧格式的字符串配置）"""
+    if isinstance(config, dict):
+        return config.get("prompt", "")
+    return config or ""
+
+def get_column_dependencies(ai_columns):
+    """返回 {AI列: [模板引用的其他AI列]}，引用普通列、不存在的列或自身不构成依赖"""
+    dependencies = {}
+    for column_name, config in ai_columns.items():
+        fields = compile_template(get_template_text(config)).fields
+        dependencies[column_name] = [field for field in fields if field in ai_columns and field != column_name]
+    return dependencies
+
+def find_cycle(ai_columns):
+    """
+    查找循环引用，返回构成环的列名列表（首尾相同），没有环时返回None
+    列引用自身读取的是该单元格已有的值，不视为循环
+    """
+    dependencies = get_column_dependencies(ai_columns)
+    
+    # 深度优先搜索，0=未访问 1=在当前路径上 2=已完成
+    state = {column_name: 0 for column_name in dependencies}
+    path = []
+    
+    def visit(column_name):
+        state[column_name] = 1
+        path.append(column_name)
+        for upstream in dependencies[column_name]:
+            if state[upstream] == 1:
+                return path[path.index(upstream):] + [upstream]
+            if state[upstream] == 0:
+                cycle = visit(upstream)
+                if cycle:
+                    return cycle
+        path.pop()
+        state[column_name] = 2
+        return None
+    
+    for column_name in dependencies:
+        if state[column_name] == 0:
+            cycle = visit(column_name)
+            if cycle:
+                # 按数据流向（上游→下游）显示
+                return cycle[::-1]
+    return None
+
+def format_cycle(cycle):
+    """循环引用的提示文本"""
+    return f"AI列之间存在循环引用: {' → '.join(cycle)}"
+
+def topological_order(ai_columns):
+    """
+    按依赖关系排序AI列（上游在前），同层保持原有顺序
+    存在循环引用时抛出ValueError
+    """
+    cycle = find_cycle(ai_columns)
+    if cycle:
+        raise ValueError(format_cycle(cycle))
+    
+    dependencies = get_column_dependencies(ai_columns)
+    order = []
+    placed = set()
+    while len(order) < len(dependencies):
+        for column_name, upstreams in dependencies.items():
+            if column_name not in placed and all(upstream in placed for upstream in upstreams):
+                order.append(column_name)
+                placed.add(column_name)
+    return order
+
+def get_column_depths(ai_columns):
+    """
+    每个AI列在依赖链中的层数：不依赖其他AI列为0，否则为其上游列的最大层数+1
+    存在循环引用时抛出ValueError
+    """
+    dependencies = get_column_dependencies(ai_columns)
+    depths = {}
+    for column_name in topological_order(ai_columns):
+        depths[column_name] = max((depths[upstream] + 1 for upstream in dependencies[column_name]), default=0)
+    return depths
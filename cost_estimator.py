@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+费用和耗时预估
+在发送请求前渲染待处理的prompt（行数较多时随机抽样后外推），离线统计输入token，
+结合max_tokens和历史用量预估输出token、费用、TPM压力和预计耗时
+"""
+
+import math
+import os
+import re
+import numpy as np
+import pandas as pd
+from ai_processor import CJK_PATTERN
+from prompt_template import compile_template
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 默认单价（美元/百万token: 输入, 输出），可用 AI_PRICE_<模型>=输入,输出 覆盖
+DEFAULT_PRICES = {
+    "gpt-4.1": (2.0, 8.0),
+    "o1": (15.0, 60.0)
+}
+
+# 没有历史延迟数据时假定的单次请求耗时（秒）
+DEFAULT_LATENCY = {
+    "gpt-4.1": 3.0,
+    "o1": 30.0
+}
+
+def count_tokens_array(prompts, model=None):
+    """
+    批量统计prompt的token数，返回整数数组
+    安装了tiktoken时使用模型的分词器，否则按中日韩字符1个token/字、其余4个字符/token近似
+    """
+    prompts = [str(prompt) for prompt in prompts]
+    if len(prompts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model or "gpt-4o")
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        lengths = [len(tokens) for tokens in encoding.encode_ordinary_batch(prompts)]
+        return np.asarray(lengths, dtype=np.int64) + 4
+    
+    series = pd.Series(prompts, dtype=object)
+    lengths = series.str.len().to_numpy(dtype=np.int64)
+    cjk_counts = series.str.count(CJK_PATTERN.pattern).to_numpy(dtype=np.int64)
+    return cjk_counts + np.ceil((lengths - cjk_counts) / 4).astype(np.int64) + 4
+
+def estimate_unique_count(counts, total, sample_size):
+    """
+    由抽样中各prompt的出现次数外推全部行中不同prompt的个数：
+    抽样中重复出现的prompt视为已全部出现，只出现一次的按抽样比例放大
+    """
+    singletons = int((counts == 1).sum())
+    if sample_size >= total:
+        return len(counts)
+    return singletons * total / sample_size + (len(counts) - singletons)
+
+class CostEstimator:
+    def __init__(self, ai_processor):
+        self.ai_processor = ai_processor
+        # 待处理单元格超过该行数时只渲染随机抽样的行（0表示不抽样）
+        self.sample_rows = int(os.getenv('AI_ESTIMATE_SAMPLE_ROWS', '5000'))
+    
+    def get_price(self, model):
+        """返回模型单价 (输入, 输出)，单位美元/百万token"""
+        suffix = re.sub(r'[^0-9A-Za-z]', '_', model).upper()
+        value = os.getenv(f'AI_PRICE_{suffix}')
+        if value:
+            try:
+                input_price, output_price = (float(part) for part in value.split(","))
+                return input_price, output_price
+            except ValueError:
+                print(f"AI_PRICE_{suffix} 格式错误，应为 输入单价,输出单价")
+        return DEFAULT_PRICES.get(model, DEFAULT_PRICES["gpt-4.1"])
+    
+    def get_latency(self, model):
+        """单次请求的预计耗时：优先使用本次运行的历史平均延迟"""
+        stats = self.ai_processor.usage_stats.get(model)
+        if stats and stats["requests"] > 0:
+            return stats["latency"] / stats["requests"]
+        return float(os.getenv('AI_ESTIMATED_LATENCY', DEFAULT_LATENCY.get(model, 3.0)))
+    
+    def get_calibration(self, model):
+        """近似分词与实际prompt_tokens的比例（没有历史用量或使用tiktoken时为1）"""
+        stats = self.ai_processor.usage_stats.get(model)
+        if tiktoken is None and stats and stats["estimated_prompt_tokens"] > 0:
+            return stats["prompt_tokens"] / stats["estimated_prompt_tokens"]
+        return 1.0
+    
+    def get_output_limit(self, model):
+        """单次请求的输出token上限"""
+        return self.ai_processor.o1_output_tokens if model == "o1" else self.ai_processor.max_tokens
+    
+    def predict_output_tokens(self, dataframe, column_name, model, pending_rows):
+        """
+        预估单次请求的平均输出token：
+        优先使用本次运行的实际completion_tokens，其次用该列已有结果的长度，都没有时按输出上限计
+        """
+        stats = self.ai_processor.usage_stats.get(model)
+        if stats and stats["usage_requests"] > 0:
+            return stats["completion_tokens"] / stats["usage_requests"], "历史用量"
+        
+        if column_name in dataframe.columns:
+            done_mask = np.ones(len(dataframe), dtype=bool)
+            done_mask[pending_rows] = False
+            done_values = dataframe[column_name].to_numpy(dtype=object)[done_mask]
+            if len(done_values) > 0:
+                # 最多抽样1万个已有结果
+                if len(done_values) > 10000:
+                    done_values = done_values[np.linspace(0, len(done_values) - 1, 10000).astype(np.int64)]
+                output_tokens = count_tokens_array(done_values, model) - 4
+                return float(min(output_tokens.mean(), self.get_output_limit(model))), "已有结果"
+        
+        return float(self.get_output_limit(model)), "输出上限"
+    
+    def estimate_column(self, dataframe, column_name, config, only_pending=True):
+        """预估单个AI列"""
+        prompt_template, model = self.ai_processor.get_column_config(config)
+        pack_size = self.ai_processor.get_pack_size(config)
+        
+        if only_pending:
+            rows = self.ai_processor.get_pending_rows(dataframe, column_name)
+        else:
+            rows = list(range(len(dataframe)))
+        
+        # 行数较多时渲染和分词只处理随机抽样的行（固定种子，结果可复现；等距抽样会与重复的数据周期重合）
+        sample_rows = rows
+        if 0 < self.sample_rows < len(rows):
+            positions = np.sort(np.random.default_rng(0).choice(len(rows), self.sample_rows, replace=False))
+            sample_rows = np.asarray(rows)[positions]
+        
+        prompts = compile_template(prompt_template).render_rows(dataframe, sample_rows)
+        counts = pd.Series(prompts, dtype=object).value_counts(sort=False)
+        unique_count = estimate_unique_count(counts.to_numpy(), len(rows), len(sample_rows))
+        requests = math.ceil(unique_count / pack_size)
+        
+        tokens_per_prompt = float(count_tokens_array(counts.index, model).mean()) if len(counts) else 0.0
+        input_tokens = tokens_per_prompt * unique_count * self.get_calibration(model)
+        output_per_prompt, output_source = self.predict_output_tokens(dataframe, column_name, model, rows)
+        output_tokens = output_per_prompt * unique_count
+        max_output_tokens = float(self.get_output_limit(model)) * unique_count
+        
+        input_price, output_price = self.get_price(model)
+        return {
+            "column_name": column_name,
+            "model": model,
+            "cells": len(rows),
+            "unique_prompts": round(unique_count),
+            "sampled_rows": len(sample_rows) if len(sample_rows) < len(rows) else None,
+            "requests": requests,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "max_output_tokens": max_output_tokens,
+            "output_source": output_source,
+            "cost": (input_tokens * input_price + output_tokens * output_price) / 1_000_000,
+            "max_cost": (input_tokens * input_price + max_output_tokens * output_price) / 1_000_000
+        }
+    
+    def estimate(self, dataframe, ai_columns, only_pending=True):
+        """
+        预估所有AI列，返回:
+        {"columns": [每列预估], "models": {模型: 汇总及耗时}, "cells", "requests", "cost", "max_cost", "seconds"}
+        """
+        columns = [self.estimate_column(dataframe, column_name, config, only_pending)
+                   for column_name, config in ai_columns.items()]
+        
+        models = {}
+        for column in columns:
+            summary = models.setdefault(column["model"], {"requests": 0, "input_tokens": 0.0, "output_tokens": 0.0})
+            summary["requests"] += column["requests"]
+            summary["input_tokens"] += column["input_tokens"]
+            summary["output_tokens"] += column["output_tokens"]
+        
+        concurrency = max(1, self.ai_processor.max_concurrency)
+        for model, summary in models.items():
+            limits = self.ai_processor.get_rate_limit_config(model)
+            total_tokens = summary["input_tokens"] + summary["output_tokens"]
+            
+            # 并发、RPM、TPM三者中最慢的决定耗时
+            times = {"并发": summary["requests"] * self.get_latency(model) / concurrency}
+            if limits["rpm"] > 0:
+                times["RPM"] = summary["requests"] / limits["rpm"] * 60
+            if limits["tpm"] > 0:
+                times["TPM"] = total_tokens / limits["tpm"] * 60
+            bottleneck = max(times, key=times.get)
+            summary["seconds"] = times[bottleneck]
+            summary["bottleneck"] = bottleneck
+            
+            # 按并发速度运行时每分钟需要的token占TPM限额的比例
+            if limits["tpm"] > 0 and times["并发"] > 0:
+                summary["tpm_pressure"] = total_tokens / (times["并发"] / 60) / limits["tpm"]
+            else:
+                summary["tpm_pressure"] = None
+        
+        return {
+            "columns": columns,
+            "models": models,
+            "cells": sum(column["cells"] for column in columns),
+            "requests": sum(column["requests"] for column in columns),
+            "cost": sum(column["cost"] for column in columns),
+            "max_cost": sum(column["max_cost"] for column in columns),
+            # 不同模型的限速相互独立，并行运行时取最慢的模型
+            "seconds": max((summary["seconds"] for summary in models.values()), default=0.0)
+        }
+
+def format_duration(seconds):
+    """把秒数格式化为易读的时长"""
+    if seconds < 60:
+        return f"{seconds:.0f}秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}分钟"
+    return f"{seconds / 3600:.1f}小时"
+
+def format_estimate(estimate):
+    """生成预估报告文本"""
+    lines = [
+        f"待处理单元格: {estimate['cells']}  预计请求: {estimate['requests']}",
+        f"预计费用: ${estimate['cost']:.2f}（输出全部达到上限时 ${estimate['max_cost']:.2f}）",
+        f"预计耗时: {format_duration(estimate['seconds'])}"
+    ]
+    for column in estimate["columns"]:
+        lines.append(
+            f"  • {column['column_name']} ({column['model']}): {column['cells']}格 / {column['requests']}次请求，"
+            f"输入≈{column['input_tokens']:,.0f} 输出≈{column['output_tokens']:,.0f} token"
+            f"（按{column['output_source']}），${column['cost']:.2f}"
+            + (f"，抽样{column['sampled_rows']}行估算" if column.get("sampled_rows") else "")
+        )
+    for model, summary in estimate["models"].items():
+        text = f"  [{model}] 瓶颈: {summary['bottleneck']}，耗时≈{format_duration(summary['seconds'])}"
+        if summary["tpm_pressure"] is not None:
+            text += f"，TPM压力 {summary['tpm_pressure'] * 100:.0f}%"
+        lines.append(text)
+    return "\n".join(lines)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多端点负载均衡
+管理多个API Key/网关，每个端点有独立的客户端、权重、可用模型、限速和自适应并发，
+按"在途请求数/权重"最小选择端点，连续失败的端点被暂时摘除并定期做健康检查
+"""
+
+import json
+import os
+import threading
+import time
+
+class Endpoint:
+    def __init__(self, name, client, rate_limiter, weight=1.0, models=None, concurrency=None):
+        self.name = name
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency  # 自适应并发控制器（限流和Retry-After暂停只作用于本端点）
+        self.weight = max(float(weight), 0.001)
+        self.models = set(models or [])  # 为空表示支持所有模型
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejection_count = 0
+    
+    def supports(self, model):
+        """端点是否可用于该模型"""
+        return not self.models or model in self.models
+    
+    def is_ejected(self, now=None):
+        """是否处于摘除期"""
+        return (now or time.monotonic()) < self.ejected_until
+
+class EndpointPool:
+    """
+    端点池
+    acquire/release之间计为在途请求；连续失败max_failures次的端点摘除一段时间（每次翻倍，上限max_ejection），
+    摘除期满后先放行请求试探，成功即恢复；设置了健康检查间隔时后台线程会主动探测被摘除的端点，close()时停止；
+    只有一个端点时摘除没有可切换的目标，不做摘除；
+    各端点的并发控制器与端点池共用一个条件变量，任一端点释放名额、调整上限时唤醒等待的请求
+    """
+    def __init__(self, endpoints, max_failures=3, base_ejection=30.0, max_ejection=600.0, health_interval=0.0):
+        if not endpoints:
+            raise ValueError("至少需要一个API端点")
+        self.endpoints = endpoints
+        self.max_failures = max_failures
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.condition = threading.Condition()
+        for endpoint in endpoints:
+            if endpoint.concurrency is not None:
+                endpoint.concurrency.condition = self.condition
+        
+        self.health_interval = health_interval
+        self.stop_event = threading.Event()
+        self.health_thread = None
+        if health_interval > 0 and len(endpoints) > 1:
+            self.health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self.health_thread.start()
+    
+    def acquire(self, model, limited=False):
+        """
+        选择一个可用于该模型的端点并计入在途请求；所有端点都被摘除时选择最早恢复的端点
+        limited为True时只在有空闲并发名额且不在暂停期的端点中选择并占用一个名额，都没有时等待
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                candidates = [e for e in self.endpoints if e.supports(model)]
+                if not candidates:
+                    raise ValueError(f"没有支持模型 {model} 的API端点")
+                healthy = [e for e in candidates if not e.is_ejected(now)]
+                if not healthy:
+                    healthy = [min(candidates, key=lambda e: e.ejected_until)]
+                if limited:
+                    available = [e for e in healthy if e.concurrency.has_capacity(now)]
+                    if not available:
+                        # 等待名额释放、上限调整，或最早的暂停期结束
+                        pauses = [e.concurrency.paused_until - now for e in healthy
+                                  if e.concurrency.paused_until > now]
+                        self.condition.wait(timeout=min(pauses) if pauses else None)
+                        continue
+                    healthy = available
+                endpoint = min(healthy, key=lambda e: (e.outstanding + 1) / e.weight)
+                if limited:
+                    endpoint.concurrency.in_flight += 1
+                endpoint.outstanding += 1
+                endpoint.requests += 1
+                return endpoint
+    
+    def release(self, endpoint, success, count_failure=True, limited=False):
+        """
+        结束一次请求，limited为True时归还acquire占用的并发名额
+        count_failure为False的失败（如参数错误）是请求本身的问题，不影响端点健康状态
+        """
+        with self.condition:
+            endpoint.outstanding -= 1
+            if limited:
+                endpoint.concurrency.release()
+            if success:
+                # 只在被摘除过的端点重新可用时提示，单端点的偶发失败后不刷屏
+                if endpoint.ejection_count and len(self.endpoints) > 1:
+                    print(f"API端点 {endpoint.name} 已恢复")
+                endpoint.consecutive_failures = 0
+                endpoint.ejection_count = 0
+                endpoint.ejected_until = 0.0
+                return
+            if not count_failure:
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.max_failures and len(self.endpoints) > 1:
+                self._eject(endpoint)
+    
+    def _eject(self, endpoint):
+        """摘除端点（调用方持有锁）"""
+        duration = min(self.max_ejection, self.base_ejection * (2 ** endpoint.ejection_count))
+        endpoint.ejection_count += 1
+        endpoint.consecutive_failures = 0
+        endpoint.ejected_until = time.monotonic() + duration
+        print(f"API端点 {endpoint.name} 连续失败，摘除 {duration:.0f} 秒")
+    
+    def check_health(self, endpoint):
+        """探测端点是否可用（列出模型），可用时提前结束摘除"""
+        try:
+            endpoint.client.models.list()
+        except Exception as e:
+            print(f"API端点 {endpoint.name} 健康检查失败: {e}")
+            return False
+        with self.condition:
+            endpoint.ejected_until = 0.0
+            endpoint.consecutive_failures = 0
+        print(f"API端点 {endpoint.name} 健康检查通过")
+        return True
+    
+    def _health_loop(self):
+        """后台定期检查被摘除的端点，直到close()"""
+        while not self.stop_event.wait(self.health_interval):
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                if endpoint.is_ejected(now):
+                    self.check_health(endpoint)
+    
+    def close(self):
+        """停止健康检查线程"""
+        self.stop_event.set()
+        if self.health_thread is not None:
+            self.health_thread.join(timeout=1.0)
+            self.health_thread = None
+    
+    def get_stats(self):
+        """各端点的请求统计"""
+        with self.condition:
+            now = time.monotonic()
+            return [{
+                "name": e.name,
+                "weight": e.weight,
+                "outstanding": e.outstanding,
+                "requests": e.requests,
+                "failures": e.failures,
+                "ejected": e.is_ejected(now)
+            } for e in self.endpoints]
+
+def load_endpoint_configs(value):
+    """
+    解析AI_ENDPOINTS：JSON数组，或指向JSON文件的路径
+    每项: {"name", "base_url", "api_key" 或 "api_key_env", "weight", "models", "rpm", "tpm"}
+    """
+    if not value:
+        return []
+    value = value.strip()
+    if not value.startswith("["):
+        with open(value, 'r', encoding='utf-8') as f:
+            value = f.read()
+    configs = json.loads(value)
+    if not isinstance(configs, list):
+        raise ValueError("AI_ENDPOINTS 应为端点配置数组")
+    for i, config in enumerate(configs):
+        if config.get("api_key_env"):
+            config["api_key"] = os.getenv(config["api_key_env"])
+        if not config.get("api_key"):
+            raise ValueError(f"第{i + 1}个API端点缺少api_key")
+        config.setdefault("name", config.get("base_url") or f"endpoint-{i + 1}")
+    return configs
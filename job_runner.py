@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台任务
+AI处理在后台线程中运行，结果和流式片段放入线程安全队列，
+由界面线程定时取出并只刷新变化的单元格，处理期间窗口保持响应；任务可暂停、继续和取消
+"""
+
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+JOB_QUEUED = "排队中"
+JOB_RUNNING = "运行中"
+JOB_PAUSED = "已暂停"
+JOB_CANCELLED = "已取消"
+JOB_DONE = "已完成"
+JOB_FAILED = "失败"
+
+JOB_FINAL_STATUSES = {JOB_CANCELLED, JOB_DONE, JOB_FAILED}
+
+class AIJob:
+    """
+    一个后台AI处理任务
+    作为process_tasks的control参数：工作线程发送请求前调用wait_while_paused，暂停时阻塞，取消后返回False
+    """
+    def __init__(self, job_id, name, dataframe, tasks, on_complete=None):
+        self.id = job_id
+        self.name = name
+        self.dataframe = dataframe
+        self.tasks = tasks
+        self.on_complete = on_complete
+        self.total = len(tasks)
+        self.completed = 0
+        self.success_count = 0
+        self.status = JOB_QUEUED
+        self.results = None
+        self.stats = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.running_event = threading.Event()
+        self.running_event.set()
+        self.cancel_event = threading.Event()
+    
+    def pause(self):
+        """暂停：已发出的请求继续完成，尚未发出的请求等待继续"""
+        if self.status in (JOB_QUEUED, JOB_RUNNING):
+            self.running_event.clear()
+            self.status = JOB_PAUSED
+    
+    def resume(self):
+        """继续暂停的任务"""
+        if self.status == JOB_PAUSED:
+            self.status = JOB_RUNNING if self.started_at else JOB_QUEUED
+            self.running_event.set()
+    
+    def cancel(self):
+        """取消：尚未发出的请求不再发送，对应单元格保持原值"""
+        if self.status not in JOB_FINAL_STATUSES:
+            self.cancel_event.set()
+            self.running_event.set()
+    
+    def is_cancelled(self):
+        """是否已请求取消"""
+        return self.cancel_event.is_set()
+    
+    def wait_while_paused(self):
+        """暂停时阻塞到继续或取消，返回是否应继续发送请求"""
+        self.running_event.wait()
+        return not self.cancel_event.is_set()
+    
+    def get_elapsed(self):
+        """任务运行时长（秒）"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+class JobRunner:
+    """
+    后台任务执行器
+    任务按提交顺序在后台线程中执行（默认同时只运行一个，避免多个任务同时写同一张表），
+    事件队列中的 结果/流式片段/任务结束 由界面线程调用drain取出
+    """
+    def __init__(self, ai_processor, max_jobs=None):
+        self.ai_processor = ai_processor
+        self.max_jobs = max_jobs or int(os.getenv('AI_MAX_JOBS', '1'))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="aie-job")
+        self.events = queue.Queue()
+        self.jobs = []
+        self.job_ids = itertools.count(1)
+    
+    def submit(self, name, dataframe, tasks, on_complete=None):
+        """提交后台任务，返回AIJob；on_complete(job)在界面线程drain时调用"""
+        job = AIJob(next(self.job_ids), name, dataframe, tasks, on_complete)
+        self.jobs.append(job)
+        self.executor.submit(self._run, job)
+        return job
+    
+    def _run(self, job):
+        """在后台线程中执行任务"""
+        if not job.wait_while_paused():
+            job.results = []
+            self.events.put(("finished", job, JOB_CANCELLED))
+            return
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            job.results = self.ai_processor.process_tasks(
+                job.dataframe, job.tasks,
+                result_callback=lambda result: self.events.put(("result", job, result)),
+                partial_callback=lambda row_index, column_name, text: self.events.put(
+                    ("partial", job, (row_index, column_name, text))),
+                control=job
+            )
+            job.stats = dict(self.ai_processor.last_batch_stats)
+            self.events.put(("finished", job, JOB_CANCELLED if job.is_cancelled() else JOB_DONE))
+        except Exception as e:
+            job.error = str(e)
+            self.events.put(("finished", job, JOB_FAILED))
+    
+    def drain(self, max_events=None):
+        """
+        在界面线程中取出事件，返回 (更新的单元格, 结束的任务)
+        更新的单元格为 {(行, 列): (任务, 文本)}，同一单元格只保留最新内容；最多处理max_events个事件
+        """
+        cells = {}
+        finished = []
+        count = 0
+        while max_events is None or count < max_events:
+            try:
+                kind, job, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+            if kind == "result":
+                job.completed += 1
+                if payload["success"]:
+                    job.success_count += 1
+                if not payload.get("cancelled"):
+                    cells[(payload["row_index"], payload["column_name"])] = (job, payload["result"])
+            elif kind == "partial":
+                row_index, column_name, text = payload
+                cells[(row_index, column_name)] = (job, text)
+            elif kind == "finished":
+                job.status = payload
+                job.finished_at = time.time()
+                finished.append(job)
+        return cells, finished
+    
+    def has_pending_events(self):
+        """队列中是否还有未取出的事件"""
+        return not self.events.empty()
+    
+    def get_active_jobs(self):
+        """未结束的任务"""
+        return [job for job in self.jobs if job.status not in JOB_FINAL_STATUSES]
+    
+    def clear_finished(self):
+        """从列表中移除已结束的任务"""
+        self.jobs = [job for job in self.jobs if job.status not in JOB_FINAL_STATUSES]
+    
+    def cancel_all(self):
+        """取消所有未结束的任务"""
+        for job in self.get_active_jobs():
+            job.cancel()
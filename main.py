@@ -9,12 +9,17 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import tkinter.simpledialog
 import pandas as pd
-from table_manager import TableManager
+from table_manager import TableManager, CHANGE_CELL, CHANGE_ROW, CHANGE_COLUMN, CHANGE_ROWS, CHANGE_ORDER
 from ai_processor import AIProcessor
+from batch_api import BatchAPIProcessor, BATCH_FINAL_STATUSES
+from cost_estimator import CostEstimator, format_estimate
+from column_dag import find_cycle, format_cycle
+from job_runner import JobRunner, JOB_FAILED, JOB_CANCELLED
+from virtual_grid import VirtualGrid
+from table_view import TableView
 from ai_column_dialog import AIColumnDialog
 from project_manager import ProjectManager
 import os
-import time
 
 class AIExcelApp:
     def __init__(self, root):
@@ -36,22 +41,32 @@ class AIExcelApp:
         
         # 初始化管理器
         self.table_manager = TableManager()
+        # 排序视图先于界面接收变更通知，界面刷新时使用的行顺序已经更新
+        self.table_view = TableView(self.table_manager)
+        self.table_manager.add_listener(self.on_table_changed)
         self.ai_processor = AIProcessor()
+        self.ai_processor.fingerprints = self.table_manager.fingerprints
+        self.batch_processor = BatchAPIProcessor(self.ai_processor)
+        self.cost_estimator = CostEstimator(self.ai_processor)
         self.project_manager = ProjectManager()
         
+        # 进行中的Batch API任务；表格代数在新建、导入、加载或清空表格时增加，换表后不再写回旧任务的结果
+        self.batch_job = None
+        self.table_generation = 0
+        
+        # 后台AI任务：结果由界面线程按固定帧率取出刷新
+        self.job_runner = JobRunner(self.ai_processor)
+        self.job_poll_id = None
+        self.jobs_window = None
+        self.ui_refresh_interval = max(10, int(1000 / float(os.getenv('AI_UI_FPS', '20'))))
+        self.ui_max_events = int(os.getenv('AI_UI_MAX_EVENTS', '5000'))
+        
         # 项目文件路径
         self.current_project_path = None
         
         # 初始化选中状态
         self.selected_row_index = None
         
-        # 添加排序状态跟踪
-        self.sort_state = {
-            'column': None,      # 当前排序的列
-            'ascending': True,   # 排序方向 True=升序, False=降序
-            'original_order': None  # 原始行顺序（未排序状态）
-        }
-        
         # 创建界面
         self.create_menu()
         self.create_toolbar()
@@ -264,8 +279,30 @@ class AIExcelApp:
         ai_submenu.add_command(label="🔄 全部处理", command=self.process_all_ai, accelerator="F5")
         ai_submenu.add_command(label="📋 单列处理", command=self.process_single_column, accelerator="F6")
         ai_submenu.add_command(label="⚡ 单元格处理", command=self.process_single_cell, accelerator="F7")
+        ai_submenu.add_command(label="⏯️ 继续未完成的处理", command=self.resume_ai_processing)
+        ai_submenu.add_command(label="🎯 只处理变化的单元格", command=self.process_stale_ai)
+        ai_submenu.add_separator()
+        ai_submenu.add_command(label="📦 Batch API后台处理", command=self.submit_batch_job)
+        ai_submenu.add_command(label="⏹️ 取消Batch任务", command=self.cancel_batch_job)
         ai_submenu.add_separator()
         ai_submenu.add_command(label="🔗 测试AI连接", command=self.test_ai_connection)
+        ai_submenu.add_command(label="💰 费用和耗时预估", command=self.show_cost_estimate)
+        ai_submenu.add_command(label="🌐 API端点状态", command=self.show_endpoint_stats)
+        ai_submenu.add_command(label="📋 后台任务", command=self.show_jobs_panel)
+        ai_submenu.add_separator()
+        
+        # 响应缓存
+        self.use_cache_var = tk.BooleanVar(value=not self.ai_processor.cache_bypass)
+        ai_submenu.add_checkbutton(label="♻️ 使用响应缓存", variable=self.use_cache_var,
+                                   command=self.toggle_response_cache)
+        ai_submenu.add_command(label="📈 缓存统计", command=self.show_cache_stats)
+        ai_submenu.add_command(label="🧹 清空响应缓存", command=self.clear_response_cache)
+        ai_submenu.add_separator()
+        
+        # 流式输出
+        self.stream_var = tk.BooleanVar(value=self.ai_processor.stream_enabled)
+        ai_submenu.add_checkbutton(label="🌊 流式输出", variable=self.stream_var,
+                                   command=self.toggle_streaming)
         
         data_menu.add_separator()
         data_menu.add_command(label="🧹 清空所有数据", command=self.clear_data)
@@ -391,15 +428,15 @@ class AIExcelApp:
         # 设置表格的外边框 - 移除不支持的选项
         # self.tree.configure(relief='solid', borderwidth=1)  # Treeview不支持这些选项
         
-        # 现代化垂直滚动条
-        v_scrollbar = ttk.Scrollbar(table_inner_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        # 现代化垂直滚动条 - 由虚拟化表格接管，只插入可见区间的行
+        v_scrollbar = ttk.Scrollbar(table_inner_frame, orient=tk.VERTICAL)
         v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.tree.configure(yscrollcommand=v_scrollbar.set)
+        self.grid = VirtualGrid(self.tree, v_scrollbar, self.row_height_settings[self.current_row_height])
         
         # 现代化水平滚动条
         h_scrollbar = ttk.Scrollbar(self.table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
         h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X, pady=(8, 0))
-        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        self.grid.set_x_scrollbar(h_scrollbar)
         
         # 绑定事件 - 在这里就绑定，确保始终有效
         self.bind_tree_events()
@@ -558,18 +595,15 @@ class AIExcelApp:
     def clear_preview(self):
         """清空当前单元格内容"""
         if self.current_preview_cell:
+            if not self.ensure_no_active_jobs("编辑单元格"):
+                return
             result = messagebox.askyesno("确认清空", "确定要清空当前单元格的内容吗？")
             if result:
                 row_index = self.current_preview_cell['row_index']
                 col_name = self.current_preview_cell['col_name']
                 
                 # 更新数据框
-                df = self.table_manager.get_dataframe()
-                if df is not None:
-                    df.iloc[row_index, df.columns.get_loc(col_name)] = ""
-                    
-                    # 刷新显示
-                    self.update_table_display()
+                if self.table_manager.set_cell_value(row_index, col_name, ""):
                     self.update_content_preview(row_index, col_name, "")
                     self.update_status(f"已清空 {col_name} [第{row_index+1}行]", "success")
         
@@ -675,15 +709,23 @@ class AIExcelApp:
         # 强制更新界面
         self.root.update_idletasks()
         
+    def start_new_table(self):
+        """即将换用新的表格：清除排序视图，进行中的Batch任务的结果不再写回"""
+        self.table_view.reset()
+        self.table_generation += 1
+        
     def create_blank_table(self):
         """创建空白表格"""
+        if not self.ensure_no_active_jobs("新建表格"):
+            return
         # 创建带有示例列的空白表格
+        self.start_new_table()
         success = self.table_manager.create_blank_table()
         if success:
             # 清除项目文件路径
             self.current_project_path = None
+            self.set_project_journal(None)
             self.hide_welcome()
-            self.update_table_display()
             self.info_label.config(text="已创建空白表格")
             self.update_status("已创建空白表格", "success")
             print("空白表格创建成功，数据行数：", len(self.table_manager.get_dataframe()))
@@ -775,6 +817,10 @@ class AIExcelApp:
                     label="⚡ AI处理整列",
                     command=lambda: self.process_entire_column(col_name)
                 )
+                context_menu.add_command(
+                    label=f"📦 多行打包 (当前: {self.table_manager.get_ai_column_pack_size(col_name)}行/请求)",
+                    command=lambda: self.set_column_pack_size(col_name)
+                )
                 context_menu.add_separator()
                 
                 context_menu.add_command(
@@ -795,7 +841,17 @@ class AIExcelApp:
                 label="↓ 降序排序", 
                 command=lambda: self.sort_by_column(col_name, ascending=False)
             )
-            if self.sort_state['column'] is not None:
+            if self.table_view.is_sorted():
+                # 多列排序：作为次要排序键追加到当前排序之后
+                sort_submenu.add_separator()
+                sort_submenu.add_command(
+                    label="↑ 追加为次要升序",
+                    command=lambda: self.sort_by_column(col_name, ascending=True, append=True)
+                )
+                sort_submenu.add_command(
+                    label="↓ 追加为次要降序",
+                    command=lambda: self.sort_by_column(col_name, ascending=False, append=True)
+                )
                 sort_submenu.add_separator()
                 sort_submenu.add_command(
                     label="🔄 重置排序",
@@ -877,7 +933,7 @@ class AIExcelApp:
             context_menu.add_command(label="➕ 添加行", command=self.add_row)
             
             # 排序操作
-            if self.sort_state['column'] is not None:
+            if self.table_view.is_sorted():
                 context_menu.add_separator()
                 context_menu.add_command(
                     label="🔄 重置排序",
@@ -891,6 +947,8 @@ class AIExcelApp:
             
     def edit_column_name(self, old_name):
         """编辑列名"""
+        if not self.ensure_no_active_jobs("重命名列"):
+            return
         # 创建编辑对话框
         dialog = tk.Toplevel(self.root)
         dialog.title("编辑列名")
@@ -944,7 +1002,6 @@ class AIExcelApp:
             # 执行重命名
             success = self.table_manager.rename_column(old_name, new_name)
             if success:
-                self.update_table_display()
                 self.update_status(f"列名已更改: {old_name} → {new_name}", "success")
                 messagebox.showinfo("成功", f"列名已更改为: {new_name}")
                 dialog.destroy()
@@ -1108,7 +1165,7 @@ class AIExcelApp:
                 return
                 
             # 验证提示词模板
-            is_valid, message = self.table_manager.validate_prompt_template(new_prompt)
+            is_valid, message = self.table_manager.validate_prompt_template(new_prompt, col_name)
             if not is_valid:
                 result = messagebox.askyesno("模板验证", 
                                            f"提示词模板可能有问题：{message}\n\n是否仍要保存？")
@@ -1141,12 +1198,13 @@ class AIExcelApp:
                                    f"这将删除该列的AI配置，但保留现有数据。")
         if result:
             self.table_manager.convert_to_normal_column(col_name)
-            self.update_table_display()
             self.update_status(f"已转换为普通列: {col_name}", "success")
             messagebox.showinfo("成功", f"列 '{col_name}' 已转换为普通列")
     
     def delete_specific_column(self, column_name):
         """删除指定列"""
+        if not self.ensure_no_active_jobs("删除列"):
+            return
         ai_columns = self.table_manager.get_ai_columns()
         is_ai_col = column_name in ai_columns
         col_type = "AI列" if is_ai_col else "普通列"
@@ -1159,7 +1217,6 @@ class AIExcelApp:
             # 执行删除
             success = self.table_manager.delete_column(column_name)
             if success:
-                self.update_table_display()
                 self.update_status(f"已删除列: {column_name}", "success")
                 messagebox.showinfo("成功", f"列 '{column_name}' 已删除")
             else:
@@ -1173,39 +1230,37 @@ class AIExcelApp:
             self.edit_cell_dialog(row_index, col_name, current_value)
     
     def process_specific_cell(self, row_index, col_name):
-        """处理指定的AI单元格"""
+        """在后台处理指定的AI单元格"""
         ai_columns = self.table_manager.get_ai_columns()
         if col_name in ai_columns:
-            # 获取AI列的配置
-            config = ai_columns[col_name]
-            if isinstance(config, dict):
-                prompt = config.get("prompt", "")
-                model = config.get("model", "gpt-4.1")
-            else:
-                # 向后兼容
-                prompt = config
-                model = "gpt-4.1"
-            
-            # 处理单个单元格
             try:
-                success, result = self.ai_processor.process_single_cell(
-                    self.table_manager.get_dataframe(),
-                    row_index,
-                    col_name,
-                    prompt,
-                    model
-                )
+                df = self.table_manager.get_dataframe()
+                tasks = self.ai_processor.build_tasks(df, {col_name: ai_columns[col_name]}, row_indices=[row_index])
+                self.start_ai_job(f"单元格 {col_name}[{row_index+1}]处理", df, tasks)
                 
-                if success:
-                    self.update_table_display()
-                    self.update_status(f"单元格 {col_name}[{row_index+1}] 处理完成", "success")
-                else:
-                    self.update_status("单元格处理失败", "error")
-                    
             except Exception as e:
                 messagebox.showerror("错误", f"处理单元格时出错: {str(e)}")
                 self.update_status("单元格处理失败", "error")
     
+    def set_column_pack_size(self, col_name):
+        """设置AI列每次请求合并的行数（适合分类、打标签等短回答任务）"""
+        current = self.table_manager.get_ai_column_pack_size(col_name)
+        # 一包的回复不能超过模型的输出上限
+        _, model = self.ai_processor.get_column_config(self.table_manager.get_ai_columns().get(col_name, ""))
+        max_pack_size = self.ai_processor.get_max_pack_size(model)
+        pack_size = tk.simpledialog.askinteger(
+            "多行打包",
+            f"列 '{col_name}' 每次请求合并的行数:\n"
+            f"1 为不打包；大于1时要求AI以JSON数组返回各行结果，\n"
+            f"数量不符时自动退回逐行请求。适合短回答的分类任务。\n"
+            f"模型 {model} 的输出上限最多允许 {max_pack_size} 行。",
+            initialvalue=min(current, max_pack_size), minvalue=1, maxvalue=max_pack_size
+        )
+        if pack_size is None:
+            return
+        self.table_manager.set_ai_column_pack_size(col_name, pack_size)
+        self.update_status(f"列 {col_name} 多行打包: {pack_size}行/请求", "success")
+        
     def process_entire_column(self, col_name):
         """处理整个AI列"""
         ai_columns = self.table_manager.get_ai_columns()
@@ -1226,44 +1281,9 @@ class AIExcelApp:
             return
             
         try:
-            self.update_status(f"正在处理整列 {col_name}...", "normal")
-            
-            success_count = 0
-            
-            # 获取AI列配置
-            config = ai_columns[col_name]
-            if isinstance(config, dict):
-                prompt_template = config.get("prompt", "")
-                model = config.get("model", "gpt-4.1")
-            else:
-                # 向后兼容
-                prompt_template = config
-                model = "gpt-4.1"
-            
-            # 处理每一行，优化性能
-            for row_index in range(len(df)):
-                try:
-                    success, result = self.ai_processor.process_single_cell(
-                        df, row_index, col_name, prompt_template, model
-                    )
-                    
-                    if success:
-                        success_count += 1
-                        
-                    # 更新进度条 - 使用新的表格进度条
-                    self.update_table_progress(row_index + 1, row_count, f"处理 {col_name}")
-                    
-                    # 减少界面更新频率，每5行更新一次显示
-                    if (row_index + 1) % 5 == 0 or row_index == len(df) - 1:
-                        self.update_table_display()
-                    
-                except Exception as e:
-                    print(f"处理第{row_index+1}行时出错: {e}")
-                    
-            # 最终更新显示
-            self.update_table_display()
-            self.update_status(f"列 {col_name} 处理完成 ({success_count}/{row_count})", "success")
-            messagebox.showinfo("完成", f"列 '{col_name}' 处理完成！\n成功: {success_count}/{row_count}")
+            # 在后台并发处理整列，界面保持响应
+            tasks = self.ai_processor.build_tasks(df, {col_name: ai_columns[col_name]})
+            self.start_ai_job(f"处理列 {col_name}", df, tasks)
             
         except Exception as e:
             messagebox.showerror("错误", f"处理列时出错: {str(e)}")
@@ -1289,7 +1309,8 @@ class AIExcelApp:
                 self.update_status("没有数据可编辑", "error")
                 return
                 
-            column_names = list(df.columns)
+            # 列标识按显示顺序编号
+            column_names = self.table_manager.get_column_names()
             if col_index >= len(column_names):
                 return
                 
@@ -1298,15 +1319,14 @@ class AIExcelApp:
             # 获取当前值
             values = self.tree.item(item, 'values')
             if col_index < len(values):
-                current_value = values[col_index]
                 # 处理被截断的文本，从原始数据获取完整值
-                row_index = self.tree.index(item)
-                current_value = str(df.iloc[row_index, col_index])
+                row_index = self.grid.row_of(item)
+                current_value = str(df.iloc[row_index, df.columns.get_loc(col_name)])
             else:
                 current_value = ""
                 
             # 获取行索引
-            row_index = self.tree.index(item)
+            row_index = self.grid.row_of(item)
             
             # 创建编辑对话框
             self.edit_cell_dialog(row_index, col_name, current_value)
@@ -1317,6 +1337,9 @@ class AIExcelApp:
             
     def edit_cell_dialog(self, row_index, col_name, current_value):
         """单元格编辑对话框"""
+        if not self.ensure_no_active_jobs("编辑单元格"):
+            return
+            
         dialog = tk.Toplevel(self.root)
         dialog.title(f"编辑单元格")
         dialog.geometry("500x400")
@@ -1364,12 +1387,8 @@ class AIExcelApp:
         def save_changes():
             try:
                 new_value = text_widget.get("1.0", tk.END).strip()
-                # 更新数据框
-                df = self.table_manager.get_dataframe()
-                df.iloc[row_index, df.columns.get_loc(col_name)] = new_value
-                
-                # 刷新表格显示
-                self.update_table_display()
+                # 更新数据框，表格只刷新这个单元格
+                self.table_manager.set_cell_value(row_index, col_name, new_value)
                 
                 # 更新预览面板
                 if self.current_preview_cell and self.current_preview_cell['row_index'] == row_index and self.current_preview_cell['col_name'] == col_name:
@@ -1408,6 +1427,8 @@ class AIExcelApp:
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "没有数据可保存，请先创建表格或导入数据")
             return
+        if not self.ensure_no_active_jobs("保存项目"):
+            return
         
         # 如果已有项目文件路径，直接保存
         if self.current_project_path:
@@ -1435,6 +1456,8 @@ class AIExcelApp:
                 if success:
                     # 更新当前项目路径
                     self.current_project_path = file_path
+                    self.ai_processor.open_cache(os.path.dirname(file_path))
+                    self.set_project_journal(self.project_manager.journal)
                     filename = os.path.basename(file_path)
                     self.info_label.config(text=f"📁 {filename}")
                     self.update_status(f"项目已保存: {filename}", "success")
@@ -1457,6 +1480,8 @@ class AIExcelApp:
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "没有数据可保存，请先创建表格或导入数据")
             return
+        if not self.ensure_no_active_jobs("保存项目"):
+            return
             
         # 总是弹出文件选择对话框
         file_path = filedialog.asksaveasfilename(
@@ -1480,6 +1505,8 @@ class AIExcelApp:
                 if success:
                     # 更新当前项目路径为新路径
                     self.current_project_path = file_path
+                    self.ai_processor.open_cache(os.path.dirname(file_path))
+                    self.set_project_journal(self.project_manager.journal)
                     filename = os.path.basename(file_path)
                     self.info_label.config(text=f"📁 {filename}")
                     self.update_status(f"项目已另存为: {filename}", "success")
@@ -1494,6 +1521,8 @@ class AIExcelApp:
 
     def load_project(self):
         """加载项目文件"""
+        if not self.ensure_no_active_jobs("打开项目"):
+            return
         file_path = filedialog.askopenfilename(
             title="选择项目文件",
             filetypes=[
@@ -1507,6 +1536,7 @@ class AIExcelApp:
                 self.update_status("正在加载项目...", "normal")
                 self.root.update()
                 
+                self.start_new_table()
                 success, message, column_widths = self.project_manager.load_project(
                     file_path, self.table_manager
                 )
@@ -1514,6 +1544,8 @@ class AIExcelApp:
                 if success:
                     # 记录当前项目文件路径
                     self.current_project_path = file_path
+                    self.ai_processor.open_cache(os.path.dirname(file_path))
+                    self.set_project_journal(self.project_manager.journal)
                     self.hide_welcome()
                     self.update_table_display(column_widths=column_widths) # 传递列宽
                     filename = os.path.basename(file_path)
@@ -1530,6 +1562,8 @@ class AIExcelApp:
 
     def import_data_file(self):
         """导入文件"""
+        if not self.ensure_no_active_jobs("导入数据"):
+            return
         file_path = filedialog.askopenfilename(
             title="选择数据文件",
             filetypes=[
@@ -1545,12 +1579,13 @@ class AIExcelApp:
                 self.update_status("正在导入文件...", "normal")
                 self.root.update()
                 
+                self.start_new_table()
                 success = self.table_manager.load_file(file_path)
                 if success:
                     # 清除项目文件路径（导入数据文件不是项目文件）
                     self.current_project_path = None
+                    self.set_project_journal(None)
                     self.hide_welcome()
-                    self.update_table_display()
                     filename = os.path.basename(file_path)
                     self.info_label.config(text=f"📁 {filename}")
                     self.update_status(f"已导入: {filename}", "success")
@@ -1566,30 +1601,21 @@ class AIExcelApp:
         """更新表格显示"""
         print("开始更新表格显示")
         
-        # 清空现有数据
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-            
         df = self.table_manager.get_dataframe()
         if df is not None:
             print(f"数据框大小: {df.shape}")
             print(f"列名: {list(df.columns)}")
             
-            # 设置列
+            # 设置列：行的值按数据框的物理顺序，列的显示顺序由displaycolumns决定
             columns = list(df.columns)
             self.tree["columns"] = columns
+            self.tree["displaycolumns"] = self.table_manager.get_column_names()
             self.tree["show"] = "headings"
             
             # 设置列标题和宽度，并添加边框效果
-            ai_columns = self.table_manager.get_ai_columns()
             for i, col in enumerate(columns):
-                display_col_name = col
-                if col in ai_columns:
-                    display_col_name = f"🤖 {col}" # AI列添加机器人图标
-                
-                # 添加排序指示符（如果当前正在排序这一列）
-                sort_indicator = self.get_sort_indicator(col)
-                display_col_name += sort_indicator
+                # AI列添加机器人图标，正在排序的列添加排序指示符
+                display_col_name = self.get_column_heading_text(col)
                     
                 self.tree.heading(col, text=display_col_name,
                                  anchor='w')  # 左对齐，不绑定点击事件
@@ -1622,45 +1648,82 @@ class AIExcelApp:
                                    background='#e3f2fd',  # 浅蓝色背景
                                    foreground='#1a202c')  # 深色文字
                 
-            # 插入数据并应用行样式
-            for index, row in df.iterrows():
-                values = []
-                for val in row:
-                    # 处理长文本显示 - 增加显示长度
-                    str_val = str(val) if val is not None else ""
-                    if len(str_val) > 80:  # 增加显示长度
-                        str_val = str_val[:77] + "..."
-                    values.append(str_val)
-                
-                # 使用交替行颜色创建网格效果
-                row_tag = 'odd_row' if index % 2 == 0 else 'even_row'
-                item = self.tree.insert("", "end", values=values, tags=(row_tag,))
-                print(f"插入第{index+1}行: {values}")
-                
-
+            # 只插入可见区间的行（按排序视图的行顺序，交替行颜色由虚拟化表格按显示位置设置）
+            self.grid.set_dataframe(df, self.table_view.order)
                 
             # 更新表格标题
-            row_count = len(df)
-            col_count = len(df.columns)
-            ai_count = len(self.table_manager.get_ai_columns())
-            self.table_frame.config(text=f"📊 数据表格 - {row_count}行 {col_count}列 (AI列: {ai_count})")
+            self.update_table_title()
             
             # 恢复列高亮效果
             if hasattr(self, 'highlighted_column') and self.highlighted_column is not None:
                 self.highlight_column(self.highlighted_column)
             
-            print(f"表格更新完成，显示{row_count}行{col_count}列")
+            print(f"表格更新完成，共{len(df)}行{len(df.columns)}列")
         else:
             print("数据框为空")
+            self.grid.set_dataframe(None)
             
         # 配置选择模式为单个单元格
         self.tree.configure(selectmode='browse')  # 只能选择一个项目
 
+    def update_table_title(self):
+        """更新表格区域标题中的行数、列数和AI列数"""
+        df = self.table_manager.get_dataframe()
+        if df is not None:
+            ai_count = len(self.table_manager.get_ai_columns())
+            self.table_frame.config(text=f"📊 数据表格 - {len(df)}行 {len(df.columns)}列 (AI列: {ai_count})")
+            
+    def get_column_heading_text(self, col):
+        """列头文字：AI列添加机器人图标，正在排序的列添加排序指示符"""
+        display_col_name = f"🤖 {col}" if col in self.table_manager.get_ai_columns() else col
+        return display_col_name + self.get_sort_indicator(col)
+        
+    def update_column_heading(self, col):
+        """只刷新一个列头（保留列高亮）"""
+        df = self.table_manager.get_dataframe()
+        if df is None or col not in self.tree["columns"]:
+            return
+        text = self.get_column_heading_text(col)
+        if self.highlighted_column is not None and self.table_manager.get_column_names().index(col) == self.highlighted_column:
+            text = f"★ {text} ★"
+        self.tree.heading(col, text=text)
+        
+    def on_table_changed(self, kind, row=None, column=None):
+        """表格数据变更通知：单元格、行、列的变化只刷新受影响的表格项，列结构变化才重建表格"""
+        df = self.table_manager.get_dataframe()
+        if kind in (CHANGE_CELL, CHANGE_ROW, CHANGE_COLUMN) and self.grid.dataframe is not df:
+            # 数据框已被替换，按新数据框刷新可见行
+            kind = CHANGE_ROWS
+        if kind == CHANGE_CELL:
+            self.grid.refresh_cell(row, column)
+        elif kind == CHANGE_ROW:
+            self.grid.refresh_row(row)
+        elif kind == CHANGE_COLUMN:
+            self.update_column_heading(column)
+            self.grid.refresh_column(column)
+            self.update_table_title()
+        elif kind == CHANGE_ROWS:
+            self.grid.set_dataframe(df, self.table_view.order)
+            self.update_table_title()
+        elif kind == CHANGE_ORDER:
+            # 只改变显示顺序，不重新插入任何行；高亮和选中信息按列名跟随移动后的列
+            column_names = self.table_manager.get_column_names()
+            self.tree["displaycolumns"] = column_names
+            if self.grid.highlighted_column in column_names:
+                self.highlighted_column = column_names.index(self.grid.highlighted_column)
+            if self.selection_info.get('column_name') in column_names:
+                self.selection_info['column_index'] = column_names.index(self.selection_info['column_name'])
+            self.grid.update_highlight()
+        else:
+            self.update_table_display()
+            
     def create_ai_column(self):
         """新建AI列"""
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "请先创建表格或导入数据文件")
             return
+        if not self.ensure_no_active_jobs("添加列"):
+            return
             
         dialog = AIColumnDialog(self.root, self.table_manager.get_column_names())
         result = dialog.show()
@@ -1678,14 +1741,14 @@ class AIExcelApp:
             else:
                 self.table_manager.add_normal_column(column_name)
                 self.update_status(f"已添加列: {column_name}", "success")
-                
-            self.update_table_display()
             
     def create_normal_column(self):
         """新建普通列"""
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "请先创建表格或导入数据文件")
             return
+        if not self.ensure_no_active_jobs("添加列"):
+            return
             
         # 简单输入对话框
         column_name = tk.simpledialog.askstring("新建列", "请输入列名:")
@@ -1693,31 +1756,33 @@ class AIExcelApp:
             column_name = column_name.strip()
             if column_name not in self.table_manager.get_column_names():
                 self.table_manager.add_normal_column(column_name)
-                self.update_table_display()
                 self.update_status(f"已添加列: {column_name}", "success")
             else:
                 messagebox.showerror("错误", f"列名 '{column_name}' 已存在")
                 
     def add_row(self):
         """添加新行"""
+        if not self.ensure_no_active_jobs("添加行"):
+            return
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "请先创建表格")
             return
             
         success = self.table_manager.add_row()
         if success:
-            self.update_table_display()
+            self.grid.select_row(self.table_manager.get_row_count() - 1)
             self.update_status("已添加新行", "success")
     
     def insert_row_at_position(self, position, direction):
         """在指定位置插入行"""
+        if not self.ensure_no_active_jobs("插入行"):
+            return
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "请先创建表格")
             return
             
         success = self.table_manager.insert_row_at_position(position)
         if success:
-            self.update_table_display()
             side = "上方" if direction == "above" else "下方"
             self.update_status(f"已在第{position+1}行{side}插入新行", "success")
         else:
@@ -1762,7 +1827,6 @@ class AIExcelApp:
             )
             
             if success:
-                self.update_table_display()
                 side = "左" if direction == "left" else "右"
                 col_type = "AI列" if is_ai_column else "普通列"
                 self.update_status(f"已在{side}侧插入{col_type}: {column_name}", "success")
@@ -1771,11 +1835,14 @@ class AIExcelApp:
             
     def clear_data(self):
         """清空数据"""
+        if not self.ensure_no_active_jobs("清空数据"):
+            return
         if self.table_manager.get_dataframe() is None:
             return
             
         result = messagebox.askyesno("确认", "确定要清空所有数据吗？")
         if result:
+            self.start_new_table()
             self.table_manager.clear_all_data()
             self.show_welcome()
             self.update_status("已清空数据", "success")
@@ -1797,6 +1864,349 @@ class AIExcelApp:
             messagebox.showerror("连接测试", f"测试连接时出错: {str(e)}")
             self.update_status("连接测试失败", "error")
 
+    def show_endpoint_stats(self):
+        """显示各API端点的负载和健康状态"""
+        lines = []
+        for stats in self.ai_processor.endpoint_pool.get_stats():
+            state = "已摘除" if stats["ejected"] else "正常"
+            lines.append(f"{stats['name']} (权重 {stats['weight']:g}): {state}，"
+                         f"请求 {stats['requests']}，失败 {stats['failures']}，在途 {stats['outstanding']}")
+        messagebox.showinfo("API端点状态", "\n".join(lines))
+        
+    def show_cost_estimate(self):
+        """预估待处理单元格（空值或错误结果）的费用和耗时"""
+        ai_columns = self.table_manager.get_ai_columns()
+        df = self.table_manager.get_dataframe()
+        if not ai_columns or df is None:
+            messagebox.showwarning("警告", "没有AI列需要处理")
+            return
+        try:
+            estimate = self.cost_estimator.estimate(df, ai_columns)
+            messagebox.showinfo("费用和耗时预估",
+                                f"{format_estimate(estimate)}\n\n"
+                                f"以上为待处理单元格的预估，并发上限 {self.ai_processor.max_concurrency}；"
+                                f"单价可用 AI_PRICE_<模型> 配置")
+        except Exception as e:
+            messagebox.showerror("错误", f"预估失败: {str(e)}")
+            
+    def set_project_journal(self, journal):
+        """切换AI结果写入的结果日志（项目未保存为文件时不记录）"""
+        if journal is None:
+            self.project_manager.close_journal()
+        self.ai_processor.journal = journal
+        
+    def toggle_response_cache(self):
+        """切换是否读取响应缓存（关闭时仍会写入新结果）"""
+        self.ai_processor.cache_bypass = not self.use_cache_var.get()
+        state = "已启用" if self.use_cache_var.get() else "已绕过"
+        self.update_status(f"响应缓存{state}", "success")
+        
+    def show_cache_stats(self):
+        """显示响应缓存统计"""
+        stats = self.ai_processor.get_cache_stats()
+        if stats is None:
+            messagebox.showinfo("缓存统计", "响应缓存未启用")
+            return
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = (stats["hits"] / lookups * 100) if lookups else 0
+        messagebox.showinfo("缓存统计",
+                            f"命中: {stats['hits']}  未命中: {stats['misses']} (命中率 {hit_rate:.1f}%)\n"
+                            f"条目数: {stats['entries']}\n"
+                            f"占用: {stats['total_bytes'] / 1024 / 1024:.1f} MB / "
+                            f"{stats['max_bytes'] / 1024 / 1024:.0f} MB")
+        
+    def clear_response_cache(self):
+        """清空响应缓存"""
+        if self.ai_processor.cache is None:
+            messagebox.showinfo("提示", "响应缓存未启用")
+            return
+        if messagebox.askyesno("确认", "确定要清空响应缓存吗？"):
+            self.ai_processor.cache.clear()
+            self.update_status("响应缓存已清空", "success")
+            
+    def submit_batch_job(self):
+        """将所有AI列中待处理的单元格提交为Batch API任务，后台轮询结果"""
+        if self.batch_job is not None:
+            messagebox.showinfo("提示", f"已有进行中的Batch任务: {self.batch_job['id']}")
+            return
+        if not self.ensure_no_active_jobs("提交Batch任务"):
+            return
+            
+        ai_columns = self.table_manager.get_ai_columns()
+        df = self.table_manager.get_dataframe()
+        if not ai_columns or df is None or len(df) == 0:
+            messagebox.showwarning("警告", "没有AI列需要处理")
+            return
+            
+        if not self.check_ai_column_cycles(ai_columns):
+            return
+            
+        pending_count = sum(len(self.ai_processor.get_pending_rows(df, column)) for column in ai_columns)
+        if pending_count == 0:
+            messagebox.showinfo("提示", "所有AI列都已有结果，没有待处理的单元格")
+            return
+            
+        result = messagebox.askyesno("确认Batch处理",
+                                   f"即将以Batch API提交 {pending_count} 个待处理单元格（空值或错误结果）。\n"
+                                   f"任务在服务端异步执行，通常在 {self.batch_processor.completion_window} 内完成，"
+                                   f"期间可继续使用本程序。\n\n是否继续？")
+        if not result:
+            return
+            
+        try:
+            self.update_status("正在提交Batch任务...", "normal")
+            self.root.update()
+            batch_id, requests = self.batch_processor.start(df, ai_columns)
+            self.batch_job = {"id": batch_id, "requests": requests, "table_generation": self.table_generation}
+            self.update_status(f"Batch任务已提交: {batch_id}", "success")
+            self.root.after(int(self.batch_processor.poll_interval * 1000), self.poll_batch_job)
+        except Exception as e:
+            messagebox.showerror("错误", f"提交Batch任务失败: {str(e)}")
+            self.update_status("提交Batch任务失败", "error")
+            
+    def poll_batch_job(self):
+        """定时查询Batch任务状态，结束后写回结果"""
+        job = self.batch_job
+        if job is None:
+            return
+            
+        try:
+            batch = self.batch_processor.get_status(job["id"])
+        except Exception as e:
+            # 网络波动时保留任务，下次继续查询
+            self.update_status(f"查询Batch任务失败，稍后重试: {str(e)}", "normal")
+            self.root.after(int(self.batch_processor.poll_interval * 1000), self.poll_batch_job)
+            return
+            
+        counts = batch.request_counts
+        if batch.status not in BATCH_FINAL_STATUSES:
+            if counts:
+                self.update_status(f"Batch任务 {batch.status}: {counts.completed + counts.failed}/{counts.total}", "normal")
+            else:
+                self.update_status(f"Batch任务 {batch.status}", "normal")
+            self.root.after(int(self.batch_processor.poll_interval * 1000), self.poll_batch_job)
+            return
+            
+        if self.job_runner.get_active_jobs():
+            # 后台任务在工作线程中写表格，等它结束后再写回Batch结果
+            self.update_status("Batch任务已结束，等待后台任务完成后写回结果", "normal")
+            self.root.after(int(self.batch_processor.poll_interval * 1000), self.poll_batch_job)
+            return
+            
+        self.batch_job = None
+        if job["table_generation"] != self.table_generation:
+            messagebox.showwarning("警告", f"Batch任务 {job['id']} 已结束，但当前表格已更换，结果未写回")
+            return
+            
+        try:
+            success, message = self.batch_processor.finish(self.table_manager.get_dataframe(), batch, job["requests"],
+                                                           self.table_manager.get_ai_columns())
+        except Exception as e:
+            success, message = False, f"下载Batch结果失败: {str(e)}"
+        if success:
+            # 只刷新写回结果的列
+            columns = {self.batch_processor.parse_custom_id(request["custom_id"])[0] for request in job["requests"]}
+            for col_name in columns:
+                self.table_manager.notify(CHANGE_COLUMN, column=col_name)
+            messagebox.showinfo("完成", message)
+            self.update_status("Batch任务完成" if batch.status == "completed" else f"Batch任务已结束（{batch.status}），已写回部分结果", "success")
+        else:
+            messagebox.showerror("错误", message)
+            self.update_status("Batch任务失败", "error")
+            
+    def cancel_batch_job(self):
+        """取消进行中的Batch任务"""
+        if self.batch_job is None:
+            messagebox.showinfo("提示", "没有进行中的Batch任务")
+            return
+        if not messagebox.askyesno("确认", f"确定要取消Batch任务 {self.batch_job['id']} 吗？"):
+            return
+        try:
+            self.batch_processor.client.batches.cancel(self.batch_job["id"])
+            self.update_status("已请求取消Batch任务，任务结束后写回已完成的部分结果", "normal")
+        except Exception as e:
+            messagebox.showerror("错误", f"取消Batch任务失败: {str(e)}")
+            
+    def toggle_streaming(self):
+        """切换流式输出（生成过程中实时显示部分结果）"""
+        self.ai_processor.stream_enabled = self.stream_var.get()
+        state = "已开启" if self.stream_var.get() else "已关闭"
+        self.update_status(f"流式输出{state}", "success")
+        
+    def set_cell_display(self, row_index, col_name, text):
+        """只刷新一个表格单元格和内容预览"""
+        if col_name in self.tree["columns"]:
+            self.grid.set_cell(row_index, col_name, text)
+            
+        preview = self.current_preview_cell
+        if preview and preview['row_index'] == row_index and preview['col_name'] == col_name:
+            self.preview_text.config(state='normal')
+            self.preview_text.delete("1.0", tk.END)
+            self.preview_text.insert("1.0", text)
+            self.preview_text.see(tk.END)
+            self.preview_text.config(state='disabled')
+            
+    def start_ai_job(self, name, df, tasks, on_complete=None):
+        """把AI任务交给后台执行，界面保持响应；结束后在界面线程中调用on_complete(job)"""
+        job = self.job_runner.submit(name, df, tasks, on_complete=on_complete or self.finish_ai_job)
+        active = len(self.job_runner.get_active_jobs())
+        if active > 1:
+            self.update_status(f"已加入后台任务队列: {name}（前面还有 {active - 1} 个任务）", "normal")
+        else:
+            self.update_status(f"后台处理中: {name} (0/{job.total})", "normal")
+        if self.job_poll_id is None:
+            self.job_poll_id = self.root.after(self.ui_refresh_interval, self.poll_jobs)
+        self.refresh_jobs_panel()
+        return job
+        
+    def poll_jobs(self):
+        """按固定帧率取出后台结果，只刷新变化的单元格和进度"""
+        self.job_poll_id = None
+        cells, finished = self.job_runner.drain(self.ui_max_events)
+        
+        current_df = self.table_manager.get_dataframe()
+        for (row_index, col_name), (job, text) in cells.items():
+            # 处理期间换了表格时不刷新显示（结果仍写入任务开始时的数据框）
+            if job.dataframe is current_df:
+                self.set_cell_display(row_index, col_name, "" if text is None else str(text))
+                
+        active_jobs = self.job_runner.get_active_jobs()
+        if active_jobs:
+            job = active_jobs[0]
+            if job.total > 0:
+                self.table_progress_bar['value'] = job.completed / job.total * 100
+            self.progress_label.config(text=f"{job.name}: {job.completed}/{job.total} {job.status}")
+        self.refresh_jobs_panel()
+        
+        if active_jobs or self.job_runner.has_pending_events():
+            self.job_poll_id = self.root.after(self.ui_refresh_interval, self.poll_jobs)
+        else:
+            self.root.after(1000, self.hide_table_progress)
+            
+        # 结束回调可能弹出对话框，放在重新调度之后，不阻塞其他任务的刷新
+        for job in finished:
+            if job.on_complete:
+                job.on_complete(job)
+                
+    def finish_ai_job(self, job):
+        """后台任务结束：刷新受影响的行或列并提示结果"""
+        if job.dataframe is self.table_manager.get_dataframe():
+            # 结果在处理过程中已逐个刷新，这里按最终数据再刷新一次涉及的行或列（只涉及可见行）
+            rows = {task["row_index"] for task in job.tasks}
+            if len(rows) == 1:
+                self.table_manager.notify(CHANGE_ROW, rows.pop())
+            else:
+                for col_name in {task["column_name"] for task in job.tasks}:
+                    self.table_manager.notify(CHANGE_COLUMN, column=col_name)
+        if job.status == JOB_FAILED:
+            messagebox.showerror("错误", f"{job.name}时出错: {job.error}")
+            self.update_status(f"{job.name}失败", "error")
+        elif job.status == JOB_CANCELLED:
+            self.update_status(f"{job.name}已取消 (成功 {job.success_count}/{job.total})", "normal")
+        elif job.success_count == job.total:
+            self.update_status(f"{job.name}完成 ({job.success_count}/{job.total})", "success")
+            messagebox.showinfo("完成", f"{job.name}完成！\n成功: {job.success_count}/{job.total}"
+                                        f"{self.get_saved_requests_text(job.stats)}")
+        else:
+            self.update_status(f"{job.name}完成 ({job.success_count}/{job.total})", "error")
+            messagebox.showwarning("部分成功", f"{job.name}完成\n成功: {job.success_count}/{job.total}"
+                                             f"{self.get_saved_requests_text(job.stats)}")
+            
+    def ensure_no_active_jobs(self, action):
+        """后台任务运行时不允许改变表格结构、编辑单元格、保存项目或提交Batch任务（任务在工作线程中按行列位置写回结果）"""
+        if self.job_runner.get_active_jobs():
+            messagebox.showwarning("警告", f"后台AI任务运行中，请等待完成或在后台任务面板中取消后再{action}")
+            return False
+        return True
+        
+    def show_jobs_panel(self):
+        """后台任务面板：查看进度，暂停、继续或取消任务"""
+        if self.jobs_window is not None and self.jobs_window.winfo_exists():
+            self.jobs_window.lift()
+            return
+            
+        dialog = tk.Toplevel(self.root)
+        dialog.title("后台任务")
+        dialog.geometry("620x320")
+        dialog.transient(self.root)
+        self.jobs_window = dialog
+        
+        main_frame = ttk.Frame(dialog, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        columns = ("任务", "状态", "进度", "成功", "耗时")
+        jobs_tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=8)
+        for col, width in zip(columns, (220, 70, 110, 70, 80)):
+            jobs_tree.heading(col, text=col)
+            jobs_tree.column(col, width=width, anchor=tk.W if col == "任务" else tk.CENTER)
+        jobs_tree.pack(fill=tk.BOTH, expand=True)
+        self.jobs_tree = jobs_tree
+        
+        def selected_jobs():
+            ids = {int(item) for item in jobs_tree.selection()}
+            return [job for job in self.job_runner.jobs if job.id in ids]
+            
+        def on_pause():
+            for job in selected_jobs():
+                job.pause()
+            self.refresh_jobs_panel()
+            
+        def on_resume():
+            for job in selected_jobs():
+                job.resume()
+            self.refresh_jobs_panel()
+            
+        def on_cancel():
+            for job in selected_jobs():
+                job.cancel()
+            self.refresh_jobs_panel()
+            
+        def on_clear():
+            self.job_runner.clear_finished()
+            self.refresh_jobs_panel()
+            
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="⏸️ 暂停", command=on_pause).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="▶️ 继续", command=on_resume).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="⏹️ 取消", command=on_cancel).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="🧹 清除已结束", command=on_clear).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="关闭", command=dialog.destroy).pack(side=tk.RIGHT)
+        
+        self.refresh_jobs_panel()
+        
+    def refresh_jobs_panel(self):
+        """刷新后台任务面板（面板未打开时跳过）"""
+        if self.jobs_window is None or not self.jobs_window.winfo_exists():
+            return
+        existing = set(self.jobs_tree.get_children())
+        for job in self.job_runner.jobs:
+            item = str(job.id)
+            values = (job.name, job.status, f"{job.completed}/{job.total}", job.success_count,
+                      f"{job.get_elapsed():.0f}秒")
+            if item in existing:
+                self.jobs_tree.item(item, values=values)
+                existing.discard(item)
+            else:
+                self.jobs_tree.insert("", tk.END, iid=item, values=values)
+        if existing:
+            self.jobs_tree.delete(*existing)
+            
+    def check_ai_column_cycles(self, ai_columns):
+        """检查AI列之间是否存在循环引用，存在时提示并返回False"""
+        cycle = find_cycle(ai_columns)
+        if cycle:
+            messagebox.showerror("错误", f"{format_cycle(cycle)}\n\n请修改相关AI列的提示词后再处理")
+            return False
+        return True
+        
+    def get_saved_requests_text(self, stats=None):
+        """批量处理中因相同prompt合并和多行打包而节省的请求数说明（默认为最近一次批量处理）"""
+        stats = stats or self.ai_processor.last_batch_stats
+        if stats["saved_requests"] > 0:
+            return f"\n请求合并（相同prompt/多行打包）: 实际请求 {stats['requests']} 次，节省 {stats['saved_requests']} 次"
+        return ""
+        
     def update_progress(self, current, total):
         """更新进度条"""
         progress = (current / total) * 100
@@ -1825,6 +2235,8 @@ class AIExcelApp:
         
     def delete_column(self):
         """删除列"""
+        if not self.ensure_no_active_jobs("删除列"):
+            return
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "没有数据表格")
             return
@@ -1892,7 +2304,6 @@ class AIExcelApp:
                 # 执行删除
                 success = self.table_manager.delete_column(col_name)
                 if success:
-                    self.update_table_display()
                     self.update_status(f"已删除列: {col_name}", "success")
                     messagebox.showinfo("成功", f"列 '{col_name}' 已删除")
                     dialog.destroy()
@@ -1924,7 +2335,7 @@ class AIExcelApp:
         
         if file_path:
             try:
-                self.table_manager.export_excel(file_path)
+                self.table_manager.export_excel(file_path, self.table_view.order)
                 messagebox.showinfo("成功", f"已导出到: {file_path}")
                 self.update_status(f"已导出: {os.path.basename(file_path)}", "success")
             except Exception as e:
@@ -1945,7 +2356,7 @@ class AIExcelApp:
         
         if file_path:
             try:
-                self.table_manager.export_csv(file_path)
+                self.table_manager.export_csv(file_path, self.table_view.order)
                 messagebox.showinfo("成功", f"已导出到: {file_path}")
                 self.update_status(f"已导出: {os.path.basename(file_path)}", "success")
             except Exception as e:
@@ -1966,7 +2377,7 @@ class AIExcelApp:
         
         if file_path:
             try:
-                self.table_manager.export_jsonl(file_path)
+                self.table_manager.export_jsonl(file_path, self.table_view.order)
                 messagebox.showinfo("成功", f"已导出到: {file_path}")
                 self.update_status(f"已导出: {os.path.basename(file_path)}", "success")
             except Exception as e:
@@ -2126,7 +2537,7 @@ class AIExcelApp:
                 return
                 
             # 过滤选中的列
-            export_df = df[selected_columns].copy()
+            export_df = self.table_view.take(df[selected_columns].copy())
             
             # 根据格式选择文件
             if format_type == "excel":
@@ -2304,7 +2715,7 @@ class AIExcelApp:
             if clicked_column and not clicked_item:
                 col_index = int(clicked_column.replace('#', '')) - 1
                 if 0 <= col_index < len(df.columns):
-                    col_name = list(df.columns)[col_index]
+                    col_name = self.table_manager.get_column_names()[col_index]
                     
                     # 更新选中信息
                     self.selection_info = {
@@ -2328,12 +2739,9 @@ class AIExcelApp:
             # 如果点击单元格
             elif clicked_column and clicked_item:
                 col_index = int(clicked_column.replace('#', '')) - 1
-                selection = self.tree.selection()
-                
-                if selection and 0 <= col_index < len(df.columns):
-                    item = selection[0]
-                    row_index = self.tree.index(item)
-                    col_name = list(df.columns)[col_index]
+                if 0 <= col_index < len(df.columns):
+                    row_index = self.grid.row_of(clicked_item)
+                    col_name = self.table_manager.get_column_names()[col_index]
                     
                     # 更新选中信息
                     self.selection_info = {
@@ -2344,7 +2752,7 @@ class AIExcelApp:
                     }
                     
                     # 获取单元格内容并更新预览
-                    cell_content = df.iloc[row_index, col_index]
+                    cell_content = df.iloc[row_index, df.columns.get_loc(col_name)]
                     self.update_content_preview(row_index, col_name, cell_content)
                     
                     ai_columns = self.table_manager.get_ai_columns()
@@ -2371,44 +2779,12 @@ class AIExcelApp:
             
             df = self.table_manager.get_dataframe()
             if df is not None and 0 <= col_index < len(df.columns):
+                col_name = self.table_manager.get_column_names()[col_index]
                 
-                # 配置高亮标签样式 - 使用更明显的颜色
-                highlight_tag = f"col_highlight_{col_index}"
-                self.tree.tag_configure(highlight_tag, 
-                                       background='#e0f2fe',  # 更明显的浅蓝背景
-                                       foreground='#0f172a')  # 深色文字
-                
-                # 为该列的所有行添加高亮效果
-                for item in self.tree.get_children():
-                    # 清除之前的高亮标签
-                    current_tags = list(self.tree.item(item, 'tags'))
-                    current_tags = [tag for tag in current_tags if not tag.startswith('col_highlight_')]
-                    
-                    # 添加当前列的高亮标签
-                    current_tags.append(highlight_tag)
-                    self.tree.item(item, tags=current_tags)
-                
-                # 同时设置列头的高亮效果
-                columns = list(df.columns)
-                if col_index < len(columns):
-                    col_name = columns[col_index]
-                    ai_columns = self.table_manager.get_ai_columns()
-                    
-                    # 设置高亮的列头文字（保留AI图标）
-                    display_col_name = col_name
-                    if col_name in ai_columns:
-                        display_col_name = f"🤖 {col_name}"
-                    
-                    # 添加星号表示选中状态
-                    highlight_text = f"★ {display_col_name} ★"
-                    
-                    try:
-                        self.tree.heading(col_name, text=highlight_text)
-                        print(f"设置高亮列头: {col_name} -> {highlight_text}")
-                    except Exception as e:
-                        print(f"设置列头高亮错误: {e}")
-                    
-                print(f"成功高亮列 {col_index} ({col_name if col_index < len(columns) else 'unknown'})")
+                # 列头加星号，并在表格上叠放边线标出该列（不修改任何行，开销与行数无关）
+                self.update_column_heading(col_name)
+                self.grid.highlight_column(col_name)
+                print(f"成功高亮列 {col_index} ({col_name})")
                     
         except Exception as e:
             print(f"列高亮错误: {e}")
@@ -2417,32 +2793,15 @@ class AIExcelApp:
         """清除列高亮"""
         try:
             if self.highlighted_column is not None:
-                # 清除所有行的高亮标签
-                for item in self.tree.get_children():
-                    current_tags = list(self.tree.item(item, 'tags'))
-                    current_tags = [tag for tag in current_tags if not tag.startswith('col_highlight_')]
-                    self.tree.item(item, tags=current_tags)
+                # 移除高亮边线
+                self.grid.clear_highlight()
                 
-                # 恢复列头文字（移除星号，并正确恢复AI列图标）
+                # 恢复列头文字（移除星号，保留AI列图标和排序指示符）
                 df = self.table_manager.get_dataframe()
-                if df is not None and 0 <= self.highlighted_column < len(df.columns):
-                    columns = list(df.columns)
-                    col_name = columns[self.highlighted_column]
-                    ai_columns = self.table_manager.get_ai_columns()
-                    
-                    # 根据是否为AI列设置正确的显示名称
-                    display_col_name = col_name
-                    if col_name in ai_columns:
-                        display_col_name = f"🤖 {col_name}"  # 恢复AI列图标
-                        
-                    try:
-                        # 恢复原始列头文字（包含AI图标）
-                        self.tree.heading(col_name, text=display_col_name)
-                        print(f"恢复列头: {col_name} -> {display_col_name}")
-                    except Exception as e:
-                        print(f"恢复列头文本错误: {e}")
-                    
+                col_index = self.highlighted_column
                 self.highlighted_column = None
+                if df is not None and 0 <= col_index < len(df.columns):
+                    self.update_column_heading(self.table_manager.get_column_names()[col_index])
                 print("已清除列高亮")
         except Exception as e:
             print(f"清除列高亮错误: {e}")
@@ -2458,41 +2817,10 @@ class AIExcelApp:
             return
             
         try:
-            self.update_status(f"正在处理第{row_index+1}行的AI列...", "normal")
-            
-            success_count = 0
-            total_count = len(ai_columns)
-            
-            # 处理每个AI列
-            for column_name, prompt_template in ai_columns.items():
-                try:
-                    success, result = self.ai_processor.process_single_cell(
-                        self.table_manager.get_dataframe(),
-                        row_index,
-                        column_name,
-                        prompt_template
-                    )
-                    
-                    if success:
-                        success_count += 1
-                        
-                    # 更新显示
-                    self.update_table_display()
-                    self.root.update()
-                    
-                    # 添加延迟
-                    time.sleep(0.1)
-                    
-                except Exception as e:
-                    print(f"处理列 {column_name} 时出错: {e}")
-                    
-            # 完成提示
-            if success_count == total_count:
-                self.update_status(f"第{row_index+1}行AI处理完成 ({success_count}/{total_count})", "success")
-                messagebox.showinfo("成功", f"第{row_index+1}行的{success_count}个AI列处理完成！")
-            else:
-                self.update_status(f"第{row_index+1}行AI处理完成 ({success_count}/{total_count})", "error")
-                messagebox.showwarning("部分成功", f"第{row_index+1}行：{success_count}/{total_count}个AI列处理成功")
+            # 在后台并发处理该行的每个AI列
+            df = self.table_manager.get_dataframe()
+            tasks = self.ai_processor.build_tasks(df, ai_columns, row_indices=[row_index])
+            self.start_ai_job(f"第{row_index+1}行AI处理", df, tasks)
                 
         except Exception as e:
             messagebox.showerror("错误", f"处理AI列时出错: {str(e)}")
@@ -2523,7 +2851,8 @@ class AIExcelApp:
                 self.update_status("没有数据可编辑", "error")
                 return
                 
-            column_names = list(df.columns)
+            # 列标识按显示顺序编号
+            column_names = self.table_manager.get_column_names()
             if col_index >= len(column_names):
                 return
                 
@@ -2532,15 +2861,14 @@ class AIExcelApp:
             # 获取当前值
             values = self.tree.item(item, 'values')
             if col_index < len(values):
-                current_value = values[col_index]
                 # 处理被截断的文本，从原始数据获取完整值
-                row_index = self.tree.index(item)
-                current_value = str(df.iloc[row_index, col_index])
+                row_index = self.grid.row_of(item)
+                current_value = str(df.iloc[row_index, df.columns.get_loc(col_name)])
             else:
                 current_value = ""
                 
             # 获取行索引
-            row_index = self.tree.index(item)
+            row_index = self.grid.row_of(item)
             
             # 创建编辑对话框
             self.edit_cell_dialog(row_index, col_name, current_value)
@@ -2551,6 +2879,8 @@ class AIExcelApp:
 
     def insert_column_at_position(self, position, direction):
         """在指定位置插入新列"""
+        if not self.ensure_no_active_jobs("插入列"):
+            return
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "请先创建表格或导入数据文件")
             return
@@ -2579,7 +2909,6 @@ class AIExcelApp:
             )
             
             if success:
-                self.update_table_display()
                 side = "左" if direction == "left" else "右"
                 col_type = f"AI列 (模型: {ai_model})" if is_ai_column else "普通列"
                 self.update_status(f"已在{side}侧插入{col_type}: {column_name}", "success")
@@ -2605,7 +2934,7 @@ class AIExcelApp:
                 col_index = int(column.replace('#', '')) - 1
                 df = self.table_manager.get_dataframe()
                 if df is not None and col_index < len(df.columns):
-                    col_name = list(df.columns)[col_index]
+                    col_name = self.table_manager.get_column_names()[col_index]
                     self.update_status(f"正在拖拽列: {col_name}", "normal")
                 
     def on_column_drag_motion(self, event):
@@ -2620,7 +2949,7 @@ class AIExcelApp:
                 col_index = int(column.replace('#', '')) - 1
                 df = self.table_manager.get_dataframe()
                 if df is not None and col_index < len(df.columns):
-                    target_col_name = list(df.columns)[col_index]
+                    target_col_name = self.table_manager.get_column_names()[col_index]
                     self.update_status(f"目标位置: {target_col_name}", "normal")
                 
                 # 改变目标列的视觉样式（高亮效果）
@@ -2659,7 +2988,7 @@ class AIExcelApp:
             
             df = self.table_manager.get_dataframe()
             if df is not None and 0 <= from_index < len(df.columns) and 0 <= to_index < len(df.columns):
-                columns = list(df.columns)
+                columns = self.table_manager.get_column_names()
                 from_col_name = columns[from_index]
                 to_col_name = columns[to_index]
                 
@@ -2670,8 +2999,6 @@ class AIExcelApp:
                 # 执行列移动
                 success = self.table_manager.move_column(from_index, to_index)
                 if success:
-                    # 延迟更新以显示动画效果
-                    self.root.after(100, lambda: self.update_table_display())
                     self.root.after(200, lambda: self.update_status(f"已移动列: {from_col_name} → {to_col_name}位置", "success"))
                     
         except Exception as e:
@@ -2680,6 +3007,8 @@ class AIExcelApp:
 
     def delete_selected_row(self, row_index):
         """删除选中的行"""
+        if not self.ensure_no_active_jobs("删除行"):
+            return
         if self.table_manager.get_dataframe() is None:
             messagebox.showwarning("警告", "没有数据表格")
             return
@@ -2696,7 +3025,6 @@ class AIExcelApp:
             # 执行删除
             success = self.table_manager.delete_row(row_index)
             if success:
-                self.update_table_display()
                 self.update_status(f"已删除第 {row_index + 1} 行", "success")
             else:
                 messagebox.showerror("错误", "删除行失败")
@@ -2710,6 +3038,7 @@ class AIExcelApp:
             style = ttk.Style()
             style.configure('Modern.Treeview',
                            rowheight=self.row_height_settings[self.current_row_height])
+            self.grid.set_row_height(self.row_height_settings[self.current_row_height])
             self.update_status(f"已更改行高: {self.current_row_height}", "success")
         else:
             messagebox.showerror("错误", "无效的行高选择")
@@ -2732,6 +3061,7 @@ class AIExcelApp:
                            borderwidth=1,
                            font=('Arial', 10),
                            rowheight=self.row_height_settings[self.current_row_height])
+            self.grid.set_row_height(self.row_height_settings[self.current_row_height])
             
             # 获取中文描述
             height_names = {'low': '低 (紧凑)', 'medium': '中 (标准)', 'high': '高 (宽松)'}
@@ -2751,58 +3081,97 @@ class AIExcelApp:
             messagebox.showwarning("警告", "没有数据需要处理")
             return
             
+        if not self.check_ai_column_cycles(ai_columns):
+            return
+            
         # 确认处理
         total_tasks = len(df) * len(ai_columns)
+        try:
+            estimate_text = format_estimate(self.cost_estimator.estimate(df, ai_columns, only_pending=False))
+        except Exception as e:
+            estimate_text = f"费用预估失败: {str(e)}"
         result = messagebox.askyesno("确认全部处理", 
                                    f"即将处理所有 {len(ai_columns)} 个AI列的所有 {len(df)} 行数据。\n"
                                    f"总共 {total_tasks} 个任务，这可能需要较长时间。\n\n"
+                                   f"{estimate_text}\n\n"
                                    f"是否继续？")
         if not result:
             return
             
         try:
-            self.update_status("正在全部处理AI列...", "normal")
-            
-            success_count = 0
-            current_task = 0
-            
-            # 处理每个AI列的每一行，优化性能
-            for col_name, prompt_template in ai_columns.items():
-                for row_index in range(len(df)):
-                    try:
-                        success, result = self.ai_processor.process_single_cell(
-                            df, row_index, col_name, prompt_template
-                        )
-                        
-                        if success:
-                            success_count += 1
-                            
-                        current_task += 1
-                        
-                        # 更新表格进度条
-                        self.update_table_progress(current_task, total_tasks, "全部处理")
-                        
-                        # 减少界面更新频率，每10个任务更新一次显示
-                        if current_task % 10 == 0 or current_task == total_tasks:
-                            self.update_table_display()
-                        
-                        # 减少延迟，提高处理速度
-                        if current_task % 5 == 0:
-                            time.sleep(0.05)  # 减少延迟
-                        
-                    except Exception as e:
-                        print(f"处理 {col_name} 第{row_index+1}行时出错: {e}")
-                        current_task += 1
-                        
-            # 最终更新显示
-            self.update_table_display()
-            self.update_status(f"全部处理完成 ({success_count}/{total_tasks})", "success")
-            messagebox.showinfo("完成", f"全部处理完成！\n成功: {success_count}/{total_tasks}")
+            # 在后台并发处理所有AI列的所有行
+            tasks = self.ai_processor.build_tasks(df, ai_columns)
+            self.start_ai_job("全部处理", df, tasks)
             
         except Exception as e:
             messagebox.showerror("错误", f"全部处理时出错: {str(e)}")
             self.update_status("全部处理失败", "error")
 
+    def resume_ai_processing(self):
+        """继续处理 - 只处理仍为空或出错的AI单元格（用于中断或崩溃后恢复）"""
+        ai_columns = self.table_manager.get_ai_columns()
+        df = self.table_manager.get_dataframe()
+        if not ai_columns or df is None or len(df) == 0:
+            messagebox.showwarning("警告", "没有AI列需要处理")
+            return
+            
+        if not self.check_ai_column_cycles(ai_columns):
+            return
+            
+        tasks = self.ai_processor.build_pending_tasks(df, ai_columns)
+        total_tasks = len(tasks)
+        if total_tasks == 0:
+            messagebox.showinfo("提示", "所有AI单元格都已有结果，没有需要继续处理的单元格")
+            return
+            
+        try:
+            estimate_text = format_estimate(self.cost_estimator.estimate(df, ai_columns))
+        except Exception as e:
+            estimate_text = f"费用预估失败: {str(e)}"
+        result = messagebox.askyesno("确认继续处理",
+                                   f"还有 {total_tasks} 个AI单元格为空或出错。\n\n"
+                                   f"{estimate_text}\n\n"
+                                   f"是否继续处理？")
+        if not result:
+            return
+            
+        try:
+            self.start_ai_job("继续处理", df, tasks)
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"继续处理时出错: {str(e)}")
+            self.update_status("继续处理失败", "error")
+            
+    def process_stale_ai(self):
+        """增量处理 - 只处理输入、提示词或模型变化过的单元格，以及空值和错误结果"""
+        ai_columns = self.table_manager.get_ai_columns()
+        df = self.table_manager.get_dataframe()
+        if not ai_columns or df is None or len(df) == 0:
+            messagebox.showwarning("警告", "没有AI列需要处理")
+            return
+            
+        if not self.check_ai_column_cycles(ai_columns):
+            return
+            
+        tasks = self.ai_processor.build_stale_tasks(df, ai_columns)
+        total_tasks = len(tasks)
+        if total_tasks == 0:
+            messagebox.showinfo("提示", "所有AI单元格都是最新结果，没有需要重新处理的单元格")
+            return
+            
+        result = messagebox.askyesno("确认增量处理",
+                                   f"有 {total_tasks} 个AI单元格的输入、提示词或模型发生了变化（或为空、出错）。\n\n"
+                                   f"是否只处理这些单元格？")
+        if not result:
+            return
+            
+        try:
+            self.start_ai_job("增量处理", df, tasks)
+            
+        except Exception as e:
+            messagebox.showerror("错误", f"增量处理时出错: {str(e)}")
+            self.update_status("增量处理失败", "error")
+            
     def process_single_column(self):
         """单列处理 - 选择一个AI列处理所有行"""
         ai_columns = self.table_manager.get_ai_columns()
@@ -2887,39 +3256,9 @@ class AIExcelApp:
             return
             
         try:
-            self.update_status(f"正在处理列 {col_name}...", "normal")
-            
-            success_count = 0
-            prompt_template = ai_columns[col_name]
-            
-            # 处理选中列的每一行，优化性能
-            for row_index in range(row_count):
-                try:
-                    success, result = self.ai_processor.process_single_cell(
-                        df, row_index, col_name, prompt_template
-                    )
-                    
-                    if success:
-                        success_count += 1
-                        
-                    # 更新表格进度条
-                    self.update_table_progress(row_index + 1, row_count, f"处理列 {col_name}")
-                    
-                    # 减少界面更新频率，每3行更新一次显示
-                    if (row_index + 1) % 3 == 0 or row_index == row_count - 1:
-                        self.update_table_display()
-                    
-                    # 减少延迟
-                    if (row_index + 1) % 3 == 0:
-                        time.sleep(0.05)
-                    
-                except Exception as e:
-                    print(f"处理列 {col_name} 第{row_index+1}行时出错: {e}")
-                    
-            # 最终更新显示
-            self.update_table_display()
-            self.update_status(f"列 {col_name} 处理完成 ({success_count}/{row_count})", "success")
-            messagebox.showinfo("完成", f"列 '{col_name}' 处理完成！\n成功: {success_count}/{row_count}")
+            # 在后台并发处理选中列的每一行
+            tasks = self.ai_processor.build_tasks(df, {col_name: ai_columns[col_name]})
+            self.start_ai_job(f"处理列 {col_name}", df, tasks)
             
         except Exception as e:
             messagebox.showerror("错误", f"单列处理时出错: {str(e)}")
@@ -2952,8 +3291,8 @@ class AIExcelApp:
             return
         
         # 如果没有选中，使用原来的逻辑
-        selection = self.tree.selection()
-        if not selection:
+        row_index = self.grid.get_selected_row()
+        if row_index is None:
             messagebox.showwarning("警告", "请先选择一个单元格或列")
             return
             
@@ -2968,8 +3307,6 @@ class AIExcelApp:
             return
             
         # 获取选中行的索引
-        item = selection[0]
-        row_index = self.tree.index(item)
         
         # 检查该行是否有AI列需要处理
         row_ai_columns = {}
@@ -2984,7 +3321,6 @@ class AIExcelApp:
         # 如果只有一个AI列，直接处理
         if len(row_ai_columns) == 1:
             col_name = list(row_ai_columns.keys())[0]
-            prompt_template = row_ai_columns[col_name]
             
             # 确认处理
             result = messagebox.askyesno("确认单元格处理", 
@@ -2993,24 +3329,7 @@ class AIExcelApp:
             if not result:
                 return
                 
-            try:
-                self.update_status(f"正在处理单元格 {col_name}[{row_index+1}]...", "normal")
-                
-                success, result = self.ai_processor.process_single_cell(
-                    df, row_index, col_name, prompt_template
-                )
-                
-                if success:
-                    self.update_table_display()
-                    self.update_status(f"单元格 {col_name}[{row_index+1}] 处理完成", "success")
-                    messagebox.showinfo("完成", f"单元格处理完成！\n列: {col_name}\n行: {row_index+1}")
-                else:
-                    self.update_status("单元格处理失败", "error")
-                    messagebox.showerror("错误", "单元格处理失败")
-                    
-            except Exception as e:
-                messagebox.showerror("错误", f"单元格处理时出错: {str(e)}")
-                self.update_status("单元格处理失败", "error")
+            self.process_specific_cell(row_index, col_name)
                 
         else:
             # 多个AI列，让用户选择或处理全部
@@ -3089,31 +3408,10 @@ class AIExcelApp:
             process_type, columns_to_process = selected_result[0]
             
             try:
-                self.update_status(f"正在处理第 {row_index+1} 行的AI列...", "normal")
-                
-                success_count = 0
-                total_count = len(columns_to_process)
-                
-                for col_name in columns_to_process:
-                    try:
-                        prompt_template = row_ai_columns[col_name]
-                        success, result = self.ai_processor.process_single_cell(
-                            df, row_index, col_name, prompt_template
-                        )
-                        
-                        if success:
-                            success_count += 1
-                            
-                        # 添加延迟
-                        time.sleep(0.1)
-                        
-                    except Exception as e:
-                        print(f"处理单元格 {col_name}[{row_index+1}] 时出错: {e}")
-                        
-                # 更新显示
-                self.update_table_display()
-                self.update_status(f"第 {row_index+1} 行处理完成 ({success_count}/{total_count})", "success")
-                messagebox.showinfo("完成", f"第 {row_index+1} 行处理完成！\n成功: {success_count}/{total_count}")
+                # 在后台并发处理选中的AI列
+                selected_columns = {col_name: row_ai_columns[col_name] for col_name in columns_to_process}
+                tasks = self.ai_processor.build_tasks(df, selected_columns, row_indices=[row_index])
+                self.start_ai_job(f"第 {row_index+1} 行处理", df, tasks)
                 
             except Exception as e:
                 messagebox.showerror("错误", f"单元格处理时出错: {str(e)}")
@@ -3138,66 +3436,64 @@ class AIExcelApp:
 
 
         
-    def sort_by_column(self, column, ascending=True):
-        """按指定列排序"""
+    def sort_by_column(self, column, ascending=True, append=False):
+        """按指定列排序（append为True时追加为次要排序键），只改变显示顺序，数据框不变"""
         try:
             df = self.table_manager.get_dataframe()
             if df is None or df.empty:
                 return
                 
-            # 保存原始顺序（如果还没有保存的话）
-            if self.sort_state['original_order'] is None:
-                self.sort_state['original_order'] = df.index.tolist()
-            
-            # 更新排序状态
-            self.sort_state['column'] = column
-            self.sort_state['ascending'] = ascending
-                
-            # 创建排序后的数据框
-            sorted_df = df.sort_values(by=column, ascending=ascending, na_position='last')
-            
-            # 更新表格管理器中的数据
-            self.table_manager.dataframe = sorted_df.reset_index(drop=True)
-            
-            # 重新显示表格
-            self.update_table_display()
+            previous_keys = [key_column for key_column, _ in self.table_view.sort_keys]
+            self.table_view.sort_by(column, ascending, append)
+            self.apply_table_view(previous_keys)
             
             # 更新状态信息
-            direction = "升序" if ascending else "降序"
-            self.update_status(f"已按 {column} 列{direction}排序", "success")
+            description = "，".join(f"{key_column}{'升序' if key_ascending else '降序'}"
+                                    for key_column, key_ascending in self.table_view.sort_keys)
+            self.update_status(f"已排序: {description}", "success")
             
         except Exception as e:
             print(f"排序失败: {e}")
             self.update_status(f"排序失败: {str(e)}", "error")
     
+    def apply_table_view(self, previous_keys=()):
+        """按排序视图重新插入可见行，并刷新排序状态改变的列头"""
+        df = self.table_manager.get_dataframe()
+        if df is None:
+            return
+        self.grid.set_dataframe(df, self.table_view.order)
+        changed = set(previous_keys) | {key_column for key_column, _ in self.table_view.sort_keys}
+        for col in changed:
+            self.update_column_heading(col)
+    
     def get_sort_indicator(self, column):
-        """获取排序指示符"""
-        if self.sort_state['column'] == column:
-            return " ↑" if self.sort_state['ascending'] else " ↓"
-        return ""
+        """获取排序指示符（多列排序时次要排序键带序号）"""
+        sort_position = self.table_view.get_sort_position(column)
+        if sort_position is None:
+            return ""
+        index, ascending = sort_position
+        indicator = " ↑" if ascending else " ↓"
+        return indicator if len(self.table_view.sort_keys) == 1 else f"{indicator}{index + 1}"
     
     def reset_sort(self):
         """重置排序到原始顺序"""
-        if self.sort_state['original_order'] is not None:
-            df = self.table_manager.get_dataframe()
-            if df is not None:
-                # 恢复原始顺序
-                original_df = df.iloc[self.sort_state['original_order']].reset_index(drop=True)
-                self.table_manager.dataframe = original_df
-                
-                # 重置排序状态
-                self.sort_state = {
-                    'column': None,
-                    'ascending': True,
-                    'original_order': None
-                }
-                
-                # 更新显示
-                self.update_table_display()
-                self.update_status("已重置为原始顺序", "success")
+        if self.table_view.is_sorted():
+            previous_keys = [key_column for key_column, _ in self.table_view.sort_keys]
+            self.table_view.reset()
+            
+            # 更新显示
+            self.apply_table_view(previous_keys)
+            self.update_status("已重置为原始顺序", "success")
 
     def on_closing(self):
         """处理窗口关闭事件"""
+        active_jobs = self.job_runner.get_active_jobs()
+        if active_jobs:
+            if not messagebox.askyesno("确认退出", f"还有 {len(active_jobs)} 个后台AI任务未完成，"
+                                                   f"退出将取消这些任务。\n\n是否退出？"):
+                return
+            self.job_runner.cancel_all()
+        self.ai_processor.shutdown()
         self.root.quit()
 
 def main():
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟OpenAI服务
+实现 /v1/chat/completions（含流式）、/v1/models、/v1/files 和 /v1/batches，
+可配置延迟分布、429/5xx错误率和回复长度，用于离线压测和测试各项性能功能
+
+用法:
+    python mock_server.py --port 8765 --latency lognormal:0.8,0.5 --rate-429 0.05 --rate-5xx 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python -m aie run data/bench.aie
+"""
+
+import argparse
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ai_processor import estimate_tokens
+
+# 多行打包prompt中每个任务的标题（与AIProcessor.build_pack_prompt一致）
+PACK_TASK_PATTERN = re.compile(r'^### 任务\d+$', re.MULTILINE)
+
+def parse_latency(spec):
+    """
+    解析延迟分布，返回 rng -> 秒 的函数
+    支持: 0.5 / fixed:0.5 / uniform:最小,最大 / normal:均值,标准差 / lognormal:中位数,sigma / exp:均值
+    """
+    spec = (spec or "0").strip()
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(",")]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: values[0] * math.exp(rng.gauss(0.0, values[1]))
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+class MockConfig:
+    def __init__(self, latency="0", rate_429=0.0, rate_5xx=0.0, retry_after=1.0, mode="deterministic",
+                 response_tokens=20, stream_chunks=8, batch_delay=2.0, seed=None, rate_bad_pack=0.0):
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.mode = mode  # deterministic: 按prompt哈希生成固定回复；echo: 原样返回prompt
+        self.response_tokens = response_tokens
+        self.stream_chunks = max(1, stream_chunks)
+        self.batch_delay = batch_delay
+        self.seed = seed
+        self.rate_bad_pack = rate_bad_pack  # 多行打包回复中元素数量不符的比例（测试逐个请求的退回）
+
+class MockState:
+    """服务端状态：文件、批处理任务和请求统计"""
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.batches = {}
+        self.stats = {"requests": 0, "completions": 0, "rate_limited": 0, "server_errors": 0, "bad_packs": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+    
+    def new_id(self, prefix):
+        return f"{prefix}-mock{next(self.ids)}"
+    
+    def sample_latency(self):
+        with self.lock:
+            return self.config.latency(self.rng)
+    
+    def draw_error(self):
+        """按配置的错误率抽取本次请求的错误状态码（不出错时返回None）"""
+        with self.lock:
+            u = self.rng.random()
+            if u < self.config.rate_429:
+                self.stats["rate_limited"] += 1
+                return 429
+            if u < self.config.rate_429 + self.config.rate_5xx:
+                self.stats["server_errors"] += 1
+                return self.rng.choice([500, 502, 503])
+            return None
+    
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+    
+    def answer(self, model, prompt):
+        """单个prompt的回复"""
+        if self.config.mode == "echo":
+            return prompt
+        digest = hashlib.sha1(f"{model}\x1f{prompt}".encode('utf-8')).hexdigest()
+        words = [digest[i:i + 6] for i in range(0, len(digest) - 5, 3)]
+        return " ".join(itertools.islice(itertools.cycle(words), max(1, self.config.response_tokens)))
+    
+    def reply(self, model, prompt):
+        """完整回复：多行打包的prompt返回JSON数组，其余返回单个回复"""
+        headers = PACK_TASK_PATTERN.findall(prompt)
+        if headers:
+            tasks = PACK_TASK_PATTERN.split(prompt)[1:]
+            answers = [self.answer(model, task.strip()) for task in tasks]
+            with self.lock:
+                bad_pack = self.rng.random() < self.config.rate_bad_pack
+            if bad_pack:
+                self.count("bad_packs")
+                answers = answers[:-1]
+            return json.dumps(answers, ensure_ascii=False)
+        return self.answer(model, prompt)
+    
+    def completion(self, body):
+        """生成chat.completion响应体"""
+        model = body.get("model", "mock")
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        content = self.reply(model, prompt)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(content)
+        self.count("completions")
+        self.count("prompt_tokens", prompt_tokens)
+        self.count("completion_tokens", completion_tokens)
+        return {
+            "id": self.new_id("chatcmpl"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+    
+    def run_batch(self, batch_id):
+        """后台线程：等待batch_delay后逐行生成结果（按错误率写入错误文件）"""
+        time.sleep(self.config.batch_delay)
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch["status"] == "cancelled":
+                return
+            batch["status"] = "in_progress"
+            lines = self.files[batch["input_file_id"]]["content"].decode('utf-8').splitlines()
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status = self.draw_error()
+            if status is None:
+                response = {"status_code": 200, "body": self.completion(request.get("body", {}))}
+                outputs.append({"id": self.new_id("batch_req"), "custom_id": request.get("custom_id"),
+                                "response": response, "error": None})
+            else:
+                response = {"status_code": status, "body": {"error": {"message": f"模拟错误 HTTP {status}"}}}
+                errors.append({"id": self.new_id("batch_req"), "custom_id": request.get("custom_id"),
+                               "response": response, "error": None})
+        with self.lock:
+            if batch["status"] == "cancelled":
+                return
+            batch["output_file_id"] = self.add_file(outputs, "batch_output")
+            batch["error_file_id"] = self.add_file(errors, "batch_output") if errors else None
+            batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs),
+                                       "failed": len(errors)}
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+    
+    def add_file(self, records, purpose, filename="mock.jsonl"):
+        """保存JSONL文件（调用方持有锁或单线程），返回文件ID"""
+        content = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        return self.store_file(content.encode('utf-8'), purpose, filename)
+    
+    def store_file(self, content, purpose, filename):
+        file_id = self.new_id("file")
+        self.files[file_id] = {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "content": content
+        }
+        return file_id
+    
+    def file_object(self, file_id):
+        return {key: value for key, value in self.files[file_id].items() if key != "content"}
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    @property
+    def state(self):
+        return self.server.state
+    
+    def log_message(self, format, *args):
+        # 压测时每个请求一行日志会拖慢服务，默认不输出
+        pass
+    
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+    
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": "mock_error", "code": status}}, headers)
+    
+    def do_GET(self):
+        self.state.count("requests")
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/v1/models":
+            self.send_json(200, {"object": "list", "data": [
+                {"id": "gpt-4.1", "object": "model", "created": 0, "owned_by": "mock"},
+                {"id": "o1", "object": "model", "created": 0, "owned_by": "mock"}
+            ]})
+        elif path == "/mock/stats":
+            with self.state.lock:
+                self.send_json(200, dict(self.state.stats))
+        elif re.fullmatch(r"/v1/files/[\w-]+/content", path):
+            file_id = path.split("/")[3]
+            with self.state.lock:
+                entry = self.state.files.get(file_id)
+            if entry is None:
+                self.send_error_json(404, f"文件不存在: {file_id}")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(entry["content"])))
+            self.end_headers()
+            self.wfile.write(entry["content"])
+        elif re.fullmatch(r"/v1/files/[\w-]+", path):
+            file_id = path.split("/")[3]
+            with self.state.lock:
+                if file_id not in self.state.files:
+                    self.send_error_json(404, f"文件不存在: {file_id}")
+                    return
+                self.send_json(200, self.state.file_object(file_id))
+        elif re.fullmatch(r"/v1/batches/[\w-]+", path):
+            batch_id = path.split("/")[3]
+            with self.state.lock:
+                batch = self.state.batches.get(batch_id)
+                if batch is None:
+                    self.send_error_json(404, f"批处理任务不存在: {batch_id}")
+                    return
+                self.send_json(200, dict(batch))
+        else:
+            self.send_error_json(404, f"未实现的接口: GET {path}")
+    
+    def do_POST(self):
+        self.state.count("requests")
+        path = self.path.split("?")[0].rstrip("/")
+        body = self.read_body()
+        if path == "/v1/chat/completions":
+            self.handle_chat(json.loads(body or b"{}"))
+        elif path == "/v1/files":
+            self.handle_file_upload(body)
+        elif path == "/v1/batches":
+            self.handle_batch_create(json.loads(body or b"{}"))
+        elif re.fullmatch(r"/v1/batches/[\w-]+/cancel", path):
+            batch_id = path.split("/")[3]
+            with self.state.lock:
+                batch = self.state.batches.get(batch_id)
+                if batch is None:
+                    self.send_error_json(404, f"批处理任务不存在: {batch_id}")
+                    return
+                if batch["status"] not in ("completed", "failed", "expired"):
+                    batch["status"] = "cancelled"
+                self.send_json(200, dict(batch))
+        else:
+            self.send_error_json(404, f"未实现的接口: POST {path}")
+    
+    def handle_chat(self, request):
+        """chat.completions：先按错误率返回429/5xx，否则按延迟分布等待后返回"""
+        status = self.state.draw_error()
+        if status == 429:
+            retry_after = self.state.config.retry_after
+            self.send_error_json(429, "Rate limit exceeded (mock)", {"Retry-After": f"{retry_after:g}"})
+            return
+        time.sleep(self.state.sample_latency())
+        if status is not None:
+            self.send_error_json(status, f"模拟服务端错误 HTTP {status}")
+            return
+        
+        response = self.state.completion(request)
+        if not request.get("stream"):
+            self.send_json(200, response)
+            return
+        
+        # 流式：内容分成若干块以SSE发送，首块前的延迟已在上面等待
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        content = response["choices"][0]["message"]["content"]
+        chunk_count = self.state.config.stream_chunks
+        size = max(1, math.ceil(len(content) / chunk_count))
+        base = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                "model": response["model"]}
+        for start in range(0, len(content), size):
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": content[start:start + size]},
+                                         "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = dict(base, choices=[], usage=response["usage"])
+            self.wfile.write(f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+    
+    def handle_file_upload(self, body):
+        """multipart/form-data上传文件"""
+        content_type = self.headers.get("Content-Type", "")
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('utf-8') + body)
+        content, purpose, filename = None, "batch", "upload.jsonl"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            elif name == "purpose":
+                purpose = part.get_content().strip()
+        if content is None:
+            self.send_error_json(400, "缺少file字段")
+            return
+        with self.state.lock:
+            file_id = self.state.store_file(content, purpose, filename)
+            self.send_json(200, self.state.file_object(file_id))
+    
+    def handle_batch_create(self, request):
+        """创建批处理任务，后台线程延迟batch_delay秒后完成"""
+        with self.state.lock:
+            if request.get("input_file_id") not in self.state.files:
+                self.send_error_json(400, f"输入文件不存在: {request.get('input_file_id')}")
+                return
+            batch_id = self.state.new_id("batch")
+            batch = {
+                "id": batch_id, "object": "batch", "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window", "24h"),
+                "status": "validating", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "completed_at": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}
+            }
+            self.state.batches[batch_id] = batch
+            self.send_json(200, dict(batch))
+        threading.Thread(target=self.state.run_batch, args=(batch_id,), daemon=True).start()
+
+def create_server(config=None, host="127.0.0.1", port=0):
+    """创建模拟服务（port为0时自动选择端口），base_url属性为可直接用作OPENAI_BASE_URL的地址"""
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = MockState(config or MockConfig())
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """在后台线程中启动模拟服务，返回server（用server.shutdown()停止）"""
+    server = create_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟OpenAI服务（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="0", help="延迟分布，如 0.5、uniform:0.2,1.0、lognormal:0.8,0.5")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="返回429的比例")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="返回5xx的比例")
+    parser.add_argument("--rate-bad-pack", type=float, default=0.0, help="多行打包回复中元素数量不符的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429响应的Retry-After秒数")
+    parser.add_argument("--mode", choices=["deterministic", "echo"], default="deterministic",
+                        help="deterministic: 按prompt哈希生成固定回复；echo: 原样返回prompt")
+    parser.add_argument("--response-tokens", type=int, default=20, help="deterministic模式的回复长度（词数）")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="流式回复分成的块数")
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="批处理任务完成前的等待秒数")
+    parser.add_argument("--seed", type=int, help="随机种子（延迟和错误注入可复现）")
+    args = parser.parse_args(argv)
+    
+    config = MockConfig(args.latency, args.rate_429, args.rate_5xx, args.retry_after, args.mode,
+                        args.response_tokens, args.stream_chunks, args.batch_delay, args.seed, args.rate_bad_pack)
+    server = create_server(config, args.host, args.port)
+    print(f"模拟OpenAI服务已启动: {server.base_url}", flush=True)
+    print(f"延迟 {args.latency}，429比例 {args.rate_429}，5xx比例 {args.rate_5xx}，模式 {args.mode}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
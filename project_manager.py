@@ -7,14 +7,60 @@
 
 import json
 import os
+import stat
 import zipfile
 import tempfile
 from datetime import datetime
 import pandas as pd
+from result_journal import ResultJournal, get_journal_path
+
+def get_target_file_mode(file_path):
+    """
+    替换后文件应有的权限：覆盖时沿用原文件的权限，新文件按umask取默认权限
+    （mkstemp创建的临时文件只有所有者可读写）
+    """
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
 
 class ProjectManager:
     def __init__(self):
         self.project_format_version = "1.0"
+        # 当前项目的结果日志（未保存为项目文件时为None）
+        self.journal = None
+        # 分片项目的来源信息（普通项目为None），保存时原样写回，合并时用于定位原始行
+        self.shard_info = None
+        
+    def open_journal(self, file_path, table_manager):
+        """打开项目文件对应的结果日志"""
+        self.close_journal()
+        self.journal = ResultJournal(get_journal_path(file_path), table_manager)
+        return self.journal
+        
+    def close_journal(self):
+        """关闭当前结果日志（新建表格或导入数据时调用）"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            
+    def write_project_file(self, file_path, project_data):
+        """先写临时文件再原子替换，保存中途崩溃不会损坏原项目文件"""
+        directory = os.path.dirname(os.path.abspath(file_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".aie_save_", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(project_data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, get_target_file_mode(file_path))
+            os.replace(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
         
     def save_project(self, file_path, table_manager, ai_processor=None, column_widths=None):
         """
@@ -39,6 +85,7 @@ class ProjectManager:
                 # 表格数据
                 project_data["table_data"] = {
                     "columns": list(df.columns),
+                    "column_order": table_manager.get_column_names(),
                     "data": df.to_dict('records'),
                     "row_count": len(df),
                     "col_count": len(df.columns)
@@ -49,7 +96,8 @@ class ProjectManager:
                 project_data["ai_config"] = {
                     "ai_columns": ai_columns,
                     "ai_column_count": len(ai_columns),
-                    "prompt_templates": {}
+                    "prompt_templates": {},
+                    "fingerprints": table_manager.fingerprints.to_dict()
                 }
                 
                 # 保存每个AI列的详细配置
@@ -94,9 +142,14 @@ class ProjectManager:
                 project_data["normal_columns"] = []
                 project_data["ui_state"] = {}
             
+            if self.shard_info is not None:
+                project_data["shard_info"] = self.shard_info
+                
             # 保存项目文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(project_data, f, ensure_ascii=False, indent=2)
+            self.write_project_file(file_path, project_data)
+            
+            # 结果已写入项目文件，清空日志并从此记录到该项目的日志
+            self.open_journal(file_path, table_manager).clear()
                 
             return True, f"项目已保存到: {file_path}"
             
@@ -116,6 +169,7 @@ class ProjectManager:
             # 验证文件格式
             if project_data.get("format_version") != self.project_format_version:
                 return False, f"不支持的项目文件格式版本: {project_data.get('format_version')}"
+            self.shard_info = project_data.get("shard_info")
             
             # 恢复表格数据
             table_data = project_data.get("table_data")
@@ -128,19 +182,39 @@ class ProjectManager:
                     if expected_columns:
                         df = df.reindex(columns=expected_columns)
                     
-                    # 设置到table_manager
+                    # 设置到table_manager，恢复列的显示顺序（旧项目没有时按物理顺序）
                     table_manager.dataframe = df
+                    table_manager.column_order = None
+                    if table_data.get("column_order"):
+                        table_manager.set_column_order(table_data["column_order"])
                     
                     # 恢复AI列配置
                     ai_config = project_data.get("ai_config", {})
                     ai_columns = ai_config.get("ai_columns", {})
                     table_manager.ai_columns = ai_columns
                     
+                    # 重放结果日志：恢复上次崩溃或未保存前已完成的单元格
+                    journal = self.open_journal(file_path, table_manager)
+                    recovered_cells = []
+                    recovered = journal.replay(df, recovered_cells)
+                    
+                    # 单元格指纹：旧项目没有指纹时以现有结果为基准，从日志恢复的结果补记指纹
+                    table_manager.fingerprints.load_dict(ai_config.get("fingerprints"))
+                    for col_name in ai_columns:
+                        if not table_manager.fingerprints.has_column(col_name):
+                            table_manager.adopt_fingerprints(col_name)
+                        else:
+                            recovered_rows = sorted({row for row, col in recovered_cells if col == col_name})
+                            table_manager.adopt_fingerprints(col_name, recovered_rows)
+                    
                     # 恢复界面状态（可选）
                     ui_state = project_data.get("ui_state", {})
                     column_widths = ui_state.get("column_widths", {})
                     
-                    return True, f"项目加载成功: {len(df)}行 {len(df.columns)}列 (AI列: {len(ai_columns)})", column_widths
+                    message = f"项目加载成功: {len(df)}行 {len(df.columns)}列 (AI列: {len(ai_columns)})"
+                    if recovered:
+                        message += f"\n已从结果日志恢复 {recovered} 个未保存的AI结果"
+                    return True, message, column_widths
             else:
                 # 空项目
                 table_manager.create_blank_table()
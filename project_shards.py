@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目分片
+把.aie项目按行拆成N个分片（每个分片带完整的AI列配置），可在多台机器或多个进程中分别处理，
+处理完成后按稳定行键合并回原项目，并检测不同分片对同一单元格给出不同结果的冲突
+"""
+
+import os
+import pandas as pd
+from table_manager import TableManager
+from project_manager import ProjectManager
+from result_journal import get_key_columns, compute_row_keys
+
+SHARD_SUFFIX = ".shard-{index:02d}-of-{count:02d}.aie"
+
+def get_shard_path(project_path, index, count, output_dir=None):
+    """第index个分片的文件路径（index从1开始）"""
+    base = os.path.splitext(os.path.basename(project_path))[0]
+    directory = output_dir or os.path.dirname(os.path.abspath(project_path))
+    return os.path.join(directory, base + SHARD_SUFFIX.format(index=index, count=count))
+
+def is_empty_value(value):
+    """空值（None、NaN、空字符串）"""
+    if value is None:
+        return True
+    if isinstance(value, float) and pd.isna(value):
+        return True
+    return isinstance(value, str) and value.strip() == ""
+
+def same_value(a, b):
+    """两个单元格值是否相同（各种空值视为相同）"""
+    if is_empty_value(a) and is_empty_value(b):
+        return True
+    return not is_empty_value(a) and not is_empty_value(b) and str(a) == str(b)
+
+def split_project(project_path, shard_count, output_dir=None):
+    """
+    把项目按行轮流分配到shard_count个分片（各分片待处理的单元格数量接近）
+    返回 (是否成功, 消息, 分片路径列表)
+    """
+    if shard_count < 2:
+        return False, "分片数至少为2", []
+    
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    result = project_manager.load_project(project_path, table_manager)
+    if not result[0]:
+        return False, result[1], []
+    project_manager.close_journal()
+    
+    df = table_manager.get_dataframe()
+    if df is None or len(df) == 0:
+        return False, "项目没有数据", []
+    if project_manager.shard_info is not None:
+        return False, "该项目本身是分片，请对原项目分片", []
+    shard_count = min(shard_count, len(df))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    
+    source = os.path.abspath(project_path)
+    paths = []
+    for index in range(shard_count):
+        rows = list(range(index, len(df), shard_count))
+        shard_table = TableManager()
+        shard_table.dataframe = df.iloc[rows].reset_index(drop=True)
+        shard_table.ai_columns = table_manager.get_ai_columns()
+        shard_table.column_order = table_manager.column_order
+        shard_table.fingerprints = table_manager.fingerprints
+        
+        shard_manager = ProjectManager()
+        shard_manager.shard_info = {
+            "source": source,
+            "index": index + 1,
+            "count": shard_count,
+            "source_rows": rows
+        }
+        shard_path = get_shard_path(project_path, index + 1, shard_count, output_dir)
+        success, message = shard_manager.save_project(shard_path, shard_table)
+        shard_manager.close_journal()
+        if not success:
+            return False, message, paths
+        paths.append(shard_path)
+    
+    return True, f"已拆分为 {len(paths)} 个分片（{len(df)}行）", paths
+
+def merge_shards(project_path, shard_paths, output_path=None):
+    """
+    把处理完成的分片合并回原项目并原子保存
+    分片中的行优先按原始行号定位并校验行键，行号对不上时按行键查找；
+    只合并分片中发生变化的AI单元格，多个分片对同一单元格给出不同结果、或行无法唯一定位时记为冲突（保留原值）
+    返回 (是否成功, 消息, 冲突列表)
+    """
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    result = project_manager.load_project(project_path, table_manager)
+    if not result[0]:
+        return False, result[1], []
+    
+    df = table_manager.get_dataframe()
+    ai_columns = table_manager.get_ai_columns()
+    base_keys = compute_row_keys(df, get_key_columns(df, ai_columns))
+    rows_by_key = {}
+    for row, key in enumerate(base_keys):
+        rows_by_key.setdefault(key, []).append(row)
+    
+    conflicts = []
+    proposals = {}  # {(行, 列): {值: [分片名]}}
+    for shard_path in shard_paths:
+        shard_name = os.path.basename(shard_path)
+        shard_table = TableManager()
+        shard_manager = ProjectManager()
+        shard_result = shard_manager.load_project(shard_path, shard_table)
+        shard_manager.close_journal()
+        if not shard_result[0]:
+            return False, f"{shard_name}: {shard_result[1]}", conflicts
+        shard_info = shard_manager.shard_info or {}
+        shard_df = shard_table.get_dataframe()
+        source_rows = shard_info.get("source_rows", [])
+        if shard_df is None or len(shard_df) != len(source_rows):
+            return False, f"{shard_name}: 不是有效的分片或行数已改变", conflicts
+        
+        shard_keys = compute_row_keys(shard_df, get_key_columns(shard_df, ai_columns))
+        merge_columns = [column for column in ai_columns if column in shard_df.columns]
+        for shard_row, (source_row, key) in enumerate(zip(source_rows, shard_keys)):
+            if 0 <= source_row < len(df) and base_keys[source_row] == key:
+                target = source_row
+            else:
+                candidates = rows_by_key.get(key, [])
+                if len(candidates) != 1:
+                    conflicts.append({
+                        "shard": shard_name, "row": source_row, "column": None,
+                        "reason": "找不到对应的行" if not candidates else f"行键匹配到{len(candidates)}行"
+                    })
+                    continue
+                target = candidates[0]
+            for column in merge_columns:
+                value = shard_df.iat[shard_row, shard_df.columns.get_loc(column)]
+                if same_value(value, df.iat[target, df.columns.get_loc(column)]):
+                    continue
+                values = proposals.setdefault((target, column), {})
+                values.setdefault(None if is_empty_value(value) else str(value), []).append(shard_name)
+        table_manager.fingerprints.merge(shard_table.fingerprints)
+    
+    merged = 0
+    for (row, column), values in proposals.items():
+        if len(values) > 1:
+            conflicts.append({
+                "shard": ", ".join(name for names in values.values() for name in names),
+                "row": row, "column": column, "reason": f"{len(values)}个分片的结果不同"
+            })
+            continue
+        df.loc[row, column] = next(iter(values))
+        merged += 1
+    
+    save_path = output_path or project_path
+    success, message = project_manager.save_project(save_path, table_manager)
+    project_manager.close_journal()
+    if not success:
+        return False, message, conflicts
+    return True, f"已合并 {len(shard_paths)} 个分片，更新 {merged} 个单元格，冲突 {len(conflicts)} 处\n{message}", conflicts
+
+def format_conflict(conflict):
+    """冲突的提示文本"""
+    location = f"第{conflict['row'] + 1}行"
+    if conflict["column"]:
+        location += f" 列 {conflict['column']}"
+    return f"{location}: {conflict['reason']} ({conflict['shard']})"
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt模板
+将 {列名} 模板预先解析为文本片段和字段引用，
+支持只读取被引用的列，对整列进行向量化渲染
+"""
+
+import re
+from functools import lru_cache
+import numpy as np
+
+# 模板变量格式: {变量名}
+FIELD_PATTERN = re.compile(r'\{(\w+)\}')
+
+class PromptTemplate:
+    def __init__(self, template):
+        self.template = template if template is not None else ""
+        
+        # re.split带捕获组时，结果为 [文本, 字段, 文本, 字段, ..., 文本]
+        pieces = FIELD_PATTERN.split(self.template)
+        self.parts = []  # [(是否字段, 文本或字段名)]
+        for i, piece in enumerate(pieces):
+            if i % 2 == 1:
+                self.parts.append((True, piece))
+            elif piece:
+                self.parts.append((False, piece))
+        
+        # 引用的字段（去重，保持出现顺序）
+        self.fields = list(dict.fromkeys(piece for is_field, piece in self.parts if is_field))
+    
+    @staticmethod
+    def missing_field_text(field):
+        """模板引用了不存在的字段时的占位文本"""
+        return f"{{未找到字段: {field}}}"
+    
+    def render(self, row_data):
+        """用一行数据（字典）渲染prompt"""
+        output = []
+        for is_field, text in self.parts:
+            if is_field:
+                output.append(str(row_data[text]) if text in row_data else self.missing_field_text(text))
+            else:
+                output.append(text)
+        return "".join(output)
+    
+    def render_row(self, dataframe, row_index):
+        """渲染数据框中的一行，只读取模板引用的列"""
+        columns = dataframe.columns
+        row_data = {}
+        for field in self.fields:
+            if field in columns:
+                row_data[field] = dataframe.iat[row_index, columns.get_loc(field)]
+        return self.render(row_data)
+    
+    def render_rows(self, dataframe, row_indices=None):
+        """
+        向量化渲染多行prompt，只读取模板引用的列
+        row_indices为行位置列表，None表示全部行；返回与行顺序一致的字符串数组
+        """
+        row_count = len(dataframe) if row_indices is None else len(row_indices)
+        columns = dataframe.columns
+        
+        result = None
+        for is_field, text in self.parts:
+            if is_field and text in columns:
+                column = dataframe[text]
+                if row_indices is not None:
+                    column = column.iloc[row_indices]
+                values = column.to_numpy(dtype=object)
+                # 与逐行str()保持一致（NaN渲染为'nan'，None渲染为'None'）
+                piece = np.fromiter(map(str, values), dtype=object, count=row_count)
+            elif is_field:
+                piece = self.missing_field_text(text)
+            else:
+                piece = text
+            result = piece if result is None else result + piece
+        
+        if result is None or isinstance(result, str):
+            # 模板中没有引用任何列
+            return np.full(row_count, result or "", dtype=object)
+        return result
+
+@lru_cache(maxsize=256)
+def compile_template(template):
+    """解析模板（相同模板只解析一次）"""
+    return PromptTemplate(template)
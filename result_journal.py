@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果日志
+每个处理完成的AI单元格立即追加到项目文件旁的日志文件（.aie.journal），
+批量fsync保证崩溃或休眠后最多丢失最近一小段结果；打开项目时重放日志，保存项目后清空
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+JOURNAL_SUFFIX = ".journal"
+
+def get_journal_path(project_path):
+    """项目文件对应的日志文件路径"""
+    return project_path + JOURNAL_SUFFIX
+
+def compute_row_key(values):
+    """由一行中非AI列的值计算稳定行键"""
+    payload = json.dumps([str(value) for value in values], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def get_key_columns(dataframe, ai_columns):
+    """行键由非AI列的值决定，AI结果变化不影响行键"""
+    return [column for column in dataframe.columns if column not in ai_columns]
+
+def compute_row_keys(dataframe, key_columns):
+    """批量计算所有行的行键，返回与行顺序一致的列表"""
+    if not key_columns:
+        return [compute_row_key([])] * len(dataframe)
+    columns = [dataframe[column].to_numpy(dtype=object) for column in key_columns]
+    return [compute_row_key(values) for values in zip(*columns)]
+
+class ResultJournal:
+    def __init__(self, path, table_manager, batch_size=None, sync_interval=None):
+        self.path = path
+        self.table_manager = table_manager
+        self.batch_size = batch_size or int(os.getenv('AI_JOURNAL_BATCH', '50'))
+        self.sync_interval = sync_interval if sync_interval is not None else float(os.getenv('AI_JOURNAL_SYNC_INTERVAL', '1.0'))
+        self.lock = threading.Lock()
+        self.file = None
+        self.pending = 0
+        self.last_sync = time.monotonic()
+    
+    def row_key(self, dataframe, row_index, key_columns=None):
+        """计算一行的稳定行键（排序、插入行后仍能找到对应行）"""
+        if key_columns is None:
+            key_columns = get_key_columns(dataframe, self.table_manager.get_ai_columns())
+        return compute_row_key([dataframe.iat[row_index, dataframe.columns.get_loc(column)] for column in key_columns])
+    
+    def append(self, dataframe, row_index, column_name, value, model=None):
+        """追加一条单元格结果，达到批量大小或时间间隔时fsync"""
+        record = {
+            "row": int(row_index),
+            "key": self.row_key(dataframe, row_index),
+            "column": column_name,
+            "value": value,
+            "model": model,
+            "ts": time.time()
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.pending += 1
+            if self.pending >= self.batch_size or time.monotonic() - self.last_sync >= self.sync_interval:
+                self._sync()
+    
+    def _sync(self):
+        """把缓冲写入磁盘（调用方持有锁）"""
+        if self.file is None or self.pending == 0:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+    
+    def flush(self):
+        """立即fsync未落盘的记录"""
+        with self.lock:
+            self._sync()
+    
+    def read_records(self):
+        """读取日志记录，跳过崩溃时写了一半的行"""
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+    
+    def replay(self, dataframe, applied_cells=None):
+        """
+        把日志中的结果写回数据框，返回恢复的单元格数
+        优先按行号定位并校验行键，行号对不上时按行键查找（相同输入的行都会写入）
+        applied_cells为列表时追加恢复的 (行, 列)
+        """
+        records = self.read_records()
+        if not records:
+            return 0
+        
+        keys = compute_row_keys(dataframe, get_key_columns(dataframe, self.table_manager.get_ai_columns()))
+        rows_by_key = {}
+        for i, key in enumerate(keys):
+            rows_by_key.setdefault(key, []).append(i)
+        
+        applied = 0
+        for record in records:
+            column_name = record.get("column")
+            if column_name not in dataframe.columns:
+                continue
+            row_index = record.get("row", -1)
+            if 0 <= row_index < len(keys) and keys[row_index] == record.get("key"):
+                target_rows = [row_index]
+            else:
+                target_rows = rows_by_key.get(record.get("key"), [])
+            for target in target_rows:
+                dataframe.loc[target, column_name] = record.get("value")
+                applied += 1
+                if applied_cells is not None:
+                    applied_cells.append((target, column_name))
+        return applied
+    
+    def has_records(self):
+        """日志中是否有未保存的结果"""
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+    
+    def clear(self):
+        """项目保存后清空日志"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.pending = 0
+            if os.path.exists(self.path):
+                os.remove(self.path)
+    
+    def close(self):
+        """落盘并关闭日志文件"""
+        with self.lock:
+            self._sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -7,13 +7,51 @@
 
 import pandas as pd
 import os
+from cell_fingerprint import FingerprintStore, fingerprint_prompts
+from column_dag import find_cycle, format_cycle
+from prompt_template import compile_template
+
+# 变更通知类型，监听者以 (类型, 行, 列) 被调用
+CHANGE_CELL = "cell"        # 一个单元格的值改变（行、列）
+CHANGE_ROW = "row"          # 一行的值改变（行）
+CHANGE_COLUMN = "column"    # 一列的值或AI配置改变，列的位置不变（列）
+CHANGE_ROWS = "rows"        # 行的增加、删除或重排
+CHANGE_ORDER = "order"      # 列的显示顺序改变（数据框不变）
+CHANGE_TABLE = "table"      # 列的增加、删除、改名、移动或整个表格替换
 
 class TableManager:
     def __init__(self):
         self.dataframe = None
         self.ai_columns = {}  # {column_name: {"prompt": prompt_template, "model": model_name}}
         self.file_path = None
+        # AI结果的生成指纹，用于只重新处理输入、模板或模型变化的单元格
+        self.fingerprints = FingerprintStore()
+        # 数据变更的监听者（界面据此只刷新受影响的单元格、行或列）
+        self.listeners = []
+        # 列的逻辑（显示）顺序，None表示与数据框中的物理顺序相同；移动和插入列只修改该列表，不复制数据
+        self.column_order = None
         
+    def add_listener(self, callback):
+        """注册变更监听者 callback(类型, 行, 列)"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+            
+    def remove_listener(self, callback):
+        """移除变更监听者"""
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+            
+    def notify(self, kind, row=None, column=None):
+        """
+        发出变更通知（在调用线程中同步执行）
+        AI处理器、Batch API等直接写数据框的代码，写入后由界面线程调用此方法通知
+        """
+        for callback in list(self.listeners):
+            try:
+                callback(kind, row, column)
+            except Exception as e:
+                print(f"变更通知处理错误: {e}")
+                
     def create_blank_table(self):
         """创建空白表格"""
         try:
@@ -41,6 +79,9 @@ class TableManager:
             
             self.file_path = None
             self.ai_columns = {}
+            self.column_order = None
+            self.fingerprints.clear()
+            self.notify(CHANGE_TABLE)
             
             return True
             
@@ -75,9 +116,12 @@ class TableManager:
             self.file_path = file_path
             # 清空之前的AI列配置
             self.ai_columns = {}
+            self.column_order = None
+            self.fingerprints.clear()
             
             # 填充NaN值
             self.dataframe = self.dataframe.fillna('')
+            self.notify(CHANGE_TABLE)
             
             return True
             
@@ -125,26 +169,49 @@ class TableManager:
         return self.dataframe
         
     def get_column_names(self):
-        """获取列名列表"""
+        """获取列名列表（按显示顺序）"""
         if self.dataframe is not None:
+            if self.column_order is not None:
+                return list(self.column_order)
             return list(self.dataframe.columns)
         return []
         
+    def set_column_order(self, column_order):
+        """
+        设置列的显示顺序（必须恰好包含数据框的所有列），与物理顺序相同时清除
+        返回是否有效
+        """
+        if self.dataframe is None:
+            return False
+        column_order = list(column_order)
+        physical = list(self.dataframe.columns)
+        if sorted(map(str, column_order)) != sorted(map(str, physical)) or len(set(column_order)) != len(column_order):
+            print(f"无效的列顺序: {column_order}")
+            return False
+        self.column_order = None if column_order == physical else column_order
+        return True
+        
     def add_ai_column(self, column_name, prompt_template, model="gpt-4.1"):
         """添加AI列"""
         if self.dataframe is not None:
             # 添加空列到数据框
             self.dataframe[column_name] = ''
+            if self.column_order is not None:
+                self.column_order.append(column_name)
             # 保存AI列配置（包含模型信息）
             self.ai_columns[column_name] = {
                 "prompt": prompt_template,
                 "model": model
             }
+            self.notify(CHANGE_TABLE)
             
     def add_normal_column(self, column_name, default_value=''):
         """添加普通列"""
         if self.dataframe is not None:
             self.dataframe[column_name] = default_value
+            if self.column_order is not None:
+                self.column_order.append(column_name)
+            self.notify(CHANGE_TABLE)
             
     def add_row(self):
         """添加新行"""
@@ -156,6 +223,7 @@ class TableManager:
                 # 使用concat而不是append（pandas 2.0+推荐）
                 new_df = pd.DataFrame([new_row])
                 self.dataframe = pd.concat([self.dataframe, new_df], ignore_index=True)
+                self.notify(CHANGE_ROWS)
                 
                 return True
             except Exception as e:
@@ -167,7 +235,10 @@ class TableManager:
         """清空所有数据"""
         self.dataframe = None
         self.ai_columns = {}
+        self.column_order = None
         self.file_path = None
+        self.fingerprints.clear()
+        self.notify(CHANGE_TABLE)
         
     def get_ai_columns(self):
         """获取AI列配置"""
@@ -195,6 +266,64 @@ class TableManager:
                 return "gpt-4.1"
         return "gpt-4.1"
     
+    def get_ai_column_pack_size(self, column_name):
+        """获取AI列每次请求合并的行数（1为不打包）"""
+        config = self.ai_columns.get(column_name)
+        if isinstance(config, dict):
+            return config.get("pack_size", 1)
+        return 1
+    
+    def set_ai_column_pack_size(self, column_name, pack_size):
+        """设置AI列每次请求合并的行数"""
+        if column_name not in self.ai_columns:
+            print(f"AI列不存在: {column_name}")
+            return False
+        config = self.ai_columns[column_name]
+        if not isinstance(config, dict):
+            # 旧格式升级为字典配置
+            config = {"prompt": config, "model": "gpt-4.1"}
+        if pack_size > 1:
+            config["pack_size"] = int(pack_size)
+        else:
+            config.pop("pack_size", None)
+        self.ai_columns[column_name] = config
+        self.notify(CHANGE_COLUMN, column=column_name)
+        return True
+    
+    def adopt_fingerprints(self, column_name, row_indices=None):
+        """
+        把AI列中已有的结果登记为当前prompt生成的结果
+        用于没有指纹的旧项目和从结果日志恢复的单元格，空值和错误结果不登记
+        """
+        if self.dataframe is None or column_name not in self.ai_columns or column_name not in self.dataframe.columns:
+            return 0
+        if row_indices is None:
+            row_indices = list(range(len(self.dataframe)))
+        if not row_indices:
+            return 0
+        values = self.dataframe[column_name].iloc[row_indices]
+        text = values.map(str, na_action='ignore').str.strip()
+        done = (values.notna() & (text != "") & ~text.str.startswith("错误:").fillna(False)).to_numpy()
+        if not done.any():
+            return 0
+        done_rows = [row for row, is_done in zip(row_indices, done) if is_done]
+        prompts = compile_template(self.get_ai_column_prompt(column_name)).render_rows(self.dataframe, done_rows)
+        model = self.get_ai_column_model(column_name)
+        self.fingerprints.record(column_name, fingerprint_prompts(prompts, model))
+        return len(done_rows)
+    
+    def prune_fingerprints(self):
+        """删除行或列后清理指纹库：只保留当前表格中仍有单元格使用的 (模型, prompt) 指纹"""
+        if self.dataframe is None:
+            self.fingerprints.clear()
+            return
+        for column_name in list(self.fingerprints.columns):
+            if column_name not in self.ai_columns or column_name not in self.dataframe.columns:
+                self.fingerprints.delete_column(column_name)
+                continue
+            prompts = compile_template(self.get_ai_column_prompt(column_name)).render_rows(self.dataframe)
+            self.fingerprints.prune(column_name, fingerprint_prompts(prompts, self.get_ai_column_model(column_name)))
+    
     def get_ai_columns_simple(self):
         """获取简化的AI列配置（向后兼容）"""
         simple_config = {}
@@ -209,6 +338,15 @@ class TableManager:
         """更新AI列的值"""
         if self.dataframe is not None and column_name in self.dataframe.columns:
             self.dataframe.at[row_index, column_name] = value
+            self.notify(CHANGE_CELL, row_index, column_name)
+            
+    def set_cell_value(self, row_index, column_name, value):
+        """按行位置更新一个单元格的值并通知"""
+        if self.dataframe is not None and column_name in self.dataframe.columns:
+            self.dataframe.iloc[row_index, self.dataframe.columns.get_loc(column_name)] = value
+            self.notify(CHANGE_CELL, row_index, column_name)
+            return True
+        return False
             
     def get_row_data(self, row_index):
         """获取指定行的数据"""
@@ -222,25 +360,35 @@ class TableManager:
             return len(self.dataframe)
         return 0
         
-    def export_excel(self, file_path):
+    def get_export_dataframe(self, row_order=None):
+        """导出用的数据框：row_order为排序视图的行置换数组，None表示按数据框的行顺序"""
+        if row_order is None:
+            return self.dataframe
+        return self.dataframe.iloc[row_order]
+        
+    def export_excel(self, file_path, row_order=None):
         """导出Excel文件"""
         if self.dataframe is not None:
-            self.dataframe.to_excel(file_path, index=False)
+            self.get_export_dataframe(row_order).to_excel(file_path, index=False, columns=self.get_column_names())
             
-    def export_csv(self, file_path):
+    def export_csv(self, file_path, row_order=None):
         """导出CSV文件"""
         if self.dataframe is not None:
-            self.dataframe.to_csv(file_path, index=False, encoding='utf-8-sig')
+            self.get_export_dataframe(row_order).to_csv(file_path, index=False, encoding='utf-8-sig',
+                                                        columns=self.get_column_names())
             
-    def export_jsonl(self, file_path):
+    def export_jsonl(self, file_path, row_order=None):
         """导出JSONL文件"""
         if self.dataframe is not None:
             import json
             
+            column_order = self.column_order
             with open(file_path, 'w', encoding='utf-8') as f:
-                for _, row in self.dataframe.iterrows():
-                    # 将每行转换为字典，然后转换为JSON字符串
+                for _, row in self.get_export_dataframe(row_order).iterrows():
+                    # 将每行转换为字典（按显示顺序），然后转换为JSON字符串
                     row_dict = row.to_dict()
+                    if column_order is not None:
+                        row_dict = {col: row_dict[col] for col in column_order}
                     json_line = json.dumps(row_dict, ensure_ascii=False)
                     f.write(json_line + '\n')
                     
@@ -253,26 +401,32 @@ class TableManager:
             
             # 使用drop方法删除列，并直接赋值
             self.dataframe = self.dataframe.drop(columns=[column_name])
+            if self.column_order is not None:
+                self.column_order.remove(column_name)
             
             # 如果是AI列，也删除配置
             if column_name in self.ai_columns:
                 del self.ai_columns[column_name]
+                self.fingerprints.delete_column(column_name)
                 print(f"删除AI列配置: {column_name}")
+            # 引用被删除列的AI列的prompt随之改变，旧指纹不会再被用到
+            self.prune_fingerprints()
                 
-            print(f"删除后列名: {list(self.dataframe.columns)}")
+            print(f"删除后列名: {self.get_column_names()}")
+            self.notify(CHANGE_TABLE)
             return True
         else:
             print(f"列不存在或数据框为空: {column_name}")
             return False
             
-    def validate_prompt_template(self, prompt_template):
-        """验证prompt模板中的字段引用是否有效"""
+    def validate_prompt_template(self, prompt_template, column_name=None):
+        """验证prompt模板中的字段引用是否有效，指定AI列名时同时检查是否造成循环引用"""
         if self.dataframe is None:
             return False, "没有加载数据"
             
-        import re
+        from prompt_template import compile_template
         # 提取模板中的字段引用
-        field_refs = re.findall(r'\{(\w+)\}', prompt_template)
+        field_refs = compile_template(prompt_template).fields
         
         invalid_fields = []
         for field in field_refs:
@@ -282,6 +436,13 @@ class TableManager:
         if invalid_fields:
             return False, f"字段不存在: {', '.join(invalid_fields)}"
             
+        if column_name is not None:
+            ai_columns = dict(self.ai_columns)
+            ai_columns[column_name] = prompt_template
+            cycle = find_cycle(ai_columns)
+            if cycle:
+                return False, format_cycle(cycle)
+                
         return True, "模板有效"
         
     def rename_column(self, old_name, new_name):
@@ -290,15 +451,19 @@ class TableManager:
             try:
                 # 重命名DataFrame中的列
                 self.dataframe = self.dataframe.rename(columns={old_name: new_name})
+                if self.column_order is not None:
+                    self.column_order[self.column_order.index(old_name)] = new_name
                 
                 # 如果是AI列，也要更新AI配置
                 if old_name in self.ai_columns:
                     prompt = self.ai_columns[old_name]
                     del self.ai_columns[old_name]
                     self.ai_columns[new_name] = prompt
+                    self.fingerprints.rename_column(old_name, new_name)
                     print(f"AI列配置已更新: {old_name} → {new_name}")
                 
                 print(f"列重命名成功: {old_name} → {new_name}")
+                self.notify(CHANGE_TABLE)
                 return True
             except Exception as e:
                 print(f"重命名列失败: {e}")
@@ -312,6 +477,7 @@ class TableManager:
         if column_name in self.ai_columns:
             self.ai_columns[column_name] = new_prompt
             print(f"AI提示词已更新: {column_name}")
+            self.notify(CHANGE_COLUMN, column=column_name)
             return True
         else:
             print(f"AI列不存在: {column_name}")
@@ -320,11 +486,16 @@ class TableManager:
     def update_ai_column_config(self, column_name, new_prompt, new_model):
         """更新AI列的完整配置（包含模型）"""
         if column_name in self.ai_columns:
-            self.ai_columns[column_name] = {
+            # 保留打包等其他设置
+            old_config = self.ai_columns[column_name]
+            config = dict(old_config) if isinstance(old_config, dict) else {}
+            config.update({
                 "prompt": new_prompt,
                 "model": new_model
-            }
+            })
+            self.ai_columns[column_name] = config
             print(f"AI列配置已更新: {column_name} (模型: {new_model})")
+            self.notify(CHANGE_COLUMN, column=column_name)
             return True
         else:
             print(f"AI列不存在: {column_name}")
@@ -336,6 +507,7 @@ class TableManager:
             # 添加到AI列配置
             self.ai_columns[column_name] = prompt_template
             print(f"已转换为AI列: {column_name}")
+            self.notify(CHANGE_COLUMN, column=column_name)
             return True
         else:
             print(f"列不存在: {column_name}")
@@ -346,7 +518,9 @@ class TableManager:
         if column_name in self.ai_columns:
             # 从AI列配置中移除
             del self.ai_columns[column_name]
+            self.fingerprints.delete_column(column_name)
             print(f"已转换为普通列: {column_name}")
+            self.notify(CHANGE_COLUMN, column=column_name)
             return True
         else:
             print(f"AI列不存在: {column_name}")
@@ -356,20 +530,15 @@ class TableManager:
         """在指定位置插入列"""
         if self.dataframe is not None:
             try:
-                # 获取当前列名列表
-                columns = list(self.dataframe.columns)
+                # 获取当前列名列表（显示顺序）
+                columns = self.get_column_names()
                 
                 # 确保位置在有效范围内
                 position = max(0, min(position, len(columns)))
                 
-                # 创建新的列顺序
-                new_columns = columns[:position] + [column_name] + columns[position:]
-                
-                # 为新列添加空值
+                # 新列追加到数据框末尾，只在显示顺序中插入到指定位置（不复制已有数据）
                 self.dataframe[column_name] = ''
-                
-                # 重新排列列的顺序
-                self.dataframe = self.dataframe[new_columns]
+                self.set_column_order(columns[:position] + [column_name] + columns[position:])
                 
                 # 如果是AI列，添加到AI配置
                 if is_ai_column and prompt_template:
@@ -379,6 +548,7 @@ class TableManager:
                     }
                     
                 print(f"已在位置{position}插入列: {column_name}")
+                self.notify(CHANGE_TABLE)
                 return True
                 
             except Exception as e:
@@ -392,7 +562,7 @@ class TableManager:
         """移动列位置"""
         if self.dataframe is not None:
             try:
-                columns = list(self.dataframe.columns)
+                columns = self.get_column_names()
                 
                 # 检查索引有效性
                 if not (0 <= from_index < len(columns)):
@@ -413,10 +583,11 @@ class TableManager:
                 new_columns.pop(from_index)  # 移除原位置的列
                 new_columns.insert(to_index, column_to_move)  # 在新位置插入
                 
-                # 重新排列DataFrame的列
-                self.dataframe = self.dataframe[new_columns]
+                # 只修改显示顺序，数据框不变
+                self.set_column_order(new_columns)
                 
                 print(f"已移动列 '{column_to_move}' 从位置{from_index}到位置{to_index}")
+                self.notify(CHANGE_ORDER)
                 return True
                 
             except Exception as e:
@@ -437,8 +608,10 @@ class TableManager:
                     
                 # 删除指定行
                 self.dataframe = self.dataframe.drop(self.dataframe.index[row_index]).reset_index(drop=True)
+                self.prune_fingerprints()
                 
                 print(f"已删除第{row_index + 1}行")
+                self.notify(CHANGE_ROWS)
                 return True
                 
             except Exception as e:
@@ -475,6 +648,7 @@ class TableManager:
                 
                 self.dataframe = new_df
                 print(f"已在位置{position}插入新行")
+                self.notify(CHANGE_ROWS)
                 return True
                 
             except Exception as e:
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+表格视图
+排序只计算一个行置换数组（显示位置 -> 数据行号），数据框本身不变也不复制；
+各列的排序键按列缓存，多列排序用稳定的lexsort，排序、取消排序和排序状态下的编辑都不移动数据，
+后台任务按数据行号写回的结果总能落在正确的行上
+"""
+
+import numpy as np
+import pandas as pd
+from table_manager import CHANGE_CELL, CHANGE_ROW, CHANGE_COLUMN, CHANGE_ORDER
+
+def compute_sort_key(series):
+    """
+    一列的排序键：每个值在升序中的名次（相同的值名次相同），空值为-1
+    返回 (名次数组, 不同值的个数)
+    """
+    try:
+        codes, uniques = pd.factorize(series, sort=True)
+    except TypeError:
+        # 无法直接比较的值按文本比较
+        codes, uniques = pd.factorize(series.map(str, na_action='ignore'), sort=True)
+    return np.asarray(codes, dtype=np.int64), len(uniques)
+
+class TableView:
+    """
+    表格的排序视图
+    sort_keys为[(列名, 是否升序)]，第一个为主排序键；order为None时按数据框的行顺序显示
+    """
+    def __init__(self, table_manager):
+        self.table_manager = table_manager
+        self.sort_keys = []
+        self.order = None
+        self.key_cache = {}  # {列名: (名次数组, 不同值的个数)}
+        table_manager.add_listener(self.on_table_changed)
+    
+    def is_sorted(self):
+        return bool(self.sort_keys)
+    
+    def get_sort_position(self, column):
+        """列在排序键中的位置和方向 (序号, 是否升序)，不参与排序时返回None"""
+        for index, (key_column, ascending) in enumerate(self.sort_keys):
+            if key_column == column:
+                return index, ascending
+        return None
+    
+    def get_column_key(self, column):
+        """列的排序键（缓存，数据改变时由变更通知清除）"""
+        if column not in self.key_cache:
+            self.key_cache[column] = compute_sort_key(self.table_manager.get_dataframe()[column])
+        return self.key_cache[column]
+    
+    def sort(self, sort_keys):
+        """按多个排序键稳定排序（空值总在最后），只计算行置换数组"""
+        df = self.table_manager.get_dataframe()
+        self.sort_keys = [(column, ascending) for column, ascending in sort_keys
+                          if df is not None and column in df.columns]
+        if not self.sort_keys or len(df) == 0:
+            self.order = None
+            return
+        keys = []
+        for column, ascending in self.sort_keys:
+            codes, count = self.get_column_key(column)
+            ranks = codes if ascending else count - 1 - codes
+            keys.append(np.where(codes < 0, count, ranks))
+        # lexsort以最后一个键为主键，相同键值保持数据框中的顺序
+        self.order = np.lexsort(keys[::-1])
+    
+    def sort_by(self, column, ascending=True, append=False):
+        """按一列排序；append为True时作为次要排序键追加到已有排序之后"""
+        sort_keys = [key for key in self.sort_keys if key[0] != column] if append else []
+        self.sort(sort_keys + [(column, ascending)])
+    
+    def reset(self):
+        """恢复数据框的行顺序"""
+        self.sort_keys = []
+        self.order = None
+        self.key_cache.clear()
+    
+    def take(self, dataframe):
+        """按视图顺序排列的数据框（导出用），未排序时原样返回"""
+        if self.order is None:
+            return dataframe
+        return dataframe.iloc[self.order]
+    
+    def on_table_changed(self, kind, row=None, column=None):
+        """
+        数据变更：单元格和列的值改变只清除相应的排序键缓存，已显示的行不跳动（重新排序后生效）；
+        行数或表格结构改变时按当前排序键重新计算行置换
+        """
+        if kind == CHANGE_CELL or kind == CHANGE_COLUMN:
+            self.key_cache.pop(column, None)
+        elif kind == CHANGE_ROW:
+            self.key_cache.clear()
+        elif kind != CHANGE_ORDER:
+            self.key_cache.clear()
+            self.sort(self.sort_keys)
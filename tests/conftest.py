@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公用夹具：本地模拟OpenAI服务，以及连接到模拟服务的AIProcessor
+"""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_server import MockConfig, start_server
+from ai_processor import AIProcessor
+
+@pytest.fixture
+def mock_server():
+    """启动模拟服务的工厂，参数同MockConfig，测试结束后停止"""
+    servers = []
+    
+    def start(**options):
+        server = start_server(MockConfig(**options))
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def make_processor(monkeypatch, tmp_path):
+    """创建连接到模拟服务的AIProcessor（关闭响应缓存），其余关键字参数为额外的环境变量"""
+    processors = []
+    
+    def create(server, **env):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.delenv("AI_ENDPOINTS", raising=False)
+        monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+        monkeypatch.setenv("OPENAI_API_KEY", "mock")
+        monkeypatch.setenv("AI_CACHE", "0")
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        processor = AIProcessor()
+        processors.append(processor)
+        return processor
+    
+    yield create
+    for processor in processors:
+        processor.shutdown()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch API模式的提交、轮询和写回测试（使用本地模拟服务）
+"""
+
+import pandas as pd
+from batch_api import BatchAPIProcessor
+
+AI_COLUMNS = {
+    "a": {"prompt": "A {x}", "model": "mock"},
+    "b": {"prompt": "B {a}", "model": "mock"}
+}
+
+def make_table(rows):
+    return pd.DataFrame({
+        "x": [f"r{i}" for i in range(rows)],
+        "a": [""] * rows,
+        "b": [""] * rows
+    })
+
+def test_downstream_rows_wait_for_upstream_batch(mock_server, make_processor):
+    server = mock_server(mode="echo", batch_delay=0.1)
+    batch = BatchAPIProcessor(make_processor(server))
+    df = make_table(5)
+    
+    success, message = batch.run(df, AI_COLUMNS, poll_interval=0.05)
+    
+    assert success, message
+    assert df["a"].tolist() == [f"A r{i}" for i in range(5)]
+    # 上游结果写回之前下游单元格不提交
+    assert df["b"].tolist() == [""] * 5
+    assert [job["request_counts"]["total"] for job in server.state.batches.values()] == [5]
+    
+    success, message = batch.run(df, AI_COLUMNS, poll_interval=0.05)
+    
+    assert success, message
+    assert df["b"].tolist() == [f"B A r{i}" for i in range(5)]
+    
+    success, message = batch.run(df, AI_COLUMNS, poll_interval=0.05)
+    
+    assert (success, message) == (True, "没有待处理的单元格")
+
+def test_results_follow_rows_inserted_while_batch_runs(mock_server, make_processor):
+    server = mock_server(mode="echo", batch_delay=0.1)
+    batch = BatchAPIProcessor(make_processor(server))
+    df = make_table(3)
+    
+    batch_id, requests = batch.start(df, AI_COLUMNS)
+    assert len(requests) == 3
+    # 任务进行期间在表头插入一行
+    df = pd.concat([pd.DataFrame({"x": ["new"], "a": [""], "b": [""]}), df], ignore_index=True)
+    success, message = batch.finish(df, batch.wait(batch_id, 0.05), requests, AI_COLUMNS)
+    
+    assert success, message
+    assert df["a"].tolist() == ["", "A r0", "A r1", "A r2"]
+
+def test_failed_batch_requests_are_written_as_errors(mock_server, make_processor):
+    server = mock_server(batch_delay=0.1, rate_5xx=1.0)
+    batch = BatchAPIProcessor(make_processor(server))
+    df = make_table(2)
+    
+    success, message = batch.run(df, AI_COLUMNS, columns=["a"], poll_interval=0.05)
+    
+    assert success, message
+    assert "失败 2" in message
+    assert all(value.startswith("错误:") for value in df["a"])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单元格指纹与增量处理测试
+"""
+
+import pandas as pd
+from table_manager import TableManager
+
+def make_table_manager():
+    table_manager = TableManager()
+    table_manager.dataframe = pd.DataFrame({
+        "x": ["a", "b", "c", "a"],
+        "src": ["1", "2", "3", "4"],
+        "y": ["A", "B", "C", "A"]
+    })
+    table_manager.ai_columns = {"y": {"prompt": "Q {x} {src}", "model": "mock"}}
+    table_manager.adopt_fingerprints("y")
+    return table_manager
+
+def get_stale_rows(processor, table_manager):
+    processor.fingerprints = table_manager.fingerprints
+    return processor.get_stale_rows(table_manager.get_dataframe(), "y", table_manager.ai_columns["y"])
+
+def test_manual_edit_is_not_stale(mock_server, make_processor):
+    processor = make_processor(mock_server())
+    table_manager = make_table_manager()
+    assert get_stale_rows(processor, table_manager) == []
+    
+    table_manager.set_cell_value(1, "y", "手动修改")
+    assert get_stale_rows(processor, table_manager) == []
+    
+    # 输入变化的单元格才需要重新处理
+    table_manager.set_cell_value(2, "x", "z")
+    assert get_stale_rows(processor, table_manager) == [2]
+
+def test_deleting_rows_and_columns_prunes_fingerprints(mock_server, make_processor):
+    processor = make_processor(mock_server())
+    table_manager = make_table_manager()
+    assert len(table_manager.fingerprints.columns["y"]) == 4
+    
+    table_manager.delete_row(2)
+    assert len(table_manager.fingerprints.columns["y"]) == 3
+    assert get_stale_rows(processor, table_manager) == []
+    
+    # 模板引用的列被删除后prompt全部改变，旧指纹不再保留
+    table_manager.delete_column("src")
+    assert not table_manager.fingerprints.has_column("y")
+    assert get_stale_rows(processor, table_manager) == [0, 1, 2]
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AIProcessor.process_tasks 的调度测试（使用本地模拟服务）
+"""
+
+import pandas as pd
+import pytest
+
+def make_table(rows):
+    return pd.DataFrame({
+        "x": [f"r{i}" for i in range(rows)],
+        "a": [""] * rows,
+        "b": [""] * rows,
+        "c": [""] * rows
+    })
+
+def run_in_order(processor, df, ai_columns):
+    """处理全部任务，返回结果列表和按完成先后排列的列名"""
+    finished = []
+    results = processor.process_tasks(df, processor.build_tasks(df, ai_columns),
+                                      result_callback=lambda result: finished.append(result["column_name"]))
+    return results, finished
+
+def test_dependent_columns_pipeline_by_row(mock_server, make_processor):
+    server = mock_server(latency="0.01")
+    processor = make_processor(server, AI_MAX_CONCURRENCY=4, AI_INITIAL_CONCURRENCY=4)
+    df = make_table(60)
+    ai_columns = {
+        "a": {"prompt": "A {x}", "model": "mock"},
+        "b": {"prompt": "B {a}", "model": "mock"}
+    }
+    
+    results, finished = run_in_order(processor, df, ai_columns)
+    
+    assert all(result["success"] for result in results)
+    # 下游列在上游列全部完成之前就开始产出结果，而不是逐列处理
+    first_b = finished.index("b")
+    last_a = len(finished) - 1 - finished[::-1].index("a")
+    assert first_b < last_a
+    assert first_b < 10
+
+def test_independent_columns_interleave(mock_server, make_processor):
+    server = mock_server(latency="0.01")
+    processor = make_processor(server, AI_MAX_CONCURRENCY=4, AI_INITIAL_CONCURRENCY=4)
+    df = make_table(40)
+    ai_columns = {
+        "a": {"prompt": "A {x}", "model": "mock"},
+        "c": {"prompt": "C {x}", "model": "mock"}
+    }
+    
+    results, finished = run_in_order(processor, df, ai_columns)
+    
+    assert all(result["success"] for result in results)
+    # 互不依赖的两列同时推进：前一半完成的结果中两列都有
+    assert set(finished[:len(finished) // 2]) == {"a", "c"}
+
+def test_packed_downstream_pipelines_with_full_packs(mock_server, make_processor):
+    server = mock_server(latency="0.01")
+    processor = make_processor(server, AI_MAX_CONCURRENCY=4, AI_INITIAL_CONCURRENCY=4)
+    df = make_table(100)
+    ai_columns = {
+        "a": {"prompt": "A {x}", "model": "mock", "pack_size": 10},
+        "b": {"prompt": "B {a}", "model": "mock", "pack_size": 10}
+    }
+    
+    results, finished = run_in_order(processor, df, ai_columns)
+    
+    assert all(result["success"] for result in results)
+    # 下游单元格凑满一包才发送，打包节省的请求数不受流水线影响
+    assert processor.last_batch_stats["requests"] == 20
+    assert finished.index("b") < len(finished) - 1 - finished[::-1].index("a")
+
+def test_pack_size_is_capped_by_model_output_limit(mock_server, make_processor):
+    server = mock_server()
+    processor = make_processor(server)
+    df = make_table(64)
+    ai_columns = {"a": {"prompt": "A {x}", "model": "gpt-4.1", "pack_size": 100}}
+    
+    results, _ = run_in_order(processor, df, ai_columns)
+    
+    assert all(result["success"] for result in results)
+    # gpt-4.1单次最多输出32768个token，每行预留1000个，一包最多32行
+    assert processor.get_max_pack_size("gpt-4.1") == 32
+    assert processor.last_batch_stats["requests"] == 2
+
+def test_identical_prompts_are_sent_once(mock_server, make_processor):
+    server = mock_server()
+    processor = make_processor(server)
+    df = pd.DataFrame({"x": ["甲", "乙", "丙"] * 10, "a": [""] * 30})
+    
+    results, _ = run_in_order(processor, df, {"a": {"prompt": "A {x}", "model": "mock"}})
+    
+    assert all(result["success"] and result["shared"] for result in results)
+    assert processor.last_batch_stats == {"tasks": 30, "requests": 3, "saved_requests": 27}
+    assert server.state.stats["completions"] == 3
+    # 相同prompt的单元格得到同一个结果
+    assert df.groupby("x")["a"].nunique().eq(1).all()
+
+def test_malformed_pack_falls_back_to_single_requests(mock_server, make_processor):
+    server = mock_server(rate_bad_pack=1.0)
+    processor = make_processor(server)
+    df = make_table(20)
+    
+    results, _ = run_in_order(processor, df, {"a": {"prompt": "A {x}", "model": "mock", "pack_size": 10}})
+    
+    assert all(result["success"] for result in results)
+    # 两个包都返回了错误数量的元素，20个prompt改为逐个请求
+    assert server.state.stats["bad_packs"] == 2
+    assert processor.last_batch_stats["requests"] == 22
+    assert df["a"].tolist() == [server.state.answer("mock", f"A r{i}") for i in range(20)]
+
+def test_downstream_columns_render_upstream_results(mock_server, make_processor):
+    server = mock_server(mode="echo")
+    processor = make_processor(server)
+    df = make_table(10)
+    ai_columns = {
+        "c": {"prompt": "C {b}", "model": "mock"},
+        "b": {"prompt": "B {a}", "model": "mock"},
+        "a": {"prompt": "A {x}", "model": "mock"}
+    }
+    
+    results, finished = run_in_order(processor, df, ai_columns)
+    
+    assert all(result["success"] for result in results)
+    # 每行的下游单元格都在同一行的上游结果写回之后渲染
+    assert df["c"].tolist() == [f"C B A r{i}" for i in range(10)]
+
+def test_failed_upstream_marks_downstream_as_error(mock_server, make_processor):
+    server = mock_server(rate_5xx=1.0)
+    processor = make_processor(server, MAX_RETRIES=0)
+    df = make_table(3)
+    ai_columns = {
+        "a": {"prompt": "A {x}", "model": "mock"},
+        "b": {"prompt": "B {a}", "model": "mock"}
+    }
+    
+    results, _ = run_in_order(processor, df, ai_columns)
+    
+    assert not any(result["success"] for result in results)
+    # 下游单元格不发送请求
+    assert server.state.stats["server_errors"] == 3
+    assert all(value.startswith("错误: 依赖的列 a") for value in df["b"])
+
+def test_cyclic_columns_are_rejected(mock_server, make_processor):
+    processor = make_processor(mock_server())
+    df = make_table(2)
+    ai_columns = {
+        "a": {"prompt": "A {b}", "model": "mock"},
+        "b": {"prompt": "B {a}", "model": "mock"}
+    }
+    with pytest.raises(ValueError):
+        processor.process_tasks(df, processor.build_tasks(df, ai_columns))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目分片测试：拆分 -> 用命令行分别处理每个分片 -> 合并回原项目
+"""
+
+import pandas as pd
+import aie
+from table_manager import TableManager
+from project_manager import ProjectManager
+from project_shards import split_project, merge_shards
+
+AI_COLUMNS = {
+    "a": {"prompt": "A {x}", "model": "mock"},
+    "b": {"prompt": "B {a}", "model": "mock"}
+}
+
+def create_project(path, rows):
+    table_manager = TableManager()
+    table_manager.dataframe = pd.DataFrame({
+        "x": [f"r{i}" for i in range(rows)],
+        "a": [""] * rows,
+        "b": [""] * rows
+    })
+    table_manager.ai_columns = dict(AI_COLUMNS)
+    project_manager = ProjectManager()
+    success, message = project_manager.save_project(str(path), table_manager)
+    project_manager.close_journal()
+    assert success, message
+
+def load(path):
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    result = project_manager.load_project(str(path), table_manager)
+    project_manager.close_journal()
+    assert result[0], result[1]
+    return table_manager
+
+def test_split_run_merge_round_trip(mock_server, make_processor, tmp_path):
+    # 命令行处理使用与测试处理器相同的环境变量（模拟服务地址）
+    processor = make_processor(mock_server(mode="echo"))
+    path = tmp_path / "demo.aie"
+    create_project(path, 10)
+    
+    success, message, shard_paths = split_project(str(path), 3, str(tmp_path / "shards"))
+    
+    assert success, message
+    assert len(shard_paths) == 3
+    for shard_path in shard_paths:
+        assert aie.main(["run", shard_path, "--progress-interval", "60"]) == 0
+    
+    success, message, conflicts = merge_shards(str(path), shard_paths)
+    
+    assert success, message
+    assert conflicts == []
+    table_manager = load(path)
+    df = table_manager.get_dataframe()
+    assert df["b"].tolist() == [f"B A r{i}" for i in range(10)]
+    # 合并后的指纹覆盖所有分片的结果，没有需要重新处理的单元格
+    processor.fingerprints = table_manager.fingerprints
+    assert processor.build_stale_tasks(df, table_manager.get_ai_columns()) == []
+
+def test_conflicting_shard_results_keep_original_value(tmp_path):
+    path = tmp_path / "demo.aie"
+    create_project(path, 4)
+    _, _, shard_paths = split_project(str(path), 2)
+    
+    # 同一分片的两个副本对同一单元格给出不同结果
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    project_manager.load_project(shard_paths[0], table_manager)
+    copy_path = str(tmp_path / "copy.aie")
+    for save_path, value in [(shard_paths[0], "甲"), (copy_path, "乙")]:
+        table_manager.set_cell_value(0, "a", value)
+        success, message = project_manager.save_project(save_path, table_manager)
+        assert success, message
+    project_manager.close_journal()
+    
+    success, message, conflicts = merge_shards(str(path), shard_paths + [copy_path])
+    
+    assert success, message
+    assert [(conflict["row"], conflict["column"]) for conflict in conflicts] == [(0, "a")]
+    assert load(path).get_dataframe()["a"].tolist() == [""] * 4
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+结果日志测试：处理中途崩溃（未保存项目）后重新打开项目，从日志恢复已完成的结果
+"""
+
+import pandas as pd
+from table_manager import TableManager
+from project_manager import ProjectManager
+from result_journal import get_journal_path
+
+AI_COLUMNS = {"y": {"prompt": "Q {x}", "model": "mock"}}
+
+def create_project(path, rows):
+    """保存一个AI列全部待处理的项目，返回 (项目管理器, 表格管理器)"""
+    table_manager = TableManager()
+    table_manager.dataframe = pd.DataFrame({"x": [f"r{i}" for i in range(rows)], "y": [""] * rows})
+    table_manager.ai_columns = dict(AI_COLUMNS)
+    project_manager = ProjectManager()
+    success, message = project_manager.save_project(str(path), table_manager)
+    assert success, message
+    return project_manager, table_manager
+
+def process_without_saving(processor, project_manager, table_manager):
+    """处理全部单元格，结果只写入日志（模拟保存前崩溃：不保存项目也不关闭日志）"""
+    processor.journal = project_manager.journal
+    processor.fingerprints = table_manager.fingerprints
+    df = table_manager.get_dataframe()
+    results = processor.process_tasks(df, processor.build_tasks(df, AI_COLUMNS))
+    assert all(result["success"] for result in results)
+    return df["y"].tolist()
+
+def load(path):
+    table_manager = TableManager()
+    project_manager = ProjectManager()
+    result = project_manager.load_project(str(path), table_manager)
+    assert result[0], result[1]
+    return project_manager, table_manager, result[1]
+
+def test_replay_recovers_results_after_crash(mock_server, make_processor, tmp_path):
+    processor = make_processor(mock_server())
+    path = tmp_path / "demo.aie"
+    project_manager, table_manager = create_project(path, 8)
+    expected = process_without_saving(processor, project_manager, table_manager)
+    # 崩溃时写了一半的记录
+    with open(get_journal_path(str(path)), 'a', encoding='utf-8') as f:
+        f.write('{"row": 0, "key": "')
+    
+    project_manager, table_manager, message = load(path)
+    
+    assert "已从结果日志恢复 8 个" in message
+    assert table_manager.get_dataframe()["y"].tolist() == expected
+    # 恢复的结果登记了指纹，不会被当作过期重新处理
+    processor.fingerprints = table_manager.fingerprints
+    assert processor.build_stale_tasks(table_manager.get_dataframe(), AI_COLUMNS) == []
+    
+    # 保存后日志清空，再次打开不重复恢复
+    success, _ = project_manager.save_project(str(path), table_manager)
+    project_manager.close_journal()
+    assert success
+    _, table_manager, message = load(path)
+    assert "恢复" not in message
+    assert table_manager.get_dataframe()["y"].tolist() == expected
+
+def test_replay_locates_rows_by_key_after_rows_move(mock_server, make_processor, tmp_path):
+    processor = make_processor(mock_server())
+    path = tmp_path / "demo.aie"
+    project_manager, table_manager = create_project(path, 4)
+    expected = dict(zip(table_manager.get_dataframe()["x"],
+                        process_without_saving(processor, project_manager, table_manager)))
+    project_manager.close_journal()
+    
+    # 日志写入后项目文件中的行顺序改变（例如另一份副本排序后保存）
+    reordered = pd.DataFrame({"x": ["new", "r3", "r2", "r1", "r0"], "y": [""] * 5})
+    ProjectManager().write_project_file(str(path), {
+        "format_version": "1.0",
+        "table_data": {"columns": ["x", "y"], "data": reordered.to_dict('records')},
+        "ai_config": {"ai_columns": AI_COLUMNS}
+    })
+    
+    _, table_manager, message = load(path)
+    
+    df = table_manager.get_dataframe()
+    assert "已从结果日志恢复 4 个" in message
+    assert df["y"].tolist() == [""] + [expected[x] for x in ["r3", "r2", "r1", "r0"]]
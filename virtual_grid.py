@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+虚拟化表格
+Treeview中只保留可见行和少量预渲染行（item的iid就是数据行号），滚动时按滚动位置换入换出行，
+打开、滚动和刷新的开销只与可见行数有关，与表格总行数无关；
+排序视图以行置换数组给出每个显示位置对应的数据行
+"""
+
+import os
+import tkinter as tk
+import numpy as np
+
+# 单元格显示的最大字符数，超出部分以...结尾
+MAX_DISPLAY_LENGTH = 80
+
+# 高亮列两侧边线的颜色和宽度
+HIGHLIGHT_COLOR = '#3b82f6'
+HIGHLIGHT_WIDTH = 2
+
+def format_cell(value):
+    """单元格的显示文本（长文本截断）"""
+    text = str(value) if value is not None else ""
+    if len(text) > MAX_DISPLAY_LENGTH:
+        text = text[:MAX_DISPLAY_LENGTH - 3] + "..."
+    return text
+
+class VirtualGrid:
+    """
+    虚拟化的Treeview
+    垂直滚动条由本类接管：滚动位置对应显示位置的区间，只插入该区间的行；
+    数据行号与item一一对应（iid为行号字符串），行、item和显示位置之间的换算为O(1)
+    """
+    def __init__(self, tree, scrollbar, row_height=28, overscan=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.row_height = row_height
+        # 可见区域之外额外插入的行数，窗口变大时在下次刷新前也不会出现空白
+        self.overscan = overscan if overscan is not None else int(os.getenv('AI_GRID_OVERSCAN', '5'))
+        self.dataframe = None
+        self.order = None      # 显示位置 -> 数据行号，None表示按数据框顺序
+        self.positions = None  # 数据行号 -> 显示位置（order的逆置换）
+        self.first_row = 0
+        self.rows = range(0)  # 当前已插入Treeview的显示位置
+        self.selected_row = None
+        # 高亮列：在Treeview上方叠放两条竖线标出列的左右边界，不修改任何行
+        self.highlighted_column = None
+        self.highlight_lines = []
+        self.x_scrollbar = None
+        
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind("<Configure>", self.on_configure, add='+')
+        self.tree.bind("<<TreeviewSelect>>", self.on_select, add='+')
+        # 滚轮和键盘导航按数据行滚动，不使用Treeview自身的滚动
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(3))
+        self.tree.bind("<Up>", lambda event: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self.move_selection(1))
+        self.tree.bind("<Prior>", lambda event: self.move_selection(-self.get_visible_count()))
+        self.tree.bind("<Next>", lambda event: self.move_selection(self.get_visible_count()))
+        self.tree.bind("<Home>", lambda event: self.move_selection(-self.get_row_count()))
+        self.tree.bind("<End>", lambda event: self.move_selection(self.get_row_count()))
+    
+    def get_row_count(self):
+        """显示的总行数"""
+        if self.dataframe is None:
+            return 0
+        return len(self.dataframe) if self.order is None else len(self.order)
+    
+    def row_at(self, position):
+        """显示位置对应的数据行号"""
+        return position if self.order is None else int(self.order[position])
+    
+    def position_of(self, row):
+        """数据行号对应的显示位置（不在视图中时为-1）"""
+        return row if self.positions is None else int(self.positions[row])
+    
+    def get_visible_count(self):
+        """窗口中完整可见的行数（按Treeview高度和行高计算，表头按一行计）"""
+        height = self.tree.winfo_height()
+        if height <= 1:
+            # 尚未显示时按默认窗口大小估算
+            height = 600
+        return max(1, height // self.row_height - 1)
+    
+    def on_configure(self, event=None):
+        """窗口大小改变：可见行数和高亮边线位置随之改变"""
+        self.render()
+        self.update_highlight()
+    
+    def set_row_height(self, row_height):
+        """行高改变后可见行数随之改变"""
+        self.row_height = row_height
+        self.render()
+    
+    def set_dataframe(self, dataframe, order=None):
+        """显示新的数据框（或列、行顺序发生变化），重新插入当前窗口的行"""
+        self.dataframe = dataframe
+        self.order = order
+        self.positions = None
+        if order is not None:
+            # 不在视图中的行位置为-1
+            self.positions = np.full(len(dataframe), -1, dtype=np.int64)
+            self.positions[order] = np.arange(len(order))
+        if self.selected_row is not None and self.selected_row >= self.get_row_count():
+            self.selected_row = None
+        self.render(force=True)
+    
+    def row_of(self, item):
+        """item对应的行号"""
+        return int(item)
+    
+    def item_of(self, row):
+        """行号对应的item，行不在当前窗口中时返回None"""
+        return str(row) if self.position_of(row) in self.rows else None
+    
+    def get_selected_row(self):
+        """选中的行号（选中行滚出窗口后仍保留），没有选中时返回None"""
+        selection = self.tree.selection()
+        if selection:
+            return self.row_of(selection[0])
+        return self.selected_row
+    
+    def on_select(self, event=None):
+        selection = self.tree.selection()
+        if selection:
+            self.selected_row = self.row_of(selection[0])
+    
+    def get_row_tags(self, position):
+        """行的样式标签：按显示位置的斑马纹"""
+        return ('odd_row' if position % 2 == 0 else 'even_row',)
+    
+    def take_rows(self, start, stop):
+        """显示位置start到stop对应的数据行（未排序时为切片）"""
+        if self.order is None:
+            return slice(start, stop)
+        return self.order[start:stop]
+    
+    def format_rows(self, start, stop):
+        """显示位置start到stop的各行显示值"""
+        if start >= stop:
+            return []
+        values = self.dataframe.iloc[self.take_rows(start, stop)].to_numpy(dtype=object)
+        return [tuple(format_cell(value) for value in row) for row in values]
+    
+    def insert_rows(self, start, stop, index):
+        """把显示位置start到stop的行插入到Treeview的index位置"""
+        for offset, values in enumerate(self.format_rows(start, stop)):
+            position = start + offset
+            tree_index = "end" if index == "end" else index + offset
+            self.tree.insert("", tree_index, iid=str(self.row_at(position)), values=values,
+                             tags=self.get_row_tags(position))
+    
+    def render(self, force=False):
+        """
+        按first_row插入可见区间的行：与上次区间重叠时只删除滚出的行、插入滚入的行，
+        force为True时（数据框或列改变）清空后重新插入
+        """
+        total = self.get_row_count()
+        visible = self.get_visible_count()
+        first = max(0, min(self.first_row, total - visible))
+        new_rows = range(first, min(total, first + visible + self.overscan))
+        old_rows = self.rows
+        
+        if force or new_rows.start >= old_rows.stop or new_rows.stop <= old_rows.start:
+            children = self.tree.get_children()
+            if children:
+                self.tree.delete(*children)
+            self.rows = new_rows
+            self.insert_rows(new_rows.start, new_rows.stop, "end")
+        else:
+            # 删除滚出的行
+            removed = [str(self.row_at(position)) for position in old_rows
+                       if position < new_rows.start or position >= new_rows.stop]
+            if removed:
+                self.tree.delete(*removed)
+            # 在顶部和底部插入滚入的行
+            self.rows = new_rows
+            self.insert_rows(new_rows.start, min(new_rows.stop, old_rows.start), 0)
+            self.insert_rows(max(new_rows.start, old_rows.stop), new_rows.stop, "end")
+        
+        self.first_row = first
+        # 选中的行滚回窗口时恢复选中状态
+        if self.selected_row is not None and self.position_of(self.selected_row) in new_rows and not self.tree.selection():
+            self.tree.selection_set(str(self.selected_row))
+        self.tree.yview_moveto(0)
+        if total:
+            self.scrollbar.set(first / total, min(1.0, (first + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def refresh(self):
+        """数据改变后刷新当前窗口中各行的显示值"""
+        if self.dataframe is None:
+            return
+        for offset, values in enumerate(self.format_rows(self.rows.start, self.rows.stop)):
+            self.tree.item(str(self.row_at(self.rows.start + offset)), values=values)
+    
+    def refresh_row(self, row):
+        """刷新一行（不在窗口中时无需处理）"""
+        position = self.position_of(row)
+        if position in self.rows:
+            self.tree.item(str(row), values=self.format_rows(position, position + 1)[0])
+    
+    def refresh_cell(self, row, column):
+        """从数据框刷新一个单元格（不在窗口中时无需处理）"""
+        if self.position_of(row) in self.rows and column in self.dataframe.columns:
+            value = self.dataframe.iat[row, self.dataframe.columns.get_loc(column)]
+            self.tree.set(str(row), column, format_cell(value))
+    
+    def refresh_column(self, column):
+        """从数据框刷新窗口中一列的显示值"""
+        if self.dataframe is None or column not in self.dataframe.columns:
+            return
+        values = self.dataframe.iloc[self.take_rows(self.rows.start, self.rows.stop),
+                                     self.dataframe.columns.get_loc(column)]
+        for offset, value in enumerate(values.to_numpy(dtype=object)):
+            self.tree.set(str(self.row_at(self.rows.start + offset)), column, format_cell(value))
+    
+    def set_cell(self, row, column, text):
+        """只更新一个单元格的显示（不在窗口中时无需处理）"""
+        if self.position_of(row) in self.rows:
+            self.tree.set(str(row), column, format_cell(text))
+    
+    def set_x_scrollbar(self, scrollbar):
+        """接管水平滚动条，水平滚动或列宽改变时同步移动高亮边线"""
+        self.x_scrollbar = scrollbar
+        self.tree.configure(xscrollcommand=self.on_xscroll)
+    
+    def on_xscroll(self, first, last):
+        if self.x_scrollbar is not None:
+            self.x_scrollbar.set(first, last)
+        self.update_highlight()
+    
+    def get_display_columns(self):
+        """当前按显示顺序排列的列"""
+        display = self.tree["displaycolumns"]
+        if not display or display[0] == "#all":
+            return list(self.tree["columns"])
+        return list(display)
+    
+    def highlight_column(self, column):
+        """高亮一列：开销只与列数有关，与行数无关"""
+        self.highlighted_column = column
+        if not self.highlight_lines:
+            self.highlight_lines = [tk.Frame(self.tree, bg=HIGHLIGHT_COLOR, width=HIGHLIGHT_WIDTH) for _ in range(2)]
+        self.update_highlight()
+    
+    def clear_highlight(self):
+        """取消列高亮"""
+        self.highlighted_column = None
+        for line in self.highlight_lines:
+            line.place_forget()
+    
+    def update_highlight(self):
+        """按列宽和水平滚动位置重新放置高亮边线"""
+        if self.highlighted_column is None or not self.highlight_lines:
+            return
+        columns = self.get_display_columns()
+        if self.highlighted_column not in columns:
+            self.clear_highlight()
+            return
+        widths = [int(self.tree.column(column, "width")) for column in columns]
+        index = columns.index(self.highlighted_column)
+        offset = float(self.tree.xview()[0]) * sum(widths)
+        left = sum(widths[:index]) - offset
+        right = left + widths[index]
+        tree_width = self.tree.winfo_width()
+        for line, x in zip(self.highlight_lines, (left, right - HIGHLIGHT_WIDTH)):
+            if 0 <= x <= tree_width:
+                line.place(x=int(x), y=0, relheight=1.0)
+                line.lift()
+            else:
+                line.place_forget()
+    
+    def scroll(self, delta):
+        """向下（正数）或向上滚动若干行"""
+        self.first_row += delta
+        self.render()
+        return "break"
+    
+    def see(self, row):
+        """滚动到该行可见"""
+        position = self.position_of(row)
+        visible = self.get_visible_count()
+        if position < self.first_row:
+            self.first_row = position
+        elif position >= self.first_row + visible:
+            self.first_row = position - visible + 1
+        self.render()
+    
+    def select_row(self, row):
+        """选中一行并滚动到可见"""
+        total = self.get_row_count()
+        if total == 0:
+            return
+        row = max(0, min(row, total - 1))
+        self.selected_row = row
+        self.see(row)
+        self.tree.selection_set(str(row))
+        self.tree.focus(str(row))
+    
+    def move_selection(self, delta):
+        """键盘按显示顺序移动选中行"""
+        current = self.get_selected_row()
+        position = self.first_row if current is None else self.position_of(current)
+        position = max(0, min(position + delta, self.get_row_count() - 1))
+        if self.get_row_count():
+            self.select_row(self.row_at(position))
+        return "break"
+    
+    def on_mouse_wheel(self, event):
+        # Windows每格delta为120，macOS为较小的整数
+        steps = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        return self.scroll(-3 * steps)
+    
+    def yview(self, *args):
+        """滚动条回调：拖动（moveto）或点击箭头/空白处（scroll）"""
+        total = self.get_row_count()
+        if not args or total == 0:
+            return
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * total)
+            self.render()
+        elif args[0] == "scroll":
+            count = int(args[1])
+            if args[2] == "pages":
+                count *= self.get_visible_count()
+            self.scroll(count)